@@ -1,6 +1,8 @@
 import os
 from pathlib import Path
-from mongoengine import  connect
+from corsheaders.defaults import default_headers
+from core.db import mongo_uri, register_mongo, check_read_preference
+from core.metrics import mongo_listener
 from datetime import timedelta
 
 BASE_DIR = Path(__file__).resolve().parent.parent
@@ -25,6 +27,7 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'core.middleware.MetricsMiddleware',
     'corsheaders.middleware.CorsMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
@@ -40,6 +43,9 @@ CORS_ALLOWED_ORIGINS = [
     "http://127.0.0.1:3000",
 ]
 
+CORS_EXPOSE_HEADERS = ['X-Next-Cursor', 'Server-Timing', 'ETag']
+CORS_ALLOW_HEADERS = (*default_headers, 'if-none-match')
+
 ROOT_URLCONF = 'backend.urls'
 
 TEMPLATES = [
@@ -70,10 +76,38 @@ MONGO_DB_CONFIG = {
     'PORT': os.environ.get('MONGO_DB_PORT'),
 }
 
-# Connect to MongoDB using MongoEngine
-if all(MONGO_DB_CONFIG.values()):
-    connect(
-        host=f"mongodb://{MONGO_DB_CONFIG['USER']}:{MONGO_DB_CONFIG['PASSWORD']}@{MONGO_DB_CONFIG['HOST']}:{MONGO_DB_CONFIG['PORT']}/{MONGO_DB_CONFIG['NAME']}?authSource=admin"
+# MONGO_URI (e.g. a replica set with ?replicaSet=...) takes precedence over the MONGO_DB_* parts
+MONGO_URI = os.environ.get('MONGO_URI', '')
+
+# Client pool and timeouts, per process (see core.db)
+MONGO_MAX_POOL_SIZE = int(os.environ.get('MONGO_MAX_POOL_SIZE', 100))
+MONGO_MIN_POOL_SIZE = int(os.environ.get('MONGO_MIN_POOL_SIZE', 0))
+MONGO_MAX_IDLE_TIME_MS = int(os.environ.get('MONGO_MAX_IDLE_TIME_MS', 60000))
+MONGO_WAIT_QUEUE_TIMEOUT_MS = int(os.environ.get('MONGO_WAIT_QUEUE_TIMEOUT_MS', 10000))
+MONGO_CONNECT_TIMEOUT_MS = int(os.environ.get('MONGO_CONNECT_TIMEOUT_MS', 5000))
+MONGO_SERVER_SELECTION_TIMEOUT_MS = int(os.environ.get('MONGO_SERVER_SELECTION_TIMEOUT_MS', 5000))
+MONGO_SOCKET_TIMEOUT_MS = int(os.environ.get('MONGO_SOCKET_TIMEOUT_MS', 0))  # 0: no timeout
+# Wire compression, e.g. 'zstd,zlib' (zstd needs the optional 'zstandard' package)
+MONGO_COMPRESSORS = os.environ.get('MONGO_COMPRESSORS', '')
+
+# Search and export may read from secondaries lagging at most this much (at least 90; 0 for no bound)
+MONGO_READ_PREFERENCE = os.environ.get('MONGO_READ_PREFERENCE', 'secondaryPreferred')
+MONGO_MAX_STALENESS_SECONDS = int(os.environ.get('MONGO_MAX_STALENESS_SECONDS', 90))
+check_read_preference(MONGO_READ_PREFERENCE, MONGO_MAX_STALENESS_SECONDS)
+
+# Register the connection; each process connects on its first query
+if MONGO_URI or all(MONGO_DB_CONFIG.values()):
+    register_mongo(
+        MONGO_URI or mongo_uri(*(MONGO_DB_CONFIG[key] for key in ('USER', 'PASSWORD', 'HOST', 'PORT', 'NAME'))),
+        event_listeners=[mongo_listener],  # per-request query counts and latency (core.metrics)
+        compressors=MONGO_COMPRESSORS,
+        socket_timeout_ms=MONGO_SOCKET_TIMEOUT_MS,
+        maxPoolSize=MONGO_MAX_POOL_SIZE,
+        minPoolSize=MONGO_MIN_POOL_SIZE,
+        maxIdleTimeMS=MONGO_MAX_IDLE_TIME_MS,
+        waitQueueTimeoutMS=MONGO_WAIT_QUEUE_TIMEOUT_MS,
+        connectTimeoutMS=MONGO_CONNECT_TIMEOUT_MS,
+        serverSelectionTimeoutMS=MONGO_SERVER_SELECTION_TIMEOUT_MS,
     )
 else:
     raise ValueError("MongoDB configuration is incomplete.")
@@ -128,6 +162,10 @@ REST_FRAMEWORK = {
    
 }
 
+# Keyset pagination for list endpoints (see core.pagination)
+PAGE_SIZE = int(os.environ.get('PAGE_SIZE', 50))
+MAX_PAGE_SIZE = int(os.environ.get('MAX_PAGE_SIZE', 200))
+
 
 SIMPLE_JWT = {
     'USER_ID_FIELD': 'id',  
@@ -137,3 +175,123 @@ SIMPLE_JWT = {
 }
 
 AUTHENTICATION_BACKENDS = ['core.custom_auth.MongoBackend']
+
+
+# Groq client configuration (one pooled client per process, see core.llm)
+GROQ_API_KEY = os.environ.get('GROQ_API_KEY')
+GROQ_BASE_URL = os.environ.get('GROQ_BASE_URL') or None  # e.g. a local stub: http://127.0.0.1:8001
+GROQ_MAX_CONNECTIONS = int(os.environ.get('GROQ_MAX_CONNECTIONS', 500))
+GROQ_MAX_KEEPALIVE_CONNECTIONS = int(os.environ.get('GROQ_MAX_KEEPALIVE_CONNECTIONS', 100))
+GROQ_KEEPALIVE_EXPIRY = float(os.environ.get('GROQ_KEEPALIVE_EXPIRY', 30))
+GROQ_CONNECT_TIMEOUT = float(os.environ.get('GROQ_CONNECT_TIMEOUT', 5))
+GROQ_TIMEOUT = float(os.environ.get('GROQ_TIMEOUT', 60))
+GROQ_MAX_RETRIES = int(os.environ.get('GROQ_MAX_RETRIES', 2))
+GROQ_RETRY_BACKOFF = float(os.environ.get('GROQ_RETRY_BACKOFF', 0.5))
+GROQ_RETRY_BACKOFF_MAX = float(os.environ.get('GROQ_RETRY_BACKOFF_MAX', 8))
+
+
+
+# Conversation context sent with each chat turn (see core.context)
+CHAT_CONTEXT_MAX_TOKENS = int(os.environ.get('CHAT_CONTEXT_MAX_TOKENS', 4096))
+CHAT_CONTEXT_MAX_MESSAGES = int(os.environ.get('CHAT_CONTEXT_MAX_MESSAGES', 50))
+CHAT_CONTEXT_BATCH_SIZE = int(os.environ.get('CHAT_CONTEXT_BATCH_SIZE', 10))
+
+# Rolling thread summaries (see core.summaries)
+CHAT_SUMMARY_ENABLED = os.environ.get('CHAT_SUMMARY_ENABLED', 'True').lower() == 'true'
+CHAT_SUMMARY_TRIGGER_MESSAGES = int(os.environ.get('CHAT_SUMMARY_TRIGGER_MESSAGES', 20))
+CHAT_SUMMARY_KEEP_RECENT = int(os.environ.get('CHAT_SUMMARY_KEEP_RECENT', 6))
+CHAT_SUMMARY_MODEL = os.environ.get('CHAT_SUMMARY_MODEL', 'llama-3.1-8b-instant')
+CHAT_SUMMARY_MAX_TOKENS = int(os.environ.get('CHAT_SUMMARY_MAX_TOKENS', 400))
+CHAT_SUMMARY_WORKERS = int(os.environ.get('CHAT_SUMMARY_WORKERS', 2))
+
+# Per-process caches for authenticated users and their Settings (see core.cache)
+USER_CACHE_TTL = float(os.environ.get('USER_CACHE_TTL', 300))
+USER_CACHE_SIZE = int(os.environ.get('USER_CACHE_SIZE', 10000))
+SETTINGS_CACHE_TTL = float(os.environ.get('SETTINGS_CACHE_TTL', 300))
+SETTINGS_CACHE_SIZE = int(os.environ.get('SETTINGS_CACHE_SIZE', 10000))
+# 'mongo' tells every worker on every host (polled); 'multicast' only other workers on this host,
+# best effort; 'local' only this process, so use it only with a single worker process
+CACHE_INVALIDATION_BUS = os.environ.get('CACHE_INVALIDATION_BUS', 'mongo')
+CACHE_INVALIDATION_POLL_INTERVAL = float(os.environ.get('CACHE_INVALIDATION_POLL_INTERVAL', 1))
+CACHE_INVALIDATION_ADDRESS = os.environ.get('CACHE_INVALIDATION_ADDRESS', '239.255.42.99:50099')
+
+# Opt-in cache of LLM responses for identical prompts (see core.response_cache): '', 'memory' or 'mongo'
+RESPONSE_CACHE_BACKEND = os.environ.get('RESPONSE_CACHE_BACKEND', '')
+RESPONSE_CACHE_TTL = int(os.environ.get('RESPONSE_CACHE_TTL', 86400))
+RESPONSE_CACHE_SIZE = int(os.environ.get('RESPONSE_CACHE_SIZE', 10000))
+
+# Model routing (see core.routing): fallback sibling per model, circuit breakers and hedging
+MODEL_FALLBACKS = {
+    'gemma-7b-it': 'gemma2-9b-it',
+    'gemma2-9b-it': 'llama3-8b-8192',
+    'llama-3.1-70b-versatile': 'llama-3.1-8b-instant',
+    'llama-3.1-8b-instant': 'llama3-8b-8192',
+    'llama-3.2-11b-text-preview': 'llama-3.1-8b-instant',
+    'llama-3.2-1b-preview': 'llama-3.2-3b-preview',
+    'llama-3.2-3b-preview': 'llama-3.1-8b-instant',
+    'llama-3.2-90b-text-preview': 'llama-3.1-70b-versatile',
+    'llama3-8b-8192': 'llama-3.1-8b-instant',
+}
+CIRCUIT_FAILURE_THRESHOLD = int(os.environ.get('CIRCUIT_FAILURE_THRESHOLD', 5))
+CIRCUIT_RESET_TIMEOUT = float(os.environ.get('CIRCUIT_RESET_TIMEOUT', 30))
+ROUTER_LATENCY_WINDOW = int(os.environ.get('ROUTER_LATENCY_WINDOW', 200))
+ROUTER_HEDGE_ENABLED = os.environ.get('ROUTER_HEDGE_ENABLED', 'False').lower() == 'true'
+ROUTER_HEDGE_MIN_SAMPLES = int(os.environ.get('ROUTER_HEDGE_MIN_SAMPLES', 20))
+ROUTER_HEDGE_WORKERS = int(os.environ.get('ROUTER_HEDGE_WORKERS', 64))
+
+# Per-user rate limits and rolling 24h token quotas (see core.quotas); 0 disables a quota
+RATE_LIMIT_REQUESTS_PER_MINUTE = float(os.environ.get('RATE_LIMIT_REQUESTS_PER_MINUTE', 20))
+RATE_LIMIT_BURST = int(os.environ.get('RATE_LIMIT_BURST', 10))
+DAILY_TOKEN_QUOTA = int(os.environ.get('DAILY_TOKEN_QUOTA', 500000))
+MODEL_DAILY_TOKEN_QUOTAS = {
+    'llama-3.1-70b-versatile': 200000,
+    'llama-3.2-90b-text-preview': 200000,
+}
+USAGE_FLUSH_INTERVAL = float(os.environ.get('USAGE_FLUSH_INTERVAL', 10))
+USAGE_REFRESH_INTERVAL = float(os.environ.get('USAGE_REFRESH_INTERVAL', 60))
+USAGE_RETENTION_DAYS = int(os.environ.get('USAGE_RETENTION_DAYS', 35))
+
+# ChatMessage persistence (see core.writebehind): 'sync' saves before responding, 'async' queues the write
+CHAT_WRITE_MODE = os.environ.get('CHAT_WRITE_MODE', 'sync')
+CHAT_WRITE_QUEUE_SIZE = int(os.environ.get('CHAT_WRITE_QUEUE_SIZE', 10000))
+CHAT_WRITE_BATCH_SIZE = int(os.environ.get('CHAT_WRITE_BATCH_SIZE', 200))
+CHAT_WRITE_FLUSH_INTERVAL = float(os.environ.get('CHAT_WRITE_FLUSH_INTERVAL', 0.05))
+CHAT_WRITE_ENQUEUE_TIMEOUT = float(os.environ.get('CHAT_WRITE_ENQUEUE_TIMEOUT', 0.5))
+
+# History search (see core.search): 'mongo' uses text indexes, 'local' an in-process inverted index
+SEARCH_BACKEND = os.environ.get('SEARCH_BACKEND', 'mongo')
+SEARCH_THREAD_LIMIT = int(os.environ.get('SEARCH_THREAD_LIMIT', 5))
+# Seconds before the local index rebuilds a user's entries, picking up imports and deletions from other processes
+SEARCH_INDEX_TTL = int(os.environ.get('SEARCH_INDEX_TTL', 600))
+# Bulk export/import of chat history (see core.transfer); zstd needs the optional 'zstandard' package
+EXPORT_BATCH_SIZE = int(os.environ.get('EXPORT_BATCH_SIZE', 1000))
+EXPORT_COMPRESSION = os.environ.get('EXPORT_COMPRESSION', 'gzip')
+IMPORT_BATCH_SIZE = int(os.environ.get('IMPORT_BATCH_SIZE', 1000))
+
+# Cold storage for idle threads (see core.archive): 'mongo' keeps them in a compressed archive collection, 'files' on disk
+ARCHIVE_IDLE_DAYS = int(os.environ.get('ARCHIVE_IDLE_DAYS', 180))
+ARCHIVE_BACKEND = os.environ.get('ARCHIVE_BACKEND', 'mongo')
+ARCHIVE_DIRECTORY = os.environ.get('ARCHIVE_DIRECTORY', str(BASE_DIR / 'archive'))
+ARCHIVE_PART_BYTES = int(os.environ.get('ARCHIVE_PART_BYTES', 4 * 1024 * 1024))
+
+# Cascade deletes (see core.deletion): larger deletions run in the background and report progress
+DELETE_INLINE_MESSAGES = int(os.environ.get('DELETE_INLINE_MESSAGES', 2000))
+DELETE_BATCH_SIZE = int(os.environ.get('DELETE_BATCH_SIZE', 5000))
+DELETE_WORKERS = int(os.environ.get('DELETE_WORKERS', 2))
+DELETION_JOB_RETENTION_DAYS = int(os.environ.get('DELETION_JOB_RETENTION_DAYS', 7))
+
+# Instrumentation (see core.metrics): Server-Timing response headers, and an optional bearer token for /metrics
+SERVER_TIMING_ENABLED = os.environ.get('SERVER_TIMING_ENABLED', 'False').lower() == 'true'
+METRICS_TOKEN = os.environ.get('METRICS_TOKEN', '')
+
+# Bounded pool for password hashing during login/registration bursts (see core.passwords); 0 hashes inline
+PASSWORD_HASH_WORKERS = int(os.environ.get('PASSWORD_HASH_WORKERS', 0))
+
+# WebSocket chat (see core.websocket); served by backend.asgi
+WS_MAX_CONNECTIONS = int(os.environ.get('WS_MAX_CONNECTIONS', 20000))
+WS_AUTH_TIMEOUT = float(os.environ.get('WS_AUTH_TIMEOUT', 10))
+WS_STATE_TTL = float(os.environ.get('WS_STATE_TTL', 60))
+
+# Batch chat (see core.batch): items per request, and completions in flight per batch
+BATCH_MAX_ITEMS = int(os.environ.get('BATCH_MAX_ITEMS', 50))
+BATCH_CONCURRENCY = int(os.environ.get('BATCH_CONCURRENCY', 8))
@@ -0,0 +1,172 @@
+"""Tiered retention: move the messages of idle threads out of the hot collections.
+
+``archive_thread`` copies a thread's messages into cold storage, marks the thread with
+``archived_at``/``archive_location`` and deletes the messages from ChatMessage. The ChatThread
+document stays behind as a stub carrying its title, summary and sidebar counters, so listings
+are unaffected. Reading or continuing the thread calls ``rehydrate_thread``, which puts the
+messages back with their original ids and slugs.
+
+Messages are stored as BSON, so types round-trip exactly, and zlib-compressed. With
+``ARCHIVE_BACKEND = 'mongo'`` they go to the ThreadArchive collection, split into parts of at
+most ``ARCHIVE_PART_BYTES`` before compression. With ``'files'`` they are written to
+``ARCHIVE_DIRECTORY/<user id>/<thread id>.bson.gz``.
+"""
+import gzip
+import os
+import zlib
+from datetime import datetime
+import bson
+from django.conf import settings
+from pymongo.errors import BulkWriteError
+from core.models import ChatThread, ChatMessage, ThreadArchive
+from core.search import unindex_messages, unindex_user
+
+DUPLICATE_KEY = 11000
+FILE_PREFIX = 'file:'
+
+
+def _split(messages, limit):
+    part, size = [], 0
+    for message in messages:
+        data = bson.encode(message)
+        if part and size + len(data) > limit:
+            yield part
+            part, size = [], 0
+        part.append(data)
+        size += len(data)
+    if part:
+        yield part
+
+
+class MongoArchiveStore:
+    def write(self, thread_id, user_id, messages):
+        parts = [
+            {
+                'thread': thread_id,
+                'user': user_id,
+                'part': i,
+                'message_count': len(part),
+                'data': bson.Binary(zlib.compress(b"".join(part))),
+                'created_at': datetime.utcnow(),
+            }
+            for i, part in enumerate(_split(messages, settings.ARCHIVE_PART_BYTES))
+        ]
+        if parts:
+            ThreadArchive._get_collection().insert_many(parts)
+        return 'mongo'
+
+    def read(self, thread_id, location):
+        for row in ThreadArchive.objects(thread=thread_id).order_by('part').batch_size(1).as_pymongo():
+            yield from bson.decode_all(zlib.decompress(row['data']))
+
+    def delete(self, thread_id, location):
+        ThreadArchive._get_collection().delete_many({'thread': thread_id})
+
+
+class FileArchiveStore:
+    def __init__(self, directory):
+        self.directory = directory
+
+    def write(self, thread_id, user_id, messages):
+        folder = os.path.join(self.directory, str(user_id))
+        os.makedirs(folder, exist_ok=True)
+        path = os.path.join(folder, f"{thread_id}.bson.gz")
+        with gzip.open(path + '.tmp', 'wb') as f:
+            for message in messages:
+                f.write(bson.encode(message))
+        os.replace(path + '.tmp', path)
+        return FILE_PREFIX + path
+
+    def read(self, thread_id, location):
+        path = location[len(FILE_PREFIX):]
+        if not os.path.exists(path):
+            return
+        with gzip.open(path, 'rb') as f:
+            yield from bson.decode_file_iter(f)
+
+    def delete(self, thread_id, location):
+        try:
+            os.remove(location[len(FILE_PREFIX):])
+        except FileNotFoundError:
+            pass
+
+
+def get_archive_store(location=None):
+    """The store that holds ``location``, or the configured store for new archives."""
+    if location is None:
+        location = 'files' if settings.ARCHIVE_BACKEND == 'files' else 'mongo'
+    if location == 'files' or location.startswith(FILE_PREFIX):
+        return FileArchiveStore(settings.ARCHIVE_DIRECTORY)
+    return MongoArchiveStore()
+
+
+def archive_thread(thread_id):
+    """Move one idle thread's messages to cold storage.
+
+    Returns the number of messages moved, or None if the thread was already archived or changed.
+
+    The thread is only marked if it saw no new activity while its messages were copied, and
+    only the copied messages are deleted, so a concurrent chat turn is never lost.
+    """
+    thread = ChatThread.objects(id=thread_id, archived_at=None).only('user', 'last_message_at').as_pymongo().first()
+    if thread is None:
+        return None
+    messages = list(
+        ChatMessage.objects(thread=thread_id).order_by('timestamp')
+        .batch_size(settings.EXPORT_BATCH_SIZE).as_pymongo()
+    )
+
+    store = get_archive_store()
+    location = store.write(thread_id, thread.get('user'), messages)
+    marked = ChatThread.objects(
+        id=thread_id, archived_at=None, last_message_at=thread.get('last_message_at')
+    ).update_one(set__archived_at=datetime.utcnow(), set__archive_location=location)
+    if not marked:
+        store.delete(thread_id, location)
+        return None
+
+    ids = [message['_id'] for message in messages]
+    for start in range(0, len(ids), 1000):
+        ChatMessage._get_collection().delete_many({'_id': {'$in': ids[start:start + 1000]}})
+    unindex_messages(thread.get('user'), ids)
+    return len(ids)
+
+
+def archived_messages(thread_id, location):
+    """Iterate an archived thread's messages (raw documents, oldest first) without restoring them."""
+    return get_archive_store(location).read(thread_id, location)
+
+
+def rehydrate_thread(chat_thread):
+    """Restore an archived thread's messages into ChatMessage; a no-op for live threads."""
+    if not chat_thread.archived_at:
+        return chat_thread
+
+    location = chat_thread.archive_location or 'mongo'
+    store = get_archive_store(location)
+    batch = []
+    for message in store.read(chat_thread.id, location):
+        batch.append(message)
+        if len(batch) >= settings.IMPORT_BATCH_SIZE:
+            _restore(batch)
+            batch = []
+    _restore(batch)
+
+    ChatThread.objects(id=chat_thread.id).update_one(unset__archived_at=True, unset__archive_location=True)
+    store.delete(chat_thread.id, location)
+    # Restored messages keep their old ids, which the local index's catch-up does not look at
+    unindex_user(chat_thread.to_mongo().get('user'))
+    chat_thread.archived_at = None
+    chat_thread.archive_location = None
+    return chat_thread
+
+
+def _restore(messages):
+    if not messages:
+        return
+    try:
+        ChatMessage._get_collection().insert_many(messages, ordered=False)
+    except BulkWriteError as e:
+        # Another request restored the same thread concurrently
+        if any(error.get('code') != DUPLICATE_KEY for error in e.details.get('writeErrors', [])):
+            raise
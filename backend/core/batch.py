@@ -0,0 +1,187 @@
+"""Batch chat: many questions in one request (``/api/threads/chat/batch/``).
+
+The batch counts as one request against the rate limit of each model it uses, so it is
+accepted or rejected as a whole (RateLimited) before any thread is created; each item still
+checks the daily token quotas. Threads and Settings are resolved once for the whole batch.
+The items then run concurrently, with at most ``BATCH_CONCURRENCY`` completions in flight, so
+the request takes about as long as its slowest item. Answered items are persisted with a single ``insert_many`` (see
+core.writebehind.persist_chat_messages). Results come back in request order, each with either
+its message or its error.
+
+Items run side by side, so items sent to the same thread do not see each other's answers
+in their context.
+"""
+import asyncio
+from functools import partial
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from rest_framework import status
+from core.archive import rehydrate_thread
+from core.chat import resolve_chat_thread, get_user_settings
+from core.context import build_chat_messages
+from core.metrics import span
+from core.models import ChatThread, ChatMessage, Settings
+from core.quotas import limiter, RateLimited
+from core.response_cache import response_cache_key, lookup_cached_response, store_cached_response, cache_metadata
+from core.routing import router, AllModelsFailed
+from core.search import index_chat_message
+from core.serializers import ChatMessageSerializer, prefetch_references
+from core.singleflight import chat_completions
+from core.writebehind import prepare_chat_message, persist_chat_messages
+
+MODEL_CHOICES = {choice for choice, _ in Settings.model_choices}
+
+# Per-item Mongo work (context, cache, quotas) runs on the default pool so items overlap
+run_sync = partial(sync_to_async, thread_sensitive=False)
+
+
+class BatchItemError(Exception):
+    def __init__(self, status, error, retry_after=None):
+        super().__init__(error)
+        self.status = status
+        self.error = error
+        self.retry_after = retry_after
+
+
+def parse_items(data):
+    """Validate a batch body; returns ``[{question, slug, model}, ...]`` or raises ValueError."""
+    items = data.get('items') if isinstance(data, dict) else None
+    if not isinstance(items, list) or not items:
+        raise ValueError("'items' must be a non-empty list.")
+    if len(items) > settings.BATCH_MAX_ITEMS:
+        raise ValueError(f"A batch may contain at most {settings.BATCH_MAX_ITEMS} items.")
+
+    parsed = []
+    for i, item in enumerate(items):
+        if not isinstance(item, dict) or not isinstance(item.get('question'), str) or not item['question']:
+            raise ValueError(f"Item {i}: question is required.")
+        model = item.get('model')
+        if model is not None and model not in MODEL_CHOICES:
+            raise ValueError(f"Item {i}: unknown model {model!r}.")
+        parsed.append({'question': item['question'], 'slug': item.get('slug') or None, 'model': model})
+    return parsed
+
+
+def resolve_threads(user, items):
+    """Return one ``(thread, new_thread_created)`` or BatchItemError per item.
+
+    Named threads are loaded with a single query. Items without a slug go through
+    ``resolve_chat_thread`` in order, so two of them with the same title share one new thread.
+    """
+    with span('thread'):
+        slugs = {item['slug'] for item in items if item['slug']}
+        threads = {thread.slug: thread for thread in ChatThread.objects(slug__in=list(slugs), user=user)} if slugs else {}
+    # The results are serialized on the event loop, where dereferencing thread.user would block
+    prefetch_references(threads.values(), ['user'], known=[user])
+    for thread in threads.values():
+        rehydrate_thread(thread)
+
+    resolved = []
+    for item in items:
+        if item['slug']:
+            thread = threads.get(item['slug'])
+            resolved.append((thread, False) if thread else BatchItemError(status.HTTP_404_NOT_FOUND, 'ChatThread does not exist.'))
+        else:
+            resolved.append(resolve_chat_thread(user, item['question']))
+    return resolved
+
+
+async def _answer(user, user_settings, item, chat_thread, new_thread_created, semaphore):
+    model_choice, max_tokens = item['model'] or user_settings.model, user_settings.max_tokens
+    try:
+        await run_sync(limiter.check_quota)(user.id, model_choice)
+    except RateLimited as e:
+        raise BatchItemError(status.HTTP_429_TOO_MANY_REQUESTS, e.detail, e.retry_after)
+
+    with span('context'):
+        messages = await run_sync(build_chat_messages)(
+            chat_thread, item['question'], user_settings.customize_response, model_choice, max_tokens,
+            include_history=not new_thread_created
+        )
+    cache_key, cached = await run_sync(lookup_cached_response)(user_settings, messages, model_choice, max_tokens)
+    if cached:
+        return cached["response"], model_choice, cached
+
+    async with semaphore:
+        with span('llm'):
+            try:
+                completion = await chat_completions.ado(
+                    response_cache_key(messages, model_choice, max_tokens),
+                    lambda: router.acomplete(messages, model_choice, max_tokens)
+                )
+            except AllModelsFailed as e:
+                print(f"Error generating AI response: {str(e)}")
+                completion = None
+    if not completion or not completion.content:
+        raise BatchItemError(status.HTTP_502_BAD_GATEWAY, 'Failed to generate a valid response.')
+    limiter.record_completion(user.id, completion, messages)
+    await run_sync(store_cached_response)(cache_key, completion.content, model_choice)
+    return completion.content, model_choice, None
+
+
+def _save(answered):
+    """Persist ``[(index, chat_thread, chat_message), ...]``; returns the indexes that failed."""
+    with span('save'):
+        for _, _, chat_message in answered:
+            prepare_chat_message(chat_message)
+        failed = persist_chat_messages([(chat_message, chat_thread) for _, chat_thread, chat_message in answered])
+        for position, (_, _, chat_message) in enumerate(answered):
+            if position not in failed:
+                index_chat_message(chat_message)
+    return {answered[position][0] for position in failed}
+
+
+def _error_result(index, error):
+    result = {"index": index, "ok": False, "status": error.status, "error": error.error}
+    if error.retry_after is not None:
+        result["retry_after"] = error.retry_after
+    return result
+
+
+async def run_batch(user, items):
+    """Answer every item of a parsed batch; returns the per-item results in request order.
+
+    Raises RateLimited if the batch does not fit the user's request rate.
+    """
+    user_settings = await sync_to_async(get_user_settings)(user)
+    await run_sync(limiter.take_requests)(user.id, [item['model'] or user_settings.model for item in items])
+    resolved = await sync_to_async(resolve_threads)(user, items)
+    semaphore = asyncio.Semaphore(settings.BATCH_CONCURRENCY)
+
+    pending = {
+        index: _answer(user, user_settings, item, thread[0], thread[1], semaphore)
+        for index, (item, thread) in enumerate(zip(items, resolved))
+        if not isinstance(thread, BatchItemError)
+    }
+    outcomes = dict(zip(pending, await asyncio.gather(*pending.values(), return_exceptions=True)))
+
+    results, answered = [None] * len(items), []
+    for index, (item, thread) in enumerate(zip(items, resolved)):
+        outcome = outcomes.get(index, thread)
+        if isinstance(outcome, BatchItemError):
+            results[index] = _error_result(index, outcome)
+        elif isinstance(outcome, Exception):
+            print(f"Error in batch chat item {index}: {str(outcome)}")
+            results[index] = _error_result(index, BatchItemError(status.HTTP_500_INTERNAL_SERVER_ERROR, 'Failed to generate a valid response.'))
+        else:
+            response, model_choice, cached = outcome
+            chat_thread, new_thread_created = thread
+            chat_message = ChatMessage(thread=chat_thread, user=user, message=item['question'], response=response)
+            answered.append((index, chat_thread, chat_message))
+            results[index] = {
+                "index": index,
+                "ok": True,
+                "status": status.HTTP_201_CREATED,
+                "thread_slug": chat_thread.slug,
+                "new_thread_created": new_thread_created,
+                "model": model_choice,
+                "cache": cache_metadata(cached),
+            }
+
+    failed = await sync_to_async(_save)(answered) if answered else set()
+    for index, _, chat_message in answered:
+        if index in failed:
+            results[index] = _error_result(index, BatchItemError(status.HTTP_500_INTERNAL_SERVER_ERROR, 'Failed to save the response.'))
+        else:
+            results[index]["data"] = ChatMessageSerializer(chat_message).data
+    return results
@@ -0,0 +1,223 @@
+"""Offline benchmark harness for the chat API.
+
+Requests go through Django's test client, so the full middleware, authentication and view
+stack is measured without a network server. The LLM is the local Groq stub (core.groq_stub)
+and data lives in a scratch MongoDB database, or in mongomock when it is installed and
+requested. Each scenario reports latency percentiles, throughput and Mongo commands per
+request, which the ``benchmark`` management command checks against stored thresholds.
+"""
+import random
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+import mongoengine
+from bson import ObjectId
+from django.conf import settings
+from django.test import Client
+from django.utils.text import slugify
+from pymongo import monitoring
+from rest_framework_simplejwt.tokens import RefreshToken
+from core.ids import prefixed_slug
+from core.models import User, Settings, ChatThread, ChatMessage, PREVIEW_LENGTH
+
+DATASETS = {
+    # name: (threads, messages per thread)
+    'small': (20, 10),
+    'medium': (200, 50),
+    'large': (1000, 200),
+}
+SCENARIOS = ('threads', 'history', 'chat', 'login', 'register')
+BENCHMARK_PASSWORD = 'benchmark-password'
+IGNORED_COMMANDS = {'hello', 'ismaster', 'isMaster', 'ping', 'endSessions', 'saslStart', 'saslContinue'}
+
+
+class QueryCounter(monitoring.CommandListener):
+    """Counts Mongo commands issued by the current thread."""
+
+    def __init__(self):
+        self._local = threading.local()
+
+    @property
+    def count(self):
+        return getattr(self._local, 'count', 0)
+
+    def reset(self):
+        self._local.count = 0
+
+    def started(self, event):
+        if event.command_name not in IGNORED_COMMANDS:
+            self._local.count = self.count + 1
+
+    def succeeded(self, event):
+        pass
+
+    def failed(self, event):
+        pass
+
+
+def connect_benchmark_db(uri, mock=False, counter=None):
+    """Point the default mongoengine alias at the benchmark database and empty it."""
+    mongoengine.disconnect()
+    if mock:
+        import mongomock  # optional dev dependency
+        connection = mongoengine.connect(host=uri, mongo_client_class=mongomock.MongoClient)
+    else:
+        connection = mongoengine.connect(host=uri, event_listeners=[counter] if counter else [])
+    db = mongoengine.get_db()
+    if 'bench' not in db.name:
+        raise ValueError(f"Refusing to wipe database '{db.name}': benchmark database names must contain 'bench'.")
+    connection.drop_database(db.name)
+    return db
+
+
+def seed(thread_count, messages_per_thread, batch_size=5000):
+    """Create a benchmark user with ``thread_count`` threads of ``messages_per_thread`` messages."""
+    user = User(username='benchmark', email='benchmark@example.com', password=BENCHMARK_PASSWORD)
+    user.save()
+    Settings.objects.create(user=user, model='llama3-8b-8192', max_tokens=200)
+
+    now = datetime.utcnow()
+    slugs = []
+    threads, messages = [], []
+    for t in range(thread_count):
+        thread_id = ObjectId()
+        started = now - timedelta(days=thread_count - t)
+        title = f"Benchmark thread {t}"
+        slugs.append(prefixed_slug(slugify(title)))
+        threads.append({
+            '_id': thread_id, 'user': user.id, 'title': title, 'slug': slugs[-1], 'created_at': started,
+            'message_count': messages_per_thread,
+            'last_message_at': started + timedelta(seconds=messages_per_thread),
+            'last_message_preview': f"Question {messages_per_thread - 1}"[:PREVIEW_LENGTH],
+        })
+        for m in range(messages_per_thread):
+            question = f"Question {m} about topic {random.randint(0, 999)}"
+            messages.append({
+                '_id': ObjectId(), 'thread': thread_id, 'user': user.id, 'message': question,
+                'response': " ".join(f"token{i}" for i in range(60)),
+                'timestamp': started + timedelta(seconds=m + 1),
+                'slug': prefixed_slug(slugify(question[:30])),
+            })
+            if len(messages) >= batch_size:
+                ChatMessage._get_collection().insert_many(messages, ordered=False)
+                messages = []
+    if threads:
+        ChatThread._get_collection().insert_many(threads, ordered=False)
+    if messages:
+        ChatMessage._get_collection().insert_many(messages, ordered=False)
+    for document_class in (User, Settings, ChatThread, ChatMessage):
+        document_class.ensure_indexes()
+    return user, slugs
+
+
+def percentile(sorted_values, p):
+    if not sorted_values:
+        return None
+    k = (len(sorted_values) - 1) * p / 100
+    low = int(k)
+    high = min(low + 1, len(sorted_values) - 1)
+    return sorted_values[low] + (sorted_values[high] - sorted_values[low]) * (k - low)
+
+
+class Worker:
+    """One simulated client: its own test client and its position in the history it is paging."""
+
+    def __init__(self, token, slugs):
+        self.client = Client(headers={'Authorization': f'Bearer {token}'})
+        self.slugs = slugs
+        self.history = None  # (slug, cursor) of the next history page
+
+    def threads(self, i):
+        return self.client.get('/api/threads/', {'limit': settings.PAGE_SIZE})
+
+    def history_page(self, i):
+        if self.history is None:
+            self.history = (random.choice(self.slugs), None)
+        slug, cursor = self.history
+        params = {'cursor': cursor} if cursor else {}
+        response = self.client.get(f'/api/threads/{slug}/messages/', params)
+        next_cursor = response.headers.get('X-Next-Cursor')
+        self.history = (slug, next_cursor) if next_cursor else None
+        return response
+
+    def chat(self, i):
+        return self.client.post('/api/threads/chat/', {
+            'question': f"Benchmark question {i} {random.random()}",
+            'slug': random.choice(self.slugs),
+        }, content_type='application/json')
+
+    def login(self, i):
+        return self.client.post('/api/login/', {
+            'username': 'benchmark', 'password': BENCHMARK_PASSWORD,
+        }, content_type='application/json')
+
+    def register(self, i):
+        password = f"pw-{uuid.uuid4().hex}"
+        return self.client.post('/api/register/', {
+            'username': f"bench-{uuid.uuid4().hex[:12]}", 'email': f"bench-{uuid.uuid4().hex[:12]}@example.com",
+            'password': password, 'retype_password': password,
+        }, content_type='application/json')
+
+
+def run_scenario(name, token, slugs, requests, concurrency, counter=None):
+    workers = [Worker(token, slugs) for _ in range(concurrency)]
+    action = {'threads': 'threads', 'history': 'history_page', 'chat': 'chat', 'login': 'login', 'register': 'register'}[name]
+    latencies, queries, errors = [], [], 0
+    lock = threading.Lock()
+
+    def run(worker_index):
+        nonlocal errors
+        worker = workers[worker_index]
+        for i in range(worker_index, requests, concurrency):
+            if counter:
+                counter.reset()
+            start = time.perf_counter()
+            response = getattr(worker, action)(i)
+            elapsed = time.perf_counter() - start
+            with lock:
+                latencies.append(elapsed)
+                if counter:
+                    queries.append(counter.count)
+                if response.status_code >= 400:
+                    errors += 1
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        list(executor.map(run, range(concurrency)))
+    duration = time.perf_counter() - started
+
+    latencies.sort()
+    return {
+        "requests": len(latencies),
+        "errors": errors,
+        "rps": round(len(latencies) / duration, 1) if duration else None,
+        "p50_ms": round(percentile(latencies, 50) * 1000, 2),
+        "p95_ms": round(percentile(latencies, 95) * 1000, 2),
+        "p99_ms": round(percentile(latencies, 99) * 1000, 2),
+        "queries_per_request": round(sum(queries) / len(queries), 2) if queries else None,
+    }
+
+
+def access_token(user):
+    return str(RefreshToken.for_user(user).access_token)
+
+
+def check_thresholds(results, thresholds):
+    """Failures as readable strings; ``thresholds`` maps scenario -> {p95_ms, p99_ms, min_rps, max_queries, max_error_rate}."""
+    failures = []
+    for scenario, result in results.items():
+        limits = thresholds.get(scenario, {})
+        for key in ('p50_ms', 'p95_ms', 'p99_ms'):
+            if key in limits and result[key] > limits[key]:
+                failures.append(f"{scenario}: {key} {result[key]} > {limits[key]}")
+        if 'min_rps' in limits and result['rps'] < limits['min_rps']:
+            failures.append(f"{scenario}: rps {result['rps']} < {limits['min_rps']}")
+        if 'max_queries' in limits and result['queries_per_request'] is not None \
+                and result['queries_per_request'] > limits['max_queries']:
+            failures.append(f"{scenario}: queries/request {result['queries_per_request']} > {limits['max_queries']}")
+        error_rate = result['errors'] / result['requests'] if result['requests'] else 0
+        if error_rate > limits.get('max_error_rate', 0):
+            failures.append(f"{scenario}: error rate {error_rate:.2%} > {limits.get('max_error_rate', 0):.2%}")
+    return failures
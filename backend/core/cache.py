@@ -0,0 +1,224 @@
+import json
+import os
+import socket
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from datetime import datetime, timedelta
+from bson import ObjectId
+from django.conf import settings
+from mongoengine.connection import get_db
+
+_MISSING = object()
+
+
+class TTLCache:
+    """Thread-safe LRU cache whose entries also expire ``ttl`` seconds after being stored.
+
+    Documents are kept as their raw SON and rebuilt on every hit, so callers never share
+    (and mutate) the same instance across requests.
+    """
+
+    def __init__(self, name, maxsize, ttl):
+        self.name = name
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key, default=None):
+        with self._lock:
+            entry = self._data.get(key, _MISSING)
+            if entry is not _MISSING and entry[0] > time.monotonic():
+                self._data.move_to_end(key)
+                self.hits += 1
+                return entry[1]
+            if entry is not _MISSING:
+                del self._data[key]
+            self.misses += 1
+            return default
+
+    def set(self, key, value):
+        if self.maxsize <= 0 or self.ttl <= 0:
+            return
+        with self._lock:
+            self._data[key] = (time.monotonic() + self.ttl, value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def invalidate(self, key, publish=True):
+        with self._lock:
+            self._data.pop(key, None)
+        if publish:
+            get_invalidation_bus().publish(self.name, key)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def get_document(self, key, loader):
+        """Return a fresh document for ``key``, calling ``loader()`` on a miss.
+
+        Exceptions from the loader (e.g. ``DoesNotExist``) propagate and nothing is cached.
+        """
+        get_invalidation_bus()  # make sure this process listens for invalidations
+        entry = self.get(key, _MISSING)
+        if entry is not _MISSING:
+            document_class, son = entry
+            return document_class._from_son(son)
+        document = loader()
+        self.set(key, (type(document), document.to_mongo()))
+        return document
+
+    def stats(self):
+        with self._lock:
+            size = len(self._data)
+        return {"name": self.name, "size": size, "hits": self.hits, "misses": self.misses}
+
+
+class LocalInvalidationBus:
+    """In-process publish/subscribe, for a single worker process; base of the shared buses."""
+
+    def __init__(self):
+        self._subscribers = []
+
+    def subscribe(self, callback):
+        self._subscribers.append(callback)
+
+    def publish(self, cache_name, key):
+        pass
+
+    def deliver(self, cache_name, key):
+        for callback in self._subscribers:
+            callback(cache_name, key)
+
+
+class MulticastInvalidationBus(LocalInvalidationBus):
+    """Fans invalidations out to every worker process on this host over UDP multicast.
+
+    Packets are sent with TTL 0 so they never leave the machine. Delivery is best effort;
+    the cache TTL bounds staleness if a packet is lost.
+    """
+
+    def __init__(self, group, port):
+        super().__init__()
+        self.address = (group, port)
+        self.sender_id = uuid.uuid4().hex
+        self._pid = os.getpid()
+        self._send_socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM, socket.IPPROTO_UDP)
+        self._send_socket.setsockopt(socket.IPPROTO_IP, socket.IP_MULTICAST_TTL, 0)
+        self._send_socket.setsockopt(socket.IPPROTO_IP, socket.IP_MULTICAST_LOOP, 1)
+        threading.Thread(target=self._listen, daemon=True, name='cache-invalidation').start()
+
+    def publish(self, cache_name, key):
+        payload = json.dumps({"sender": self.sender_id, "cache": cache_name, "key": key}).encode()
+        try:
+            self._send_socket.sendto(payload, self.address)
+        except OSError as e:
+            print(f"Error publishing cache invalidation: {str(e)}")
+
+    def _listen(self):
+        group, port = self.address
+        sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM, socket.IPPROTO_UDP)
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        if hasattr(socket, 'SO_REUSEPORT'):
+            sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
+        sock.bind(('', port))
+        sock.setsockopt(socket.IPPROTO_IP, socket.IP_ADD_MEMBERSHIP, socket.inet_aton(group) + socket.inet_aton('0.0.0.0'))
+        while True:
+            data, _ = sock.recvfrom(4096)
+            try:
+                message = json.loads(data)
+            except ValueError:
+                continue
+            if message.get("sender") != self.sender_id:
+                self.deliver(message.get("cache"), message.get("key"))
+
+
+class MongoInvalidationBus(LocalInvalidationBus):
+    """Shares invalidations through a MongoDB collection every worker polls.
+
+    Reaches every process on every host that uses the database, so a deleted account or a
+    changed password stops authenticating everywhere within ``CACHE_INVALIDATION_POLL_INTERVAL``
+    seconds instead of the cache TTL. Entries expire after an hour. Each poll looks back a few
+    seconds to allow for clock skew between hosts; invalidations are idempotent, so the overlap
+    only repeats a few evictions.
+    """
+
+    COLLECTION = 'cache_invalidations'
+    LOOKBACK = timedelta(seconds=5)
+
+    def __init__(self, interval):
+        super().__init__()
+        self.interval = interval
+        self.sender_id = uuid.uuid4().hex
+        self._pid = os.getpid()
+        self._since = datetime.utcnow()
+        threading.Thread(target=self._poll_loop, daemon=True, name='cache-invalidation').start()
+
+    def _collection(self):
+        return get_db()[self.COLLECTION]
+
+    def publish(self, cache_name, key):
+        try:
+            self._collection().insert_one({"sender": self.sender_id, "cache": cache_name, "key": key, "at": datetime.utcnow()})
+        except Exception as e:
+            print(f"Error publishing cache invalidation: {str(e)}")
+
+    def _poll_loop(self):
+        indexed = False
+        while True:
+            time.sleep(self.interval)
+            try:
+                if not indexed:
+                    self._collection().create_index('at', expireAfterSeconds=3600)
+                    indexed = True
+                self.poll()
+            except Exception as e:
+                print(f"Error polling cache invalidations: {str(e)}")
+
+    def poll(self):
+        started = datetime.utcnow()
+        since = ObjectId.from_datetime(self._since - self.LOOKBACK)
+        for message in self._collection().find({'_id': {'$gt': since}, 'sender': {'$ne': self.sender_id}}):
+            self.deliver(message.get("cache"), message.get("key"))
+        self._since = started
+
+
+_bus = None
+_bus_lock = threading.Lock()
+
+
+def get_invalidation_bus():
+    global _bus
+    if _bus is None or getattr(_bus, '_pid', os.getpid()) != os.getpid():
+        with _bus_lock:
+            if _bus is None or getattr(_bus, '_pid', os.getpid()) != os.getpid():
+                if settings.CACHE_INVALIDATION_BUS == 'mongo':
+                    _bus = MongoInvalidationBus(settings.CACHE_INVALIDATION_POLL_INTERVAL)
+                elif settings.CACHE_INVALIDATION_BUS == 'multicast':
+                    group, port = settings.CACHE_INVALIDATION_ADDRESS.rsplit(':', 1)
+                    _bus = MulticastInvalidationBus(group, int(port))
+                else:
+                    _bus = LocalInvalidationBus()
+                _bus.subscribe(_on_invalidation)
+    return _bus
+
+
+user_cache = TTLCache('user', settings.USER_CACHE_SIZE, settings.USER_CACHE_TTL)
+settings_cache = TTLCache('settings', settings.SETTINGS_CACHE_SIZE, settings.SETTINGS_CACHE_TTL)
+CACHES = {cache.name: cache for cache in (user_cache, settings_cache)}
+
+
+def _on_invalidation(cache_name, key):
+    cache = CACHES.get(cache_name)
+    if cache is not None:
+        cache.invalidate(key, publish=False)
+
+
+def cache_stats():
+    return [cache.stats() for cache in CACHES.values()]
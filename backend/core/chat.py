@@ -0,0 +1,124 @@
+from django.conf import settings as django_settings
+from core.archive import rehydrate_thread
+from core.cache import settings_cache
+from core.metrics import span
+from core.models import ChatThread, ChatMessage, Settings, PREVIEW_LENGTH
+from core.search import index_chat_message
+from core.serializers import prefetch_references
+from core.summaries import maybe_schedule_summary
+from core.versions import bump_user_version
+from core.writebehind import message_writer
+
+
+def resolve_chat_thread(user, question, slug=None):
+    """Return ``(thread, new_thread_created)`` for a chat turn.
+
+    Raises ``ChatThread.DoesNotExist`` when ``slug`` does not name one of the user's threads.
+    Archived threads are restored first, so the new turn sees their history. The thread's
+    ``user`` is set to ``user``, so serializing it later (e.g. on the event loop) needs no query.
+    """
+    with span('thread'):
+        if slug:
+            chat_thread = ChatThread.objects.get(slug=slug, user=user)
+            prefetch_references([chat_thread], ['user'], known=[user])
+            return rehydrate_thread(chat_thread), False
+
+        title = question[:30]  # Generate a title based on the first 30 characters of the question
+        existing_thread = ChatThread.objects.filter(title=title, user=user).first()
+        if existing_thread:
+            prefetch_references([existing_thread], ['user'], known=[user])
+            return rehydrate_thread(existing_thread), False
+
+        chat_thread = ChatThread(title=title, user=user)
+        chat_thread.save()
+        bump_user_version(user.id)
+        return chat_thread, True
+
+
+def get_user_settings(user):
+    with span('settings'):
+        try:
+            return settings_cache.get_document(str(user.id), lambda: Settings.objects.get(user=user))
+        except Settings.DoesNotExist:
+            return Settings.objects.create(user=user, model='llama3-8b-8192', customize_response="You are an intelligent assistant. Please provide informative and helpful responses.", max_tokens=200)
+
+
+def save_chat_message(chat_thread, user, question, response):
+    with span('save'):
+        return _save_chat_message(chat_thread, user, question, response)
+
+
+def _save_chat_message(chat_thread, user, question, response):
+    chat_message = ChatMessage(
+        thread=chat_thread,
+        user=user,
+        message=question,
+        response=response
+    )
+    # Write-behind: the background writer also updates the thread counters and summary
+    if django_settings.CHAT_WRITE_MODE == 'async' and message_writer.submit(chat_message, chat_thread):
+        index_chat_message(chat_message)
+        return chat_message
+
+    chat_message.save()
+    index_chat_message(chat_message)
+    record_thread_activity(chat_thread, chat_message)
+    maybe_schedule_summary(chat_thread)
+    return chat_message
+
+
+def record_thread_activity(chat_thread, chat_message):
+    ChatThread.objects(id=chat_thread.id).update_one(
+        inc__message_count=1,
+        set__last_message_at=chat_message.timestamp,
+        set__last_message_preview=chat_message.message[:PREVIEW_LENGTH],
+    )
+    bump_user_version(chat_message.user.id)
+
+
+_activity_checked = set()
+
+
+def backfill_thread_activity(user_id=None):
+    """Fill the activity fields of threads created before they existed; returns how many were updated.
+
+    Counters come from the threads' messages; threads without messages sort by creation time.
+    Covers ``user_id``'s threads, or every thread when it is None.
+    """
+    match = {'last_message_at': None}
+    if user_id is not None:
+        match['user'] = user_id
+    thread_ids = [doc['_id'] for doc in ChatThread._get_collection().find(match, {'_id': 1})]
+    if not thread_ids:
+        return 0
+
+    rows = ChatMessage.objects.aggregate([
+        {'$match': {'thread': {'$in': thread_ids}}},
+        {'$sort': {'thread': 1, 'timestamp': 1}},
+        {'$group': {
+            '_id': '$thread',
+            'count': {'$sum': 1},
+            'last_at': {'$last': '$timestamp'},
+            'last_message': {'$last': '$message'},
+        }},
+    ], allowDiskUse=True)
+    for row in rows:
+        ChatThread.objects(id=row['_id']).update_one(
+            set__message_count=row['count'],
+            set__last_message_at=row['last_at'],
+            set__last_message_preview=(row['last_message'] or '')[:PREVIEW_LENGTH],
+        )
+    ChatThread._get_collection().update_many(
+        {'_id': {'$in': thread_ids}, 'last_message_at': None},
+        [{'$set': {'last_message_at': '$created_at'}}],
+    )
+    return len(thread_ids)
+
+
+def ensure_thread_activity(user_id):
+    """Backfill ``user_id``'s older threads before they are paged by activity; once per process and user."""
+    if user_id in _activity_checked:
+        return
+    if backfill_thread_activity(user_id):
+        bump_user_version(user_id)
+    _activity_checked.add(user_id)
@@ -0,0 +1,103 @@
+import math
+import re
+from django.conf import settings as django_settings
+from core.models import ChatMessage
+
+# Context windows for the models in Settings.model_choices
+MODEL_CONTEXT_WINDOWS = {
+    'gemma-7b-it': 8192,
+    'gemma2-9b-it': 8192,
+    'llama-3.1-70b-versatile': 131072,
+    'llama-3.1-8b-instant': 131072,
+    'llama-3.2-11b-text-preview': 8192,
+    'llama-3.2-11b-vision-preview': 8192,
+    'llama-3.2-1b-preview': 8192,
+    'llama-3.2-3b-preview': 8192,
+    'llama-3.2-90b-text-preview': 8192,
+    'llama-guard-3-8b': 8192,
+    'llama3-8b-8192': 8192,
+}
+DEFAULT_CONTEXT_WINDOW = 8192
+
+# Role markers and separators the chat template adds around each message
+MESSAGE_OVERHEAD_TOKENS = 4
+
+_TOKEN_RE = re.compile(r"\w+|[^\w\s]")
+
+
+def estimate_tokens(text):
+    """Cheap local estimate of the number of tokens ``text`` costs.
+
+    BPE tokenizers average roughly four characters per token on English text but split
+    punctuation and rare words further, so take whichever count is larger.
+    """
+    if not text:
+        return 0
+    return max(len(_TOKEN_RE.findall(text)), math.ceil(len(text) / 4))
+
+
+def message_tokens(content):
+    return estimate_tokens(content) + MESSAGE_OVERHEAD_TOKENS
+
+
+def context_budget(model_choice, max_tokens):
+    """Prompt tokens available for a request on ``model_choice`` that may generate ``max_tokens``."""
+    window = MODEL_CONTEXT_WINDOWS.get(model_choice, DEFAULT_CONTEXT_WINDOW)
+    # Large windows are allowed but not used: long prompts cost latency on every turn
+    return min(window - max_tokens, django_settings.CHAT_CONTEXT_MAX_TOKENS)
+
+
+def recent_exchanges(chat_thread, limit, since=None):
+    """Newest-first ``(message, response)`` pairs newer than ``since``, reading only those two fields.
+
+    The cursor fetches small batches so the caller can stop as soon as the budget is spent
+    without the remaining documents ever leaving the server.
+    """
+    query = {'thread': chat_thread}
+    if since:
+        query['timestamp__gt'] = since
+    queryset = (
+        ChatMessage.objects(**query)
+        .order_by('-timestamp')
+        .only('message', 'response')
+        .limit(limit)
+        .batch_size(django_settings.CHAT_CONTEXT_BATCH_SIZE)
+        .as_pymongo()
+    )
+    for doc in queryset:
+        yield doc.get('message') or '', doc.get('response') or ''
+
+
+def build_chat_messages(chat_thread, question, system_message_content, model_choice, max_tokens, include_history=True):
+    """Assemble the prompt for ``question``.
+
+    That is the system prompt, the thread's rolling summary if it has one, as much of the
+    history after the summary as fits the budget, and the question itself.
+    """
+    system_message = {"role": "system", "content": system_message_content}
+    user_message = {"role": "user", "content": question}
+
+    history = []
+    summary_messages = []
+    budget = context_budget(model_choice, max_tokens) - message_tokens(system_message_content) - message_tokens(question)
+    if include_history and chat_thread.summary:
+        summary_content = f"Summary of the earlier conversation:\n{chat_thread.summary}"
+        if message_tokens(summary_content) <= budget:
+            summary_messages.append({"role": "system", "content": summary_content})
+            budget -= message_tokens(summary_content)
+
+    if include_history and budget > 0:
+        exchanges = recent_exchanges(chat_thread, django_settings.CHAT_CONTEXT_MAX_MESSAGES, since=chat_thread.summarized_until)
+        for message, response in exchanges:
+            if response.startswith("Error:"):
+                # Failed turns carry no useful context
+                continue
+            cost = message_tokens(message) + message_tokens(response)
+            if cost > budget:
+                break
+            budget -= cost
+            history.append({"role": "assistant", "content": response})
+            history.append({"role": "user", "content": message})
+        history.reverse()
+
+    return [system_message, *summary_messages, *history, user_message]
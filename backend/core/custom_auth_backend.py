@@ -2,16 +2,22 @@ from bson import ObjectId
 from rest_framework_simplejwt.authentication import JWTAuthentication
 from rest_framework.exceptions import AuthenticationFailed
 from .models import User  
+from .cache import user_cache
+from .metrics import span
 
 class MongoDBJWTAuthentication(JWTAuthentication):
+    def authenticate(self, request):
+        with span('auth'):
+            return super().authenticate(request)
+
     def get_user(self, validated_token):
         user_id = validated_token.get("user_id")
         if not user_id:
             raise AuthenticationFailed("User ID not found in token.")
 
         try:
-            # Use MongoEngine to get the user by ObjectId
-            return User.objects.get(id=ObjectId(user_id))
+            # Use MongoEngine to get the user by ObjectId, unless this process has it cached
+            return user_cache.get_document(str(user_id), lambda: User.objects.get(id=ObjectId(user_id)))
         except User.DoesNotExist:
             raise AuthenticationFailed("User not found.")
         except Exception as e:
@@ -0,0 +1,61 @@
+"""MongoDB connection setup and read routing.
+
+settings.py only registers the connection (``register_mongo``). mongoengine creates the
+MongoClient on the first query in each process, with ``connect=False`` so even that does not
+block on the server. ``manage.py`` commands that never query skip the connection entirely.
+Prefork servers (gunicorn, ``uvicorn --workers``) get a fresh client, pool and monitor threads
+in each worker instead of sharing one created before the fork.
+
+Search and export query with ``secondary_reads()``: the ``MONGO_READ_PREFERENCE`` mode,
+bounded by ``MONGO_MAX_STALENESS_SECONDS``. The thread list and message history stay on the
+primary: their ETags come from one read (the version stamp, the thread) and their pages from
+another, and two reads routed to different secondaries could pair an old page with a newer
+ETag that clients would then keep revalidating as current. Chat turns and everything else
+that writes stay on the primary too.
+"""
+from urllib.parse import quote_plus
+from django.conf import settings
+from mongoengine import register_connection, DEFAULT_CONNECTION_NAME
+from pymongo.read_preferences import Primary, PrimaryPreferred, Secondary, SecondaryPreferred, Nearest
+
+READ_PREFERENCES = {
+    'primary': Primary,
+    'primaryPreferred': PrimaryPreferred,
+    'secondary': Secondary,
+    'secondaryPreferred': SecondaryPreferred,
+    'nearest': Nearest,
+}
+# The smallest maxStalenessSeconds the server selection spec allows
+MIN_MAX_STALENESS_SECONDS = 90
+
+
+def mongo_uri(user, password, host, port, name):
+    return f"mongodb://{quote_plus(user)}:{quote_plus(password)}@{host}:{port}/{name}?authSource=admin"
+
+
+def register_mongo(uri, event_listeners=(), compressors='', socket_timeout_ms=0, **pool_options):
+    """Register the default connection without opening it; ``pool_options`` go to MongoClient."""
+    options = dict(pool_options, connect=False, event_listeners=list(event_listeners))
+    if compressors:
+        options['compressors'] = compressors
+    if socket_timeout_ms:
+        options['socketTimeoutMS'] = socket_timeout_ms
+    register_connection(DEFAULT_CONNECTION_NAME, host=uri, **options)
+
+
+def check_read_preference(mode, max_staleness):
+    """Raise ValueError for settings pymongo would only reject on the first routed read."""
+    if mode not in READ_PREFERENCES:
+        raise ValueError(f"MONGO_READ_PREFERENCE must be one of: {', '.join(READ_PREFERENCES)}.")
+    if max_staleness < 0 or 0 < max_staleness < MIN_MAX_STALENESS_SECONDS:
+        raise ValueError(
+            f"MONGO_MAX_STALENESS_SECONDS must be at least {MIN_MAX_STALENESS_SECONDS}, or 0 for no bound."
+        )
+
+
+def secondary_reads():
+    """The read preference for read-only paths."""
+    mode = settings.MONGO_READ_PREFERENCE
+    if mode == 'primary':
+        return Primary()
+    return READ_PREFERENCES[mode](max_staleness=settings.MONGO_MAX_STALENESS_SECONDS or -1)
@@ -0,0 +1,151 @@
+"""Cascade deletes for threads and accounts.
+
+Dependents are removed with bulk ``delete_many`` calls on indexed fields rather than through
+mongoengine's per-document ``reverse_delete_rule`` handling. The thread (or the user and their
+Settings) is removed first, so it disappears from the API at once. Messages are then deleted
+in batches of ``DELETE_BATCH_SIZE`` ids, read from the covered (thread, timestamp, _id) index.
+Small deletions finish inline. Larger ones run on a background pool and record their progress
+on a DeletionJob, which ``resume_deletions`` restarts if the process died part-way.
+"""
+import os
+import secrets
+import shutil
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from django.conf import settings
+from core.archive import get_archive_store
+from core.cache import user_cache, settings_cache
+from core.models import User, Settings, ChatThread, ChatMessage, ThreadArchive, TokenUsage, DeletionJob, VersionStamp
+from core.search import unindex_messages, unindex_user
+from core.versions import bump_user_version
+
+_executor = None
+_lock = threading.Lock()
+
+
+def _get_executor():
+    global _executor
+    if _executor is None:
+        with _lock:
+            if _executor is None:
+                _executor = ThreadPoolExecutor(max_workers=settings.DELETE_WORKERS, thread_name_prefix='cascade-delete')
+    return _executor
+
+
+def _delete_messages(thread_ids, job):
+    messages = ChatMessage._get_collection()
+    while True:
+        ids = [doc['_id'] for doc in messages.find({'thread': {'$in': thread_ids}}, {'_id': 1}).limit(settings.DELETE_BATCH_SIZE)]
+        if not ids:
+            return
+        deleted = messages.delete_many({'_id': {'$in': ids}}).deleted_count
+        unindex_messages(job.user, ids)
+        DeletionJob.objects(id=job.id).update_one(inc__messages_deleted=deleted)
+
+
+def _delete_threads(threads, job):
+    """Delete thread documents and everything hanging off them. ``threads`` are raw documents."""
+    thread_ids = [thread['_id'] for thread in threads]
+    ChatThread._get_collection().delete_many({'_id': {'$in': thread_ids}})
+    _delete_messages(thread_ids, job)
+    ThreadArchive._get_collection().delete_many({'thread': {'$in': thread_ids}})
+    for thread in threads:
+        location = thread.get('archive_location')
+        if location and location != 'mongo':
+            get_archive_store(location).delete(thread['_id'], location)
+    DeletionJob.objects(id=job.id).update_one(inc__threads_deleted=len(thread_ids))
+
+
+def _run_thread(job):
+    # The thread document is already gone; only its dependents are left
+    _delete_threads([{'_id': job.thread, 'archive_location': job.archive_location}], job)
+
+
+def _run_account(job):
+    batch_size = max(1, settings.DELETE_BATCH_SIZE // 50)
+    while True:
+        threads = list(
+            ChatThread.objects(user=job.user).only('id', 'archive_location').limit(batch_size).as_pymongo()
+        )
+        if not threads:
+            break
+        _delete_threads(threads, job)
+    TokenUsage._get_collection().delete_many({'user': job.user})
+    VersionStamp._get_collection().delete_many({'_id': f"threads:{job.user}"})
+    ThreadArchive._get_collection().delete_many({'user': job.user})
+    shutil.rmtree(os.path.join(settings.ARCHIVE_DIRECTORY, str(job.user)), ignore_errors=True)
+
+
+def run_job(job):
+    DeletionJob.objects(id=job.id).update_one(set__status='running')
+    try:
+        if job.kind == 'thread':
+            _run_thread(job)
+        else:
+            _run_account(job)
+    except Exception as e:
+        print(f"Error running deletion job {job.key}: {str(e)}")
+        DeletionJob.objects(id=job.id).update_one(set__status='failed', set__error=str(e), set__finished_at=datetime.utcnow())
+    else:
+        DeletionJob.objects(id=job.id).update_one(set__status='done', set__finished_at=datetime.utcnow())
+    job.reload()
+    return job
+
+
+def _start(job):
+    if job.messages_total <= settings.DELETE_INLINE_MESSAGES:
+        return run_job(job)
+    _get_executor().submit(run_job, job)
+    return job
+
+
+def delete_thread(chat_thread):
+    """Delete a thread and its messages; returns the DeletionJob tracking it."""
+    job = DeletionJob(
+        key=secrets.token_urlsafe(16),
+        kind='thread',
+        user=chat_thread.to_mongo()['user'],
+        thread=chat_thread.id,
+        messages_total=chat_thread.message_count or 0,
+        archive_location=chat_thread.archive_location,
+    ).save()
+    ChatThread._get_collection().delete_one({'_id': chat_thread.id})
+    bump_user_version(job.user)
+    return _start(job)
+
+
+def delete_account(user):
+    """Delete a user with their settings, threads, messages, archives and usage records."""
+    totals = list(ChatThread.objects(user=user).aggregate([
+        {'$group': {'_id': None, 'messages': {'$sum': '$message_count'}}}
+    ]))
+    job = DeletionJob(
+        key=secrets.token_urlsafe(16),
+        kind='account',
+        user=user.id,
+        messages_total=totals[0]['messages'] if totals else 0,
+    ).save()
+
+    # Remove the login first: tokens stop resolving and the username becomes free
+    User._get_collection().delete_one({'_id': user.id})
+    Settings._get_collection().delete_many({'user': user.id})
+    user_cache.invalidate(str(user.id))
+    settings_cache.invalidate(str(user.id))
+    unindex_user(user.id)
+    return _start(job)
+
+
+def job_progress(job):
+    return {
+        "job": job.key,
+        "kind": job.kind,
+        "status": job.status,
+        "messages_total": job.messages_total,
+        "messages_deleted": job.messages_deleted,
+        "threads_deleted": job.threads_deleted,
+        "progress": min(1.0, job.messages_deleted / job.messages_total) if job.messages_total else (1.0 if job.status == 'done' else 0.0),
+        "error": job.error,
+        "created_at": job.created_at,
+        "finished_at": job.finished_at,
+    }
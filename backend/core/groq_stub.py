@@ -0,0 +1,167 @@
+"""A local HTTP server imitating the Groq chat completions API.
+
+Point ``GROQ_BASE_URL`` at it to exercise the LLM call path without network access or
+an API key::
+
+    python manage.py groq_stub --port 8001 --latency 0.2 --token-delay 0.01
+
+Faults can be injected to exercise retries, fallback and hedging: a share of requests can
+fail with a 5xx (``error_rate``) or stall before the first byte (``slow_rate`` /
+``slow_latency``), and models in ``fail_models`` always fail. For repeatable tests the first
+``fail_first`` requests always fail and the first ``slow_first`` always stall. Failures are
+answered with ``error_status`` (503, or e.g. 429 to imitate rate limiting).
+"""
+import json
+import random
+import threading
+import time
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+COMPLETIONS_PATH = '/openai/v1/chat/completions'
+
+
+class GroqStubHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'  # keep-alive, so client connection pooling is exercised
+
+    def setup(self):
+        super().setup()
+        with self.server.lock:
+            self.server.connection_count += 1
+
+    def log_message(self, format, *args):
+        if self.server.verbose:
+            super().log_message(format, *args)
+
+    def do_POST(self):
+        if self.path.rstrip('/') != COMPLETIONS_PATH:
+            return self._send_json(404, {"error": {"message": "Unknown path.", "type": "not_found"}})
+
+        length = int(self.headers.get('Content-Length') or 0)
+        try:
+            body = json.loads(self.rfile.read(length) or b'{}')
+        except ValueError:
+            return self._send_json(400, {"error": {"message": "Invalid JSON body.", "type": "invalid_request_error"}})
+
+        with self.server.lock:
+            self.server.request_count += 1
+            fail = self.server.request_count <= self.server.fail_first
+            slow = self.server.request_count <= self.server.slow_first
+
+        model = body.get('model', 'stub-model')
+        if fail or model in self.server.fail_models or random.random() < self.server.error_rate:
+            with self.server.lock:
+                self.server.error_count += 1
+            return self._send_json(self.server.error_status, {"error": {"message": "Injected failure.", "type": "service_unavailable"}})
+        max_tokens = body.get('max_tokens') or self.server.tokens
+        tokens = self.server.reply_tokens(body.get('messages', []))[:max_tokens]
+        prompt_tokens = sum(len(str(m.get('content', '')).split()) for m in body.get('messages', []))
+        usage = {
+            "prompt_tokens": prompt_tokens,
+            "completion_tokens": len(tokens),
+            "total_tokens": prompt_tokens + len(tokens),
+        }
+
+        latency = self.server.latency
+        if slow or random.random() < self.server.slow_rate:
+            latency += self.server.slow_latency
+        time.sleep(latency)
+        if body.get('stream'):
+            self._send_stream(model, tokens, usage)
+        else:
+            self._send_json(200, {
+                "id": f"chatcmpl-{uuid.uuid4().hex}",
+                "object": "chat.completion",
+                "created": int(time.time()),
+                "model": model,
+                "choices": [{
+                    "index": 0,
+                    "message": {"role": "assistant", "content": "".join(tokens)},
+                    "finish_reason": "stop",
+                }],
+                "usage": usage,
+            })
+
+    def _send_json(self, code, payload):
+        data = json.dumps(payload).encode()
+        self.send_response(code)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def _write_chunk(self, data):
+        self.wfile.write(f"{len(data):x}\r\n".encode() + data + b"\r\n")
+        self.wfile.flush()
+
+    def _send_stream(self, model, tokens, usage):
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/event-stream')
+        self.send_header('Transfer-Encoding', 'chunked')
+        self.end_headers()
+
+        completion_id = f"chatcmpl-{uuid.uuid4().hex}"
+        created = int(time.time())
+        try:
+            for i, token in enumerate(tokens + [None]):
+                last = token is None
+                chunk = {
+                    "id": completion_id,
+                    "object": "chat.completion.chunk",
+                    "created": created,
+                    "model": model,
+                    "choices": [{
+                        "index": 0,
+                        "delta": {} if last else {"content": token},
+                        "finish_reason": "stop" if last else None,
+                    }],
+                }
+                if last:
+                    chunk["x_groq"] = {"usage": usage}
+                elif i:
+                    time.sleep(self.server.token_delay)
+                self._write_chunk(f"data: {json.dumps(chunk)}\n\n".encode())
+            self._write_chunk(b"data: [DONE]\n\n")
+            self._write_chunk(b"")
+        except (BrokenPipeError, ConnectionResetError):
+            # The client closed the stream early
+            self.close_connection = True
+
+
+class GroqStubServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, address=('127.0.0.1', 0), latency=0.0, token_delay=0.0, tokens=50, reply=None,
+                 error_rate=0.0, slow_rate=0.0, slow_latency=0.0, fail_models=(), fail_first=0, slow_first=0, error_status=503, verbose=False):
+        super().__init__(address, GroqStubHandler)
+        self.latency = latency
+        self.token_delay = token_delay
+        self.tokens = tokens
+        self.reply = reply
+        self.error_rate = error_rate
+        self.slow_rate = slow_rate
+        self.slow_latency = slow_latency
+        self.fail_models = set(fail_models)
+        self.fail_first = fail_first
+        self.slow_first = slow_first
+        self.error_status = error_status
+        self.verbose = verbose
+        self.lock = threading.Lock()
+        self.request_count = 0
+        self.connection_count = 0
+        self.error_count = 0
+
+    @property
+    def base_url(self):
+        host, port = self.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def reply_tokens(self, messages):
+        if self.reply is not None:
+            return [f"{word} " for word in self.reply.split()]
+        return [f"token{i} " for i in range(self.tokens)]
+
+    def start(self):
+        """Serve from a daemon thread; returns the server for chaining."""
+        threading.Thread(target=self.serve_forever, daemon=True).start()
+        return self
@@ -0,0 +1,50 @@
+import os
+import threading
+import time
+
+# Crockford base32, lowercased so identifiers fit slugs and still sort by creation time
+ALPHABET = '0123456789abcdefghjkmnpqrstvwxyz'
+
+_RANDOM_BITS = 80
+_RANDOM_MAX = (1 << _RANDOM_BITS) - 1
+
+_lock = threading.Lock()
+_last_ms = 0
+_last_random = 0
+
+
+def _encode(value, length):
+    chars = []
+    for _ in range(length):
+        chars.append(ALPHABET[value & 31])
+        value >>= 5
+    return ''.join(reversed(chars))
+
+
+def new_ulid():
+    """A 26 character ULID: 48-bit millisecond timestamp followed by 80 random bits.
+
+    Identifiers are unique without a database round-trip and sort in creation order.
+    Within one millisecond the random part is incremented rather than redrawn, so ids from
+    this process are strictly increasing even under bursts of thousands per second.
+    """
+    global _last_ms, _last_random
+    with _lock:
+        now_ms = time.time_ns() // 1_000_000
+        if now_ms > _last_ms:
+            _last_ms = now_ms
+            _last_random = int.from_bytes(os.urandom(10), 'big')
+        elif _last_random < _RANDOM_MAX:
+            _last_random += 1
+        else:
+            # Random space for this millisecond exhausted (or the clock went back): borrow the next one
+            _last_ms += 1
+            _last_random = int.from_bytes(os.urandom(10), 'big')
+        ms, random_part = _last_ms, _last_random
+    return _encode(ms, 10) + _encode(random_part, 16)
+
+
+def prefixed_slug(prefix):
+    """``<prefix>-<ulid>``, or just the ULID when ``prefix`` slugifies to nothing."""
+    ulid = new_ulid()
+    return f"{prefix}-{ulid}" if prefix else ulid
@@ -0,0 +1,114 @@
+import asyncio
+import os
+import random
+import threading
+import time
+import weakref
+
+import httpx
+from django.conf import settings
+from groq import APIConnectionError, AsyncGroq, Groq, InternalServerError, RateLimitError
+
+# Timeouts (APITimeoutError is an APIConnectionError), 429s and 5xx are worth another attempt
+RETRYABLE_ERRORS = (APIConnectionError, RateLimitError, InternalServerError)
+
+_lock = threading.Lock()
+_client = None
+# httpx async pools are bound to the event loop they were opened on, so keep one per loop
+_async_clients = weakref.WeakKeyDictionary()
+
+
+def _reset_clients():
+    global _client
+    _client = None
+    _async_clients.clear()
+
+
+# Pooled sockets must not be shared with a forked child process
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=_reset_clients)
+
+
+def _client_options():
+    return {
+        "api_key": settings.GROQ_API_KEY or os.environ.get("GROQ_API_KEY"),
+        "base_url": settings.GROQ_BASE_URL,
+        # Retries are handled here so the backoff is configurable
+        "max_retries": 0,
+    }
+
+
+def _timeout():
+    return httpx.Timeout(settings.GROQ_TIMEOUT, connect=settings.GROQ_CONNECT_TIMEOUT)
+
+
+def _limits():
+    return httpx.Limits(
+        max_connections=settings.GROQ_MAX_CONNECTIONS,
+        max_keepalive_connections=settings.GROQ_MAX_KEEPALIVE_CONNECTIONS,
+        keepalive_expiry=settings.GROQ_KEEPALIVE_EXPIRY,
+    )
+
+
+def get_client():
+    """Process-wide synchronous Groq client sharing one keep-alive connection pool."""
+    global _client
+    if _client is None:
+        with _lock:
+            if _client is None:
+                _client = Groq(
+                    timeout=_timeout(),
+                    http_client=httpx.Client(limits=_limits(), timeout=_timeout()),
+                    **_client_options(),
+                )
+    return _client
+
+
+def get_async_client():
+    """Async Groq client for the running event loop, shared by every coroutine on it."""
+    loop = asyncio.get_running_loop()
+    client = _async_clients.get(loop)
+    if client is None:
+        client = AsyncGroq(
+            timeout=_timeout(),
+            http_client=httpx.AsyncClient(limits=_limits(), timeout=_timeout()),
+            **_client_options(),
+        )
+        _async_clients[loop] = client
+    return client
+
+
+def _backoff(attempt):
+    delay = min(settings.GROQ_RETRY_BACKOFF * (2 ** attempt), settings.GROQ_RETRY_BACKOFF_MAX)
+    return delay * (0.5 + random.random() / 2)
+
+
+def create_chat_completion(messages, model_choice, max_tokens, **kwargs):
+    for attempt in range(settings.GROQ_MAX_RETRIES + 1):
+        try:
+            return get_client().chat.completions.create(
+                messages=messages,
+                model=model_choice,
+                max_tokens=max_tokens,
+                **kwargs
+            )
+        except RETRYABLE_ERRORS:
+            if attempt == settings.GROQ_MAX_RETRIES:
+                raise
+            time.sleep(_backoff(attempt))
+
+
+async def acreate_chat_completion(messages, model_choice, max_tokens, **kwargs):
+    for attempt in range(settings.GROQ_MAX_RETRIES + 1):
+        try:
+            return await get_async_client().chat.completions.create(
+                messages=messages,
+                model=model_choice,
+                max_tokens=max_tokens,
+                **kwargs
+            )
+        except RETRYABLE_ERRORS:
+            if attempt == settings.GROQ_MAX_RETRIES:
+                raise
+            await asyncio.sleep(_backoff(attempt))
+
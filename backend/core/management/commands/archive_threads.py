@@ -0,0 +1,38 @@
+from datetime import datetime, timedelta
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from core.archive import archive_thread
+from core.models import ChatThread
+
+
+class Command(BaseCommand):
+    help = "Move the messages of threads idle longer than ARCHIVE_IDLE_DAYS into cold storage."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--idle-days', type=int, default=settings.ARCHIVE_IDLE_DAYS)
+        parser.add_argument('--limit', type=int, default=0, help="Archive at most this many threads (0 for no limit).")
+        parser.add_argument('--dry-run', action='store_true', help="Only count the threads that would be archived.")
+
+    def handle(self, *args, **options):
+        cutoff = datetime.utcnow() - timedelta(days=options['idle_days'])
+        queryset = ChatThread.objects(archived_at=None, last_message_at__lt=cutoff).only('id').batch_size(1000)
+        if options['limit']:
+            queryset = queryset.limit(options['limit'])
+        # Collect ids first, so the cursor is not held open while archiving
+        thread_ids = [doc['_id'] for doc in queryset.as_pymongo()]
+
+        if options['dry_run']:
+            self.stdout.write(f"{len(thread_ids)} threads idle since before {cutoff:%Y-%m-%d}.")
+            return
+
+        threads = messages = 0
+        for thread_id in thread_ids:
+            try:
+                moved = archive_thread(thread_id)
+            except Exception as e:
+                self.stderr.write(f"Error archiving thread {thread_id}: {str(e)}")
+                continue
+            if moved is not None:
+                threads += 1
+                messages += moved
+        self.stdout.write(self.style.SUCCESS(f"Archived {threads} threads ({messages} messages)."))
@@ -0,0 +1,10 @@
+from django.core.management.base import BaseCommand
+from core.chat import backfill_thread_activity
+
+
+class Command(BaseCommand):
+    help = "Fill message_count, last_message_at and last_message_preview on threads created before they existed."
+
+    def handle(self, *args, **options):
+        updated = backfill_thread_activity()
+        self.stdout.write(self.style.SUCCESS(f"Updated {updated} threads."))
@@ -0,0 +1,88 @@
+import json
+from pathlib import Path
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.test import override_settings
+from core import llm
+from core.benchmark import DATASETS, SCENARIOS, QueryCounter, connect_benchmark_db, seed, run_scenario, access_token, check_thresholds
+from core.groq_stub import GroqStubServer
+
+DEFAULT_THRESHOLDS = Path(__file__).resolve().parents[3] / 'benchmark_thresholds.json'
+# One PBKDF2 hash costs about half a second of CPU, which would swamp everything else login
+# and registration do; the login/register thresholds assume this hasher
+FAST_PASSWORD_HASHERS = ['django.contrib.auth.hashers.MD5PasswordHasher']
+
+
+class Command(BaseCommand):
+    help = "Benchmark chat, thread listing, history paging, login and registration offline against the Groq stub and a scratch database."
+    # System checks import the URLconf, whose querysets would open the configured database
+    # before handle() points mongoengine at the benchmark one
+    requires_system_checks = []
+
+    def add_arguments(self, parser):
+        parser.add_argument('--dataset', choices=sorted(DATASETS), default='small')
+        parser.add_argument('--scenario', action='append', choices=SCENARIOS, help="Scenario to run (repeatable). Defaults to all.")
+        parser.add_argument('--requests', type=int, default=200, help="Requests per scenario.")
+        parser.add_argument('--concurrency', type=int, default=8)
+        parser.add_argument('--mongo-uri', default='mongodb://localhost:27017/chat_benchmark',
+                            help="Scratch database; it is dropped first, so its name must contain 'bench'.")
+        parser.add_argument('--mongomock', action='store_true', help="Use mongomock instead of a MongoDB server (no query counts).")
+        parser.add_argument('--latency', type=float, default=0.05, help="Stub seconds before the first byte.")
+        parser.add_argument('--tokens', type=int, default=50, help="Stub tokens per completion.")
+        parser.add_argument('--thresholds', default=str(DEFAULT_THRESHOLDS), help="JSON file of limits per dataset and scenario; pass '' to skip the check.")
+        parser.add_argument('--real-hashers', action='store_true',
+                            help="Keep the configured PASSWORD_HASHERS; the login/register thresholds assume a fast hasher.")
+        parser.add_argument('--output', help="Write the results as JSON to this file.")
+
+    def handle(self, *args, **options):
+        thresholds_path = Path(options['thresholds']) if options['thresholds'] else None
+        if thresholds_path and not thresholds_path.exists():
+            raise CommandError(f"Thresholds file not found: {thresholds_path}")
+
+        stub = GroqStubServer(latency=options['latency'], tokens=options['tokens']).start()
+
+        # Only the LLM and the database are swapped; everything else runs as configured
+        settings.GROQ_BASE_URL = stub.base_url
+        settings.GROQ_API_KEY = 'benchmark'
+        settings.RATE_LIMIT_REQUESTS_PER_MINUTE = settings.RATE_LIMIT_BURST = 10 ** 9
+        settings.DAILY_TOKEN_QUOTA = 0
+        settings.MODEL_DAILY_TOKEN_QUOTAS = {}
+        settings.CHAT_SUMMARY_ENABLED = False
+        if 'testserver' not in settings.ALLOWED_HOSTS:
+            settings.ALLOWED_HOSTS = [*settings.ALLOWED_HOSTS, 'testserver']
+        if not options['real_hashers']:
+            # override_settings also clears Django's cached hasher list
+            override_settings(PASSWORD_HASHERS=FAST_PASSWORD_HASHERS).enable()
+        llm._reset_clients()
+
+        counter = None if options['mongomock'] else QueryCounter()
+        try:
+            connect_benchmark_db(options['mongo_uri'], mock=options['mongomock'], counter=counter)
+        except (ImportError, ValueError) as e:
+            raise CommandError(str(e))
+
+        threads, messages = DATASETS[options['dataset']]
+        self.stdout.write(f"Seeding {threads} threads x {messages} messages...")
+        user, slugs = seed(threads, messages)
+        token = access_token(user)
+
+        results = {}
+        for scenario in options['scenario'] or SCENARIOS:
+            results[scenario] = run_scenario(scenario, token, slugs, options['requests'], options['concurrency'], counter)
+            row = results[scenario]
+            self.stdout.write(
+                f"{scenario:>8}: {row['rps']:>8} req/s  p50 {row['p50_ms']:>8} ms  p95 {row['p95_ms']:>8} ms  "
+                f"p99 {row['p99_ms']:>8} ms  queries/req {row['queries_per_request']}  errors {row['errors']}"
+            )
+        stub.shutdown()
+
+        if options['output']:
+            with open(options['output'], 'w') as f:
+                json.dump({"dataset": options['dataset'], "results": results}, f, indent=2)
+
+        if thresholds_path:
+            thresholds = json.loads(thresholds_path.read_text()).get(options['dataset'], {})
+            failures = check_thresholds(results, thresholds)
+            if failures:
+                raise CommandError("Benchmark regressions:\n  " + "\n  ".join(failures))
+            self.stdout.write(self.style.SUCCESS(f"Within thresholds for the '{options['dataset']}' dataset."))
@@ -0,0 +1,36 @@
+import sys
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from core.models import User
+from core.transfer import COMPRESSIONS, iter_export_lines, compress
+
+
+class Command(BaseCommand):
+    help = "Stream chat threads and messages to NDJSON (optionally gzip/zstd compressed)."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--user', action='append', dest='usernames', help="Username to export; repeatable. Defaults to all users.")
+        parser.add_argument('--output', '-o', default='-', help="Output file, or '-' for stdout.")
+        parser.add_argument('--compression', choices=COMPRESSIONS, default=settings.EXPORT_COMPRESSION)
+
+    def handle(self, *args, **options):
+        if options['usernames']:
+            users = list(User.objects(username__in=options['usernames']).only('id', 'username'))
+            missing = set(options['usernames']) - {user.username for user in users}
+            if missing:
+                raise CommandError(f"Unknown users: {', '.join(sorted(missing))}")
+        else:
+            users = User.objects.only('id', 'username').batch_size(settings.EXPORT_BATCH_SIZE)
+
+        output = sys.stdout.buffer if options['output'] == '-' else open(options['output'], 'wb')
+        written = 0
+        try:
+            for chunk in compress(iter_export_lines(users), options['compression']):
+                output.write(chunk)
+                written += len(chunk)
+        except ValueError as e:
+            raise CommandError(str(e))
+        finally:
+            if output is not sys.stdout.buffer:
+                output.close()
+        self.stderr.write(self.style.SUCCESS(f"Wrote {written} bytes."))
@@ -0,0 +1,45 @@
+from django.core.management.base import BaseCommand
+from core.groq_stub import GroqStubServer
+
+
+class Command(BaseCommand):
+    help = "Run a local server imitating the Groq chat completions API (set GROQ_BASE_URL to its address)."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--host', default='127.0.0.1')
+        parser.add_argument('--port', type=int, default=8001)
+        parser.add_argument('--latency', type=float, default=0.0, help="Seconds before the first byte of each response.")
+        parser.add_argument('--token-delay', type=float, default=0.0, help="Seconds between streamed tokens.")
+        parser.add_argument('--tokens', type=int, default=50, help="Tokens per completion.")
+        parser.add_argument('--reply', default=None, help="Fixed reply text instead of generated tokens.")
+        parser.add_argument('--error-rate', type=float, default=0.0, help="Share of requests answered with --error-status.")
+        parser.add_argument('--slow-rate', type=float, default=0.0, help="Share of requests delayed by --slow-latency.")
+        parser.add_argument('--slow-latency', type=float, default=0.0, help="Extra seconds added to slow requests.")
+        parser.add_argument('--fail-first', type=int, default=0, help="Number of initial requests that always fail.")
+        parser.add_argument('--error-status', type=int, default=503, help="HTTP status of injected failures, e.g. 429.")
+        parser.add_argument('--slow-first', type=int, default=0, help="Number of initial requests always delayed by --slow-latency.")
+        parser.add_argument('--fail-model', action='append', default=[], help="Model that always fails (repeatable).")
+
+    def handle(self, *args, **options):
+        server = GroqStubServer(
+            (options['host'], options['port']),
+            latency=options['latency'],
+            token_delay=options['token_delay'],
+            tokens=options['tokens'],
+            reply=options['reply'],
+            error_rate=options['error_rate'],
+            slow_rate=options['slow_rate'],
+            slow_latency=options['slow_latency'],
+            fail_models=options['fail_model'],
+            fail_first=options['fail_first'],
+            slow_first=options['slow_first'],
+            error_status=options['error_status'],
+            verbose=options['verbosity'] > 1,
+        )
+        self.stdout.write(f"Groq stub listening on {server.base_url}")
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            server.server_close()
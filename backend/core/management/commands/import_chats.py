@@ -0,0 +1,37 @@
+from django.core.management.base import BaseCommand, CommandError
+from core.models import User
+from core.transfer import ChatImporter, open_export
+
+
+class Command(BaseCommand):
+    help = "Bulk-load an export written by export_chats (plain, gzip or zstd NDJSON)."
+
+    def add_arguments(self, parser):
+        parser.add_argument('path')
+        parser.add_argument('--user', help="Assign every thread to this username instead of the exported owners.")
+        parser.add_argument('--new-ids', action='store_true', help="Give documents fresh ids and slugs, so the file can be loaded more than once.")
+        parser.add_argument('--batch-size', type=int, default=None)
+
+    def handle(self, *args, **options):
+        user = None
+        if options['user']:
+            user = User.objects(username=options['user']).only('id').first()
+            if user is None:
+                raise CommandError(f"Unknown user: {options['user']}")
+
+        importer = ChatImporter(user=user, new_ids=options['new_ids'], batch_size=options['batch_size'])
+        try:
+            with open_export(options['path']) as lines:
+                counts = importer.run(lines)
+        except ValueError as e:
+            raise CommandError(str(e))
+        self.stdout.write(self.style.SUCCESS(
+            f"Imported {counts['threads']} threads and {counts['messages']} messages "
+            f"(skipped {counts['skipped_threads']} threads and {counts['skipped_messages']} messages already present)."
+        ))
+        if counts['conflicting_threads'] or counts['conflicting_messages']:
+            self.stdout.write(self.style.WARNING(
+                f"Not imported, slug already used by another document: {len(counts['conflicting_threads'])} threads "
+                f"({', '.join(map(str, counts['conflicting_threads']))}) with their {counts['dropped_messages']} messages, "
+                f"and {len(counts['conflicting_messages'])} messages."
+            ))
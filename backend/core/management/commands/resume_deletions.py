@@ -0,0 +1,18 @@
+from django.core.management.base import BaseCommand
+from core.deletion import run_job
+from core.models import DeletionJob
+
+
+class Command(BaseCommand):
+    help = "Re-run thread and account deletions left unfinished by a restart or failure."
+
+    def handle(self, *args, **options):
+        finished = failed = 0
+        for job in DeletionJob.objects(status__in=['pending', 'running', 'failed']):
+            job = run_job(job)
+            if job.status == 'done':
+                finished += 1
+            else:
+                failed += 1
+                self.stderr.write(f"Deletion {job.key} failed: {job.error}")
+        self.stdout.write(self.style.SUCCESS(f"Finished {finished} deletions ({failed} failed)."))
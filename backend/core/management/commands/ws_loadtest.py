@@ -0,0 +1,113 @@
+import asyncio
+import json
+import resource
+import statistics
+import time
+from django.core.management.base import BaseCommand, CommandError
+from rest_framework_simplejwt.tokens import RefreshToken
+from core.models import User
+
+
+class Command(BaseCommand):
+    help = "Open many idle chat WebSocket connections against a running server and report how many it holds."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--url', default='ws://127.0.0.1:8000/ws/chat/')
+        parser.add_argument('--username', default='benchmark', help="Existing user whose token the connections use.")
+        parser.add_argument('--connections', type=int, default=5000)
+        parser.add_argument('--rate', type=int, default=500, help="New connections per second.")
+        parser.add_argument('--hold', type=float, default=30, help="Seconds to keep the connections open.")
+        parser.add_argument('--pings', type=int, default=100, help="Connections sampled for ping round-trips while all are open.")
+        parser.add_argument('--chats', type=int, default=0, help="Chat turns to run on sampled connections while all are open.")
+
+    def handle(self, *args, **options):
+        try:
+            import websockets  # installed with uvicorn[standard] / the websockets package
+        except ImportError:
+            raise CommandError("The load test needs the 'websockets' package.")
+        user = User.objects(username=options['username']).first()
+        if user is None:
+            raise CommandError(f"Unknown user: {options['username']}")
+
+        # Each connection is a file descriptor on both ends
+        soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+        wanted = min(hard, options['connections'] + 1024) if hard != resource.RLIM_INFINITY else options['connections'] + 1024
+        if soft < wanted:
+            resource.setrlimit(resource.RLIMIT_NOFILE, (wanted, hard))
+        if options['connections'] + 64 > wanted:
+            self.stderr.write(f"Open file limit is {wanted}; raise it (ulimit -n) to hold {options['connections']} connections.")
+
+        token = str(RefreshToken.for_user(user).access_token)
+        asyncio.run(self.run(websockets, f"{options['url']}?token={token}", options))
+
+    async def run(self, websockets, url, options):
+        release = asyncio.Event()
+        opened, failed, connect_times = [], [], []
+
+        async def client():
+            start = time.perf_counter()
+            try:
+                async with websockets.connect(url, open_timeout=30, ping_interval=None, max_queue=None) as ws:
+                    ready = json.loads(await ws.recv())
+                    if ready.get('type') != 'ready':
+                        raise RuntimeError(ready)
+                    connect_times.append(time.perf_counter() - start)
+                    opened.append(ws)
+                    await release.wait()
+            except Exception as e:
+                failed.append(repr(e))
+
+        tasks = []
+        started = time.perf_counter()
+        for i in range(options['connections']):
+            tasks.append(asyncio.create_task(client()))
+            if (i + 1) % options['rate'] == 0:
+                await asyncio.sleep(1)
+        while len(opened) + len(failed) < options['connections']:
+            await asyncio.sleep(0.1)
+        ramp = time.perf_counter() - started
+        self.stdout.write(f"Open: {len(opened)}  failed: {len(failed)}  ramp: {ramp:.1f}s  "
+                          f"connect p50: {self._ms(connect_times, 50)} ms  p99: {self._ms(connect_times, 99)} ms")
+        if failed:
+            self.stdout.write(f"First failure: {failed[0]}")
+
+        sample = opened[:options['pings']]
+        rtts = []
+        for ws in sample:
+            start = time.perf_counter()
+            await ws.send(json.dumps({"type": "ping"}))
+            while json.loads(await ws.recv()).get('type') != 'pong':
+                pass
+            rtts.append(time.perf_counter() - start)
+        if rtts:
+            self.stdout.write(f"Ping with {len(opened)} open: p50 {self._ms(rtts, 50)} ms  p99 {self._ms(rtts, 99)} ms")
+
+        ttfts, totals = [], []
+        for i, ws in enumerate(opened[:options['chats']]):
+            start = time.perf_counter()
+            await ws.send(json.dumps({"type": "chat", "question": f"Load test question {i} {time.time()}"}))
+            first = None
+            while True:
+                message = json.loads(await ws.recv())
+                if message['type'] == 'delta' and first is None:
+                    first = time.perf_counter() - start
+                if message['type'] in ('done', 'error'):
+                    break
+            ttfts.append(first or time.perf_counter() - start)
+            totals.append(time.perf_counter() - start)
+        if totals:
+            self.stdout.write(f"Chat turns: {len(totals)}  first delta p50 {self._ms(ttfts, 50)} ms  "
+                              f"total p50 {self._ms(totals, 50)} ms  p99 {self._ms(totals, 99)} ms")
+
+        await asyncio.sleep(options['hold'])
+        self.stdout.write(f"Still open after {options['hold']:.0f}s: {sum(1 for ws in opened if ws.close_code is None)}")
+        release.set()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+    @staticmethod
+    def _ms(values, p):
+        if not values:
+            return None
+        if len(values) == 1:
+            return round(values[0] * 1000, 1)
+        return round(statistics.quantiles(values, n=100)[min(p, 99) - 1] * 1000, 1)
@@ -0,0 +1,230 @@
+"""Request timing spans and Prometheus metrics.
+
+``MetricsMiddleware`` opens a RequestTimings for each request. Code on the request path wraps
+its phases in ``span('name')``. ``mongo_listener`` (passed to ``connect`` in settings)
+charges every Mongo command to the request that issued it. Completions are reported per model
+through ``observe_completion``/``observe_llm_error``. Everything is aggregated into the
+in-process registry served at ``/metrics`` in the Prometheus text format. With
+``SERVER_TIMING_ENABLED`` each response also carries the per-request breakdown as a
+``Server-Timing`` header.
+
+Metrics are per process; with several workers, scrape each one (or aggregate in Prometheus).
+"""
+import contextvars
+import threading
+import time
+from contextlib import contextmanager
+from pymongo import monitoring
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+TOKEN_BUCKETS = (16, 64, 256, 1024, 4096, 16384)
+
+
+def _label_text(names, values):
+    if not names:
+        return ""
+    pairs = []
+    for name, value in zip(names, values):
+        value = str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+        pairs.append(f'{name}="{value}"')
+    return "{" + ",".join(pairs) + "}"
+
+
+class Counter:
+    def __init__(self, name, help, labels=()):
+        self.name, self.help, self.labels = name, help, tuple(labels)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, *label_values, amount=1):
+        with self._lock:
+            self._values[label_values] = self._values.get(label_values, 0) + amount
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} counter"]
+        with self._lock:
+            for values, total in sorted(self._values.items()):
+                lines.append(f"{self.name}{_label_text(self.labels, values)} {total}")
+        return lines
+
+
+class Histogram:
+    def __init__(self, name, help, labels=(), buckets=LATENCY_BUCKETS):
+        self.name, self.help, self.labels, self.buckets = name, help, tuple(labels), tuple(buckets)
+        self._values = {}  # label values -> [bucket counts..., sum, count]
+        self._lock = threading.Lock()
+
+    def observe(self, value, *label_values):
+        with self._lock:
+            state = self._values.get(label_values)
+            if state is None:
+                state = self._values[label_values] = [0] * len(self.buckets) + [0.0, 0]
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    state[i] += 1
+            state[-2] += value
+            state[-1] += 1
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            for values, state in sorted(self._values.items()):
+                for bound, count in zip(self.buckets, state):
+                    lines.append(f"{self.name}_bucket{_label_text(self.labels + ('le',), values + (bound,))} {count}")
+                lines.append(f"{self.name}_bucket{_label_text(self.labels + ('le',), values + ('+Inf',))} {state[-1]}")
+                lines.append(f"{self.name}_sum{_label_text(self.labels, values)} {state[-2]}")
+                lines.append(f"{self.name}_count{_label_text(self.labels, values)} {state[-1]}")
+        return lines
+
+
+http_request_seconds = Histogram('chat_http_request_seconds', "HTTP request latency.", ('method', 'route', 'status'))
+phase_seconds = Histogram('chat_request_phase_seconds', "Time spent in each request phase.", ('phase',))
+mongo_command_seconds = Histogram('chat_mongo_command_seconds', "MongoDB command latency.", ('command',))
+mongo_commands_per_request = Histogram('chat_mongo_commands_per_request', "MongoDB commands issued per HTTP request.", ('route',), buckets=(1, 2, 3, 5, 8, 13, 21, 50))
+mongo_command_errors = Counter('chat_mongo_command_errors_total', "Failed MongoDB commands.", ('command',))
+llm_latency_seconds = Histogram('chat_llm_latency_seconds', "Completion latency per model.", ('model',))
+llm_ttft_seconds = Histogram('chat_llm_time_to_first_token_seconds', "Time to first token per model.", ('model',))
+llm_tokens = Counter('chat_llm_tokens_total', "Tokens used per model.", ('model', 'kind'))
+llm_tokens_per_completion = Histogram('chat_llm_completion_tokens', "Completion tokens per response.", ('model',), buckets=TOKEN_BUCKETS)
+llm_errors = Counter('chat_llm_errors_total', "Failed completion attempts per model.", ('model',))
+
+REGISTRY = [
+    http_request_seconds, phase_seconds, mongo_command_seconds, mongo_commands_per_request, mongo_command_errors,
+    llm_latency_seconds, llm_ttft_seconds, llm_tokens, llm_tokens_per_completion, llm_errors,
+]
+
+
+class RequestTimings:
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.spans = {}  # phase -> seconds, in first-seen order
+        self.db_commands = 0
+        self.db_seconds = 0.0
+        self._lock = threading.Lock()
+
+    def add_span(self, name, seconds):
+        with self._lock:
+            self.spans[name] = self.spans.get(name, 0.0) + seconds
+
+    def add_db_command(self, seconds):
+        with self._lock:
+            self.db_commands += 1
+            self.db_seconds += seconds
+
+    def server_timing(self):
+        entries = [f"{name};dur={seconds * 1000:.1f}" for name, seconds in self.spans.items()]
+        entries.append(f'db;dur={self.db_seconds * 1000:.1f};desc="{self.db_commands} queries"')
+        entries.append(f"total;dur={(time.perf_counter() - self.started) * 1000:.1f}")
+        return ", ".join(entries)
+
+
+_current = contextvars.ContextVar('request_timings', default=None)
+
+
+def current_timings():
+    return _current.get()
+
+
+def start_request():
+    timings = RequestTimings()
+    return timings, _current.set(timings)
+
+
+def end_request(token):
+    _current.reset(token)
+
+
+@contextmanager
+def span(name):
+    """Time a phase of the current request (and count it globally, request or not)."""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        elapsed = time.perf_counter() - start
+        phase_seconds.observe(elapsed, name)
+        timings = _current.get()
+        if timings is not None:
+            timings.add_span(name, elapsed)
+
+
+class MongoCommandListener(monitoring.CommandListener):
+    """Charges each Mongo command's server round-trip to the request that issued it.
+
+    pymongo runs these callbacks on the calling thread, and asgiref carries the request's
+    context into ``sync_to_async`` threads, so ``current_timings`` resolves correctly.
+    """
+
+    def started(self, event):
+        pass
+
+    def succeeded(self, event):
+        seconds = event.duration_micros / 1e6
+        mongo_command_seconds.observe(seconds, event.command_name)
+        timings = _current.get()
+        if timings is not None:
+            timings.add_db_command(seconds)
+
+    def failed(self, event):
+        mongo_command_errors.inc(event.command_name)
+        self.succeeded(event)
+
+
+mongo_listener = MongoCommandListener()
+
+
+def observe_completion(completion):
+    """Record a finished routed Completion (core.routing) against the model that served it."""
+    llm_latency_seconds.observe(completion.latency, completion.model)
+    llm_ttft_seconds.observe(completion.ttft, completion.model)
+    usage = completion.usage
+    if usage is not None:
+        llm_tokens.inc(completion.model, 'prompt', amount=usage.prompt_tokens or 0)
+        llm_tokens.inc(completion.model, 'completion', amount=usage.completion_tokens or 0)
+        llm_tokens_per_completion.observe(usage.completion_tokens or 0, completion.model)
+
+
+def observe_llm_error(model):
+    llm_errors.inc(model)
+
+
+def _gauge(name, help, rows):
+    lines = [f"# HELP {name} {help}", f"# TYPE {name} gauge"]
+    for labels, values, value in rows:
+        if isinstance(value, (int, float)) and not isinstance(value, bool):
+            lines.append(f"{name}{_label_text(labels, values)} {value}")
+    return lines
+
+
+def render_metrics():
+    """The registry plus point-in-time stats of the caches, router and writers, as Prometheus text."""
+    from core.cache import cache_stats
+    from core.routing import router
+    from core.singleflight import chat_completions
+    from core.websocket import registry as websocket_registry
+    from core.writebehind import message_writer
+
+    lines = []
+    for metric in REGISTRY:
+        lines.extend(metric.render())
+
+    caches = cache_stats()
+    for field in ('size', 'hits', 'misses'):
+        lines.extend(_gauge(f'chat_cache_{field}', f"Document cache {field}.", [
+            (('cache',), (stats['name'],), stats[field]) for stats in caches
+        ]))
+    for field, value in chat_completions.stats().items():
+        lines.extend(_gauge(f'chat_singleflight_{field}', f"Chat completions {field} by single-flight.", [((), (), value)]))
+    router_stats = router.stats()
+    for field in ('requests', 'errors', 'hedges', 'latency_p50', 'latency_p95', 'ttft_p50', 'ttft_p95'):
+        lines.extend(_gauge(f'chat_router_{field}', f"Model router {field.replace('_', ' ')}.", [
+            (('model',), (model,), stats[field]) for model, stats in router_stats.items()
+        ]))
+    lines.extend(_gauge('chat_router_circuit_open', "1 while the model's circuit breaker is open.", [
+        (('model',), (model,), int(stats['circuit'] == 'open')) for model, stats in router_stats.items()
+    ]))
+    for field, value in message_writer.stats().items():
+        lines.extend(_gauge(f'chat_write_behind_{field}', f"Write-behind messages {field}.", [((), (), value)]))
+    for field, value in websocket_registry.stats().items():
+        lines.extend(_gauge(f'chat_websocket_{field}', f"Open chat WebSocket {field}.", [((), (), value)]))
+    return "\n".join(lines) + "\n"
@@ -0,0 +1,44 @@
+import time
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from core.metrics import start_request, end_request, http_request_seconds, mongo_commands_per_request
+
+
+class MetricsMiddleware:
+    """Times every request, records it in core.metrics and optionally adds a Server-Timing header."""
+
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(self.get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        timings, token = start_request()
+        try:
+            response = self.get_response(request)
+        finally:
+            end_request(token)
+        return self._finish(request, response, timings)
+
+    async def __acall__(self, request):
+        timings, token = start_request()
+        try:
+            response = await self.get_response(request)
+        finally:
+            end_request(token)
+        return self._finish(request, response, timings)
+
+    def _finish(self, request, response, timings):
+        match = getattr(request, 'resolver_match', None)
+        route = match.url_name or match.route if match else 'unmatched'
+        # For streamed responses this covers the time until the body starts
+        http_request_seconds.observe(time.perf_counter() - timings.started, request.method, route, response.status_code)
+        mongo_commands_per_request.observe(timings.db_commands, route)
+        if settings.SERVER_TIMING_ENABLED:
+            response['Server-Timing'] = timings.server_timing()
+        return response
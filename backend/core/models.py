@@ -1,9 +1,12 @@
-from mongoengine import Document, StringField, ReferenceField, DateTimeField, ListField, BooleanField, ValidationError, EmailField,IntField
+from mongoengine import Document, StringField, ReferenceField, DateTimeField, ListField, BooleanField, ValidationError, EmailField,IntField, ObjectIdField, BinaryField
 from datetime import datetime
 from django.utils.text import slugify
-from django.contrib.auth.hashers import make_password
 from django.db.models.signals import post_save
 from django.dispatch import receiver
+from django.conf import settings
+from core.ids import prefixed_slug
+from core.cache import user_cache, settings_cache
+from core.passwords import hash_password, verify_password
 
 
 class User(Document):
@@ -19,10 +22,35 @@ class User(Document):
         if len(self.password) < 8:
             raise ValidationError("Password must be at least 8 characters long.")
 
+    def set_password(self, raw_password):
+        self.password = hash_password(raw_password)
+        self._password_hashed = True
+
     def save(self, *args, **kwargs):
-        if self.password:
-            self.password = make_password(self.password)  
-        super(User, self).save(*args, **kwargs)
+        # Hash only a newly assigned raw password, never the stored hash again
+        created = self.pk is None
+        password_changed = created or 'password' in self._get_changed_fields()
+        if self.password and password_changed and not getattr(self, '_password_hashed', False):
+            self.password = hash_password(self.password)
+        doc = super(User, self).save(*args, **kwargs)
+        self._password_hashed = False
+        if not created:
+            # A new user cannot be cached anywhere yet, so registration publishes nothing
+            user_cache.invalidate(str(self.id))
+        return doc
+
+    def check_password(self, raw_password):
+        """Verify ``raw_password``, upgrading the stored hash if the hasher's settings changed."""
+        def rehash(raw):
+            self.set_password(raw)
+            User.objects(id=self.id).update_one(set__password=self.password)
+            self._password_hashed = False
+            user_cache.invalidate(str(self.id))
+        return verify_password(raw_password, self.password, rehash)
+
+    def delete(self, *args, **kwargs):
+        super(User, self).delete(*args, **kwargs)
+        user_cache.invalidate(str(self.id))
 
     @property
     def is_authenticated(self):
@@ -46,37 +74,76 @@ class Settings(Document):
     model = StringField(max_length=100, choices=model_choices, default='llama3-8b-8192')
     max_tokens = IntField(default=200)
     customize_response = StringField(default="You are an intelligent assistant. Please provide informative and helpful responses.")
+    use_response_cache = BooleanField(default=True)
 
     def __str__(self):
         return f"Settings for {self.user.username}"
 
+    def save(self, *args, **kwargs):
+        created = self.pk is None
+        doc = super(Settings, self).save(*args, **kwargs)
+        if not created:
+            settings_cache.invalidate(str(self.to_mongo()['user']))
+        return doc
+
+    def delete(self, *args, **kwargs):
+        super(Settings, self).delete(*args, **kwargs)
+        settings_cache.invalidate(str(self.to_mongo()['user']))
+
     meta = {
         'indexes': [
             {'fields': ['user'], 'unique': True}  # Ensure unique user reference
         ]
     }
 
+# Length of ChatThread.last_message_preview
+PREVIEW_LENGTH = 120
+
+# Per-user text indexes backing core.search; the local search index only needs (user, _id)
+# to pull each user's newest messages
+SEARCH_TEXT_INDEXES = {
+    'title': [{'fields': ['user', '$title'], 'name': 'user_title_text'}],
+    'message': [{
+        'fields': ['user', '$message', '$response'],
+        'weights': {'message': 2, 'response': 1},
+        'name': 'user_message_text',
+    }],
+} if settings.SEARCH_BACKEND == 'mongo' else {'title': [], 'message': [{'fields': ['user', 'id']}]}
+
+
 class ChatThread(Document):
     title = StringField(max_length=100)
     slug = StringField(blank=True, null=True, unique=True)
     user = ReferenceField(User, null=True, reverse_delete_rule=4)
     created_at = DateTimeField(default=datetime.utcnow)
+    # Rolling digest of older turns, covering messages up to and including summarized_until
+    summary = StringField()
+    summarized_until = DateTimeField()
+    # Denormalized activity for the sidebar, updated atomically with each new message
+    message_count = IntField(default=0)
+    last_message_at = DateTimeField()
+    last_message_preview = StringField()
+    # Set while the thread's messages live in cold storage (core.archive); cleared on rehydration
+    archived_at = DateTimeField()
+    archive_location = StringField()
 
     def save(self, *args, **kwargs):
         if self.title and not self.slug:
             self.slug = self._generate_slug()
-        super(ChatThread, self).save(*args, **kwargs)
+        if not self.last_message_at:
+            self.last_message_at = self.created_at
+        return super(ChatThread, self).save(*args, **kwargs)
 
     def _generate_slug(self):
-        base_slug = slugify(self.title)
-        timestamp = datetime.utcnow().strftime('%Y%m%d%H%M%S')  # Format as YYYYMMDDHHMMSS
-        unique_slug = f"{base_slug}-{timestamp}"
-        return unique_slug
+        # Older slugs end in a YYYYMMDDHHMMSS timestamp; they are stored as-is and still resolve
+        return prefixed_slug(slugify(self.title))
 
     meta = {
         'ordering': ['-created_at'],
         'indexes': [
-            {'fields': ['slug'], 'unique': True}
+            {'fields': ['slug'], 'unique': True},
+            {'fields': ['user', '-last_message_at', '-id']},
+            *SEARCH_TEXT_INDEXES['title']
         ]
     }
 
@@ -93,18 +160,17 @@ class ChatMessage(Document):
     def save(self, *args, **kwargs):
         if self.message and not self.slug:  
             self.slug = self._generate_slug()
-        super(ChatMessage, self).save(*args, **kwargs)
+        return super(ChatMessage, self).save(*args, **kwargs)
 
     def _generate_slug(self):
-        base_slug = slugify(self.message[:30])  # Use the first 30 characters of the message for the slug
-        timestamp = datetime.utcnow().strftime('%Y%m%d%H%M%S')  # Format as YYYYMMDDHHMMSS
-        unique_slug = f"{base_slug}-{timestamp}"
-        return unique_slug
+        return prefixed_slug(slugify(self.message[:30]))  # Use the first 30 characters of the message for the slug
 
     meta = {
         'ordering': ['timestamp'],
         'indexes': [
-            {'fields': ['slug'], 'unique': True}
+            {'fields': ['slug'], 'unique': True},
+            {'fields': ['thread', '-timestamp', '-id']},
+            *SEARCH_TEXT_INDEXES['message']
         ]
     }
 
@@ -112,3 +178,78 @@ class ChatMessage(Document):
         return self.slug
 
 
+class CachedResponse(Document):
+    key = StringField(required=True, unique=True)  # core.response_cache.response_cache_key
+    model = StringField()
+    response = StringField()
+    created_at = DateTimeField(default=datetime.utcnow)
+
+    meta = {
+        'indexes': [
+            {'fields': ['created_at'], 'expireAfterSeconds': settings.RESPONSE_CACHE_TTL}
+        ]
+    }
+
+
+class TokenUsage(Document):
+    # Hourly token usage per user and model, written in batches by core.quotas
+    user = ReferenceField(User, required=True)
+    model = StringField(required=True)
+    hour = DateTimeField(required=True)
+    prompt_tokens = IntField(default=0)
+    completion_tokens = IntField(default=0)
+    requests = IntField(default=0)
+
+    meta = {
+        'indexes': [
+            {'fields': ['user', 'model', 'hour'], 'unique': True},
+            {'fields': ['hour'], 'expireAfterSeconds': settings.USAGE_RETENTION_DAYS * 86400}
+        ]
+    }
+
+
+class ThreadArchive(Document):
+    # Compressed messages of an archived thread, split into parts below the BSON size limit
+    thread = ObjectIdField(required=True)
+    user = ObjectIdField()
+    part = IntField(default=0)
+    message_count = IntField(default=0)
+    data = BinaryField()
+    created_at = DateTimeField(default=datetime.utcnow)
+
+    meta = {
+        'indexes': [
+            {'fields': ['thread', 'part'], 'unique': True},
+            {'fields': ['user']}
+        ]
+    }
+
+
+class DeletionJob(Document):
+    # Progress of a thread or account deletion run by core.deletion; polled with its key
+    key = StringField(required=True, unique=True)
+    kind = StringField(required=True, choices=('thread', 'account'))
+    user = ObjectIdField(required=True)
+    thread = ObjectIdField()
+    archive_location = StringField()
+    status = StringField(default='pending', choices=('pending', 'running', 'done', 'failed'))
+    messages_total = IntField(default=0)
+    messages_deleted = IntField(default=0)
+    threads_deleted = IntField(default=0)
+    error = StringField()
+    created_at = DateTimeField(default=datetime.utcnow)
+    finished_at = DateTimeField()
+
+    meta = {
+        'indexes': [
+            {'fields': ['key'], 'unique': True},
+            {'fields': ['status']},
+            {'fields': ['created_at'], 'expireAfterSeconds': settings.DELETION_JOB_RETENTION_DAYS * 86400}
+        ]
+    }
+
+
+class VersionStamp(Document):
+    # Counters bumped on every write to a user's threads, for cheap ETags (core.versions)
+    key = StringField(primary_key=True)
+    version = IntField(default=0)
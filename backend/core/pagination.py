@@ -0,0 +1,50 @@
+import base64
+import json
+from datetime import datetime
+from bson import ObjectId
+from bson.errors import InvalidId
+from django.conf import settings
+from mongoengine.queryset.visitor import Q
+
+
+def encode_cursor(value, pk):
+    payload = json.dumps({"v": value.isoformat(), "id": str(pk)}, separators=(',', ':'))
+    return base64.urlsafe_b64encode(payload.encode()).decode().rstrip('=')
+
+
+def decode_cursor(cursor):
+    """Return the ``(datetime, ObjectId)`` position encoded in ``cursor``; raises ``ValueError``."""
+    try:
+        padded = cursor + '=' * (-len(cursor) % 4)
+        payload = json.loads(base64.urlsafe_b64decode(padded.encode()))
+        return datetime.fromisoformat(payload["v"]), ObjectId(payload["id"])
+    except (TypeError, KeyError, InvalidId, ValueError) as e:
+        raise ValueError("Invalid cursor.") from e
+
+
+def get_page_size(request):
+    try:
+        limit = int(request.query_params.get('limit', settings.PAGE_SIZE))
+    except ValueError:
+        limit = settings.PAGE_SIZE
+    return max(1, min(limit, settings.MAX_PAGE_SIZE))
+
+
+def keyset_page(queryset, field, cursor, limit):
+    """Newest-first page of ``queryset`` ordered by ``(field, _id)``, starting after ``cursor``.
+
+    Seeks with a range predicate instead of skip, so every page is one index range scan no
+    matter how deep it is. Returns ``(documents, next_cursor)``; ``next_cursor`` is None on
+    the last page.
+    """
+    if cursor:
+        value, pk = decode_cursor(cursor)
+        queryset = queryset.filter(Q(**{f'{field}__lt': value}) | Q(**{field: value, 'id__lt': pk}))
+
+    documents = list(queryset.order_by(f'-{field}', '-id').limit(limit + 1))
+    next_cursor = None
+    if len(documents) > limit:
+        documents = documents[:limit]
+        last = documents[-1]
+        next_cursor = encode_cursor(getattr(last, field), last.id)
+    return documents, next_cursor
@@ -0,0 +1,43 @@
+"""Password hashing off the request threads.
+
+PBKDF2 is deliberately slow, and a burst of logins or registrations can keep every request
+thread busy hashing. With ``PASSWORD_HASH_WORKERS`` set, hashing and verification run on a
+bounded pool instead: at most that many hashes are computed at once, and other requests keep
+their CPU share. hashlib releases the GIL while hashing, so threads are enough. With 0 (the
+default) hashing runs inline.
+"""
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from django.conf import settings
+from django.contrib.auth.hashers import make_password, check_password
+
+_executor = None
+_lock = threading.Lock()
+
+
+def _get_executor():
+    global _executor
+    if _executor is None:
+        with _lock:
+            if _executor is None:
+                _executor = ThreadPoolExecutor(max_workers=settings.PASSWORD_HASH_WORKERS, thread_name_prefix='password-hash')
+    return _executor
+
+
+def _run(fn, *args):
+    if not settings.PASSWORD_HASH_WORKERS:
+        return fn(*args)
+    return _get_executor().submit(fn, *args).result()
+
+
+def hash_password(raw_password):
+    return _run(make_password, raw_password)
+
+
+def verify_password(raw_password, encoded, setter=None):
+    """``check_password`` on the pool; ``setter`` runs on the caller's thread, as Django calls it."""
+    upgrades = []
+    valid = _run(check_password, raw_password, encoded, upgrades.append if setter else None)
+    if valid and upgrades:
+        setter(upgrades[0])
+    return valid
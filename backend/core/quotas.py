@@ -0,0 +1,270 @@
+"""Per-user rate limits and rolling daily token quotas.
+
+Checks run against in-process state only. A user's last 24 hours of usage is read from the
+TokenUsage collection the first time this process sees them (and again every
+``USAGE_REFRESH_INTERVAL`` seconds to pick up other workers' usage). New usage is counted
+locally and flushed to Mongo in one bulk write every ``USAGE_FLUSH_INTERVAL`` seconds; a reload
+waits for a flush in progress, so usage being written is never missing from the window.
+Request-rate buckets are per process.
+"""
+import atexit
+import math
+import threading
+import time
+from datetime import datetime, timedelta
+from bson import ObjectId
+from django.conf import settings
+from pymongo import UpdateOne
+from core.context import estimate_tokens
+from core.models import TokenUsage
+
+WINDOW = timedelta(hours=24)
+
+
+class RateLimited(Exception):
+    def __init__(self, retry_after, detail):
+        self.retry_after = max(1, math.ceil(retry_after))
+        self.detail = detail
+        super().__init__(detail)
+
+
+class TokenBucket:
+    def __init__(self, rate, capacity):
+        self.rate = rate  # tokens per second
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+
+    def wait(self):
+        """Seconds until a token is available, 0 if one is available now."""
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        return 0 if self.tokens >= 1 else (1 - self.tokens) / self.rate
+
+    def take(self):
+        """Take one token; returns 0 on success, else seconds until one is available."""
+        wait = self.wait()
+        if not wait:
+            self.tokens -= 1
+        return wait
+
+
+def current_hour():
+    return datetime.utcnow().replace(minute=0, second=0, microsecond=0)
+
+
+def usage_tokens(usage, messages, content):
+    """(prompt, completion) token counts from a completion's ``usage``, estimated when absent."""
+    if usage is not None:
+        return usage.prompt_tokens or 0, usage.completion_tokens or 0
+    prompt = sum(estimate_tokens(message["content"]) for message in messages)
+    return prompt, estimate_tokens(content)
+
+
+class _UserUsage:
+    def __init__(self):
+        # {model: {hour: [prompt_tokens, completion_tokens, requests]}}
+        self.persisted = {}
+        self.pending = {}
+        self.loaded_at = 0
+
+    def hours(self, model=None):
+        totals = {}
+        for source in (self.persisted, self.pending):
+            for source_model, hours in source.items():
+                if model is not None and source_model != model:
+                    continue
+                for hour, counts in hours.items():
+                    total = totals.setdefault(hour, [0, 0, 0])
+                    for i, value in enumerate(counts):
+                        total[i] += value
+        return totals
+
+
+class UsageLimiter:
+    def __init__(self):
+        self._lock = threading.Lock()
+        # A reload must not replace ``persisted`` with database contents that lack counts a
+        # flush has taken from ``pending`` but not written yet: reloads wait for an in-flight
+        # flush, and a flush waits for the reloads already reading (new ones queue behind it)
+        self._changed = threading.Condition(self._lock)
+        self._flushing = False
+        self._reloading = 0
+        self._users = {}
+        self._buckets = {}
+        self._flusher = None
+
+    def _start_flusher(self):
+        with self._lock:
+            if self._flusher is None:
+                self._flusher = threading.Thread(target=self._flush_loop, daemon=True, name='usage-flush')
+                self._flusher.start()
+                atexit.register(self.flush)
+
+    def _flush_loop(self):
+        while True:
+            time.sleep(settings.USAGE_FLUSH_INTERVAL)
+            try:
+                self.flush()
+            except Exception as e:
+                print(f"Error flushing token usage: {str(e)}")
+
+    def _user_usage(self, user_id):
+        """The user's usage state, (re)loaded from Mongo when missing or stale."""
+        with self._lock:
+            state = self._users.get(user_id)
+            if state is not None and time.monotonic() - state.loaded_at < settings.USAGE_REFRESH_INTERVAL:
+                return state
+            while self._flushing:
+                self._changed.wait()
+            self._reloading += 1
+
+        loaded = None
+        try:
+            loaded = {}
+            since = current_hour() - WINDOW
+            for row in TokenUsage.objects(user=ObjectId(user_id), hour__gt=since).as_pymongo():
+                loaded.setdefault(row['model'], {})[row['hour']] = [
+                    row.get('prompt_tokens', 0), row.get('completion_tokens', 0), row.get('requests', 0)
+                ]
+        except Exception:
+            loaded = None
+            raise
+        finally:
+            with self._lock:
+                # Replaced before a waiting flush can move more counts into ``persisted``
+                if loaded is not None:
+                    state = self._users.setdefault(user_id, _UserUsage())
+                    state.persisted = loaded
+                    state.loaded_at = time.monotonic()
+                self._reloading -= 1
+                self._changed.notify_all()
+        return state
+
+    def _window_tokens(self, hours):
+        since = current_hour() - WINDOW
+        used = sum(p + c for hour, (p, c, _) in hours.items() if hour > since)
+        live = [hour for hour in hours if hour > since]
+        # Quota frees up as the oldest hour in the window rolls off
+        retry_after = ((min(live) + WINDOW + timedelta(hours=1)) - datetime.utcnow()).total_seconds() if live else 0
+        return used, retry_after
+
+    def check(self, user_id, model):
+        """Raise RateLimited if the user may not start another completion on ``model`` now."""
+        self.take_requests(user_id, [model])
+        self.check_quota(user_id, model)
+
+    def take_requests(self, user_id, models):
+        """Count one request against each of ``models``' rate buckets, all or none.
+
+        Raises RateLimited, taking nothing, if any bucket is empty. A batch calls this once
+        for the distinct models it uses, so its items are not rate limited one by one.
+        """
+        user_id = str(user_id)
+        self._start_flusher()
+        with self._lock:
+            buckets = []
+            for model in set(models):
+                bucket = self._buckets.get((user_id, model))
+                if bucket is None:
+                    bucket = self._buckets[(user_id, model)] = TokenBucket(
+                        settings.RATE_LIMIT_REQUESTS_PER_MINUTE / 60, settings.RATE_LIMIT_BURST
+                    )
+                buckets.append(bucket)
+            wait = max(bucket.wait() for bucket in buckets)
+            if not wait:
+                for bucket in buckets:
+                    bucket.take()
+        if wait:
+            raise RateLimited(wait, "Too many chat requests. Slow down.")
+
+    def check_quota(self, user_id, model):
+        """Raise RateLimited if the user has used up their daily tokens, overall or on ``model``."""
+        user_id = str(user_id)
+        state = self._user_usage(user_id)
+        with self._lock:
+            daily_quota = settings.DAILY_TOKEN_QUOTA
+            if daily_quota:
+                used, retry_after = self._window_tokens(state.hours())
+                if used >= daily_quota:
+                    raise RateLimited(retry_after, "Daily token quota exceeded.")
+            model_quota = settings.MODEL_DAILY_TOKEN_QUOTAS.get(model)
+            if model_quota:
+                used, retry_after = self._window_tokens(state.hours(model))
+                if used >= model_quota:
+                    raise RateLimited(retry_after, f"Daily token quota for {model} exceeded.")
+
+    def record(self, user_id, model, prompt_tokens, completion_tokens):
+        user_id = str(user_id)
+        hour = current_hour()
+        with self._lock:
+            state = self._users.setdefault(user_id, _UserUsage())
+            counts = state.pending.setdefault(model, {}).setdefault(hour, [0, 0, 0])
+            counts[0] += prompt_tokens
+            counts[1] += completion_tokens
+            counts[2] += 1
+
+    def record_completion(self, user_id, completion, messages):
+        """Charge a routed Completion to the model that actually served it."""
+        prompt_tokens, completion_tokens = usage_tokens(completion.usage, messages, completion.content)
+        self.record(user_id, completion.model, prompt_tokens, completion_tokens)
+
+    def flush(self):
+        """Write all pending usage to Mongo in one unordered bulk upsert."""
+        with self._lock:
+            while self._flushing:
+                self._changed.wait()
+            self._flushing = True
+            while self._reloading:
+                self._changed.wait()
+            batch = []
+            for user_id, state in self._users.items():
+                for model, hours in state.pending.items():
+                    for hour, counts in hours.items():
+                        batch.append((user_id, model, hour, counts))
+                        persisted = state.persisted.setdefault(model, {}).setdefault(hour, [0, 0, 0])
+                        for i, value in enumerate(counts):
+                            persisted[i] += value
+                state.pending = {}
+        try:
+            if batch:
+                TokenUsage._get_collection().bulk_write([
+                    UpdateOne(
+                        {'user': ObjectId(user_id), 'model': model, 'hour': hour},
+                        {'$inc': {'prompt_tokens': p, 'completion_tokens': c, 'requests': r}},
+                        upsert=True,
+                    )
+                    for user_id, model, hour, (p, c, r) in batch
+                ], ordered=False)
+        finally:
+            with self._lock:
+                self._flushing = False
+                self._changed.notify_all()
+        return len(batch)
+
+    def summary(self, user_id):
+        state = self._user_usage(str(user_id))
+        since = current_hour() - WINDOW
+        with self._lock:
+            models = set(state.persisted) | set(state.pending)
+            by_model = {}
+            for model in sorted(models):
+                hours = {hour: counts for hour, counts in state.hours(model).items() if hour > since}
+                by_model[model] = {
+                    "prompt_tokens": sum(p for p, _, _ in hours.values()),
+                    "completion_tokens": sum(c for _, c, _ in hours.values()),
+                    "requests": sum(r for _, _, r in hours.values()),
+                    "daily_quota": settings.MODEL_DAILY_TOKEN_QUOTAS.get(model),
+                }
+        total = sum(m["prompt_tokens"] + m["completion_tokens"] for m in by_model.values())
+        return {
+            "window_hours": int(WINDOW.total_seconds() // 3600),
+            "total_tokens": total,
+            "daily_quota": settings.DAILY_TOKEN_QUOTA or None,
+            "remaining": max(0, settings.DAILY_TOKEN_QUOTA - total) if settings.DAILY_TOKEN_QUOTA else None,
+            "models": by_model,
+        }
+
+
+limiter = UsageLimiter()
@@ -0,0 +1,108 @@
+import hashlib
+import json
+import re
+import threading
+from datetime import datetime
+from django.conf import settings
+from core.cache import TTLCache
+from core.models import CachedResponse
+
+_WHITESPACE_RE = re.compile(r"\s+")
+
+
+def normalize_text(text):
+    return _WHITESPACE_RE.sub(" ", text or "").strip()
+
+
+def response_cache_key(messages, model_choice, max_tokens):
+    """Hash of everything that determines the completion: model, prompt and context, max_tokens.
+
+    Whitespace is collapsed throughout and the question is case-folded, so trivially
+    different spellings of the same prompt share an entry.
+    """
+    normalized = [{"role": m["role"], "content": normalize_text(m["content"])} for m in messages]
+    if normalized and normalized[-1]["role"] == "user":
+        normalized[-1]["content"] = normalized[-1]["content"].casefold()
+    payload = json.dumps([model_choice, max_tokens, normalized], separators=(',', ':'), ensure_ascii=False)
+    return hashlib.sha256(payload.encode()).hexdigest()
+
+
+class MemoryResponseCache:
+    """Per-process LRU of recent responses."""
+
+    def __init__(self, maxsize, ttl):
+        self._cache = TTLCache('responses', maxsize, ttl)
+
+    def get(self, key):
+        return self._cache.get(key)
+
+    def set(self, key, response, model_choice):
+        self._cache.set(key, {"response": response, "model": model_choice, "cached_at": datetime.utcnow()})
+
+    def stats(self):
+        return self._cache.stats()
+
+
+class MongoResponseCache:
+    """Responses shared by every process, expired by a TTL index on ``created_at``."""
+
+    def get(self, key):
+        entry = CachedResponse.objects(key=key).only('response', 'model', 'created_at').as_pymongo().first()
+        if entry is None:
+            return None
+        return {"response": entry['response'], "model": entry.get('model'), "cached_at": entry['created_at']}
+
+    def set(self, key, response, model_choice):
+        CachedResponse.objects(key=key).update_one(
+            set__response=response,
+            set__model=model_choice,
+            set__created_at=datetime.utcnow(),
+            upsert=True,
+        )
+
+
+_backend = None
+_lock = threading.Lock()
+
+
+def get_response_cache():
+    """The configured backend, or None when RESPONSE_CACHE_BACKEND is unset (the default)."""
+    global _backend
+    if _backend is None and settings.RESPONSE_CACHE_BACKEND:
+        with _lock:
+            if _backend is None:
+                if settings.RESPONSE_CACHE_BACKEND == 'mongo':
+                    _backend = MongoResponseCache()
+                elif settings.RESPONSE_CACHE_BACKEND == 'memory':
+                    _backend = MemoryResponseCache(settings.RESPONSE_CACHE_SIZE, settings.RESPONSE_CACHE_TTL)
+                else:
+                    raise ValueError(f"Unknown RESPONSE_CACHE_BACKEND: {settings.RESPONSE_CACHE_BACKEND}")
+    return _backend
+
+
+def lookup_cached_response(user_settings, messages, model_choice, max_tokens):
+    """Return ``(key, entry)``; ``key`` is None when caching does not apply to this request."""
+    cache = get_response_cache()
+    if cache is None or not user_settings.use_response_cache:
+        return None, None
+    key = response_cache_key(messages, model_choice, max_tokens)
+    try:
+        return key, cache.get(key)
+    except Exception as e:
+        print(f"Error reading response cache: {str(e)}")
+        return key, None
+
+
+def store_cached_response(key, response, model_choice):
+    if key is None or not response or response.startswith("Error:"):
+        return
+    try:
+        get_response_cache().set(key, response, model_choice)
+    except Exception as e:
+        print(f"Error writing response cache: {str(e)}")
+
+
+def cache_metadata(entry):
+    if entry is None:
+        return {"hit": False}
+    return {"hit": True, "cached_at": entry["cached_at"].isoformat()}
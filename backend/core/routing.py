@@ -0,0 +1,350 @@
+"""Model routing for chat completions.
+
+Each request goes to the user's model unless its circuit breaker is open, falls back to the
+configured sibling model (``MODEL_FALLBACKS``) when an attempt fails, and optionally hedges:
+when the first attempt has not produced a token within the model's p95 time-to-first-token,
+a second attempt is started and whichever finishes first wins.
+"""
+import asyncio
+import threading
+import time
+from collections import deque, namedtuple
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from django.conf import settings
+from core.llm import create_chat_completion, acreate_chat_completion
+from core.metrics import observe_completion, observe_llm_error
+
+Completion = namedtuple('Completion', ['content', 'model', 'usage', 'ttft', 'latency'])
+
+
+class AllModelsFailed(Exception):
+    def __init__(self, errors):
+        self.errors = errors
+        super().__init__("; ".join(f"{model}: {error}" for model, error in errors) or "No model available.")
+
+
+class AttemptCancelled(Exception):
+    pass
+
+
+def percentile(values, q):
+    if not values:
+        return None
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+
+
+class CircuitBreaker:
+    """Opens after ``failure_threshold`` consecutive failures and lets one trial call through
+    every ``reset_timeout`` seconds until a call succeeds again."""
+
+    def __init__(self, failure_threshold, reset_timeout):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.failures = 0
+        self.opened_at = None
+        self._lock = threading.Lock()
+
+    @property
+    def state(self):
+        if self.opened_at is None:
+            return 'closed'
+        if time.monotonic() - self.opened_at >= self.reset_timeout:
+            return 'half-open'
+        return 'open'
+
+    def allow(self):
+        with self._lock:
+            if self.opened_at is None:
+                return True
+            if time.monotonic() - self.opened_at >= self.reset_timeout:
+                # Half-open: admit this call as the trial and hold the rest back for another period
+                self.opened_at = time.monotonic()
+                return True
+            return False
+
+    def record_success(self):
+        with self._lock:
+            self.failures = 0
+            self.opened_at = None
+
+    def record_failure(self):
+        with self._lock:
+            self.failures += 1
+            if self.failures >= self.failure_threshold:
+                self.opened_at = time.monotonic()
+
+
+class ModelHealth:
+    def __init__(self, model):
+        self.model = model
+        self.breaker = CircuitBreaker(settings.CIRCUIT_FAILURE_THRESHOLD, settings.CIRCUIT_RESET_TIMEOUT)
+        self.latencies = deque(maxlen=settings.ROUTER_LATENCY_WINDOW)
+        self.ttfts = deque(maxlen=settings.ROUTER_LATENCY_WINDOW)
+        self.requests = 0
+        self.errors = 0
+        self.hedges = 0
+
+    def record_success(self, completion):
+        observe_completion(completion)
+        self.requests += 1
+        self.latencies.append(completion.latency)
+        self.ttfts.append(completion.ttft)
+        self.breaker.record_success()
+
+    def record_failure(self):
+        observe_llm_error(self.model)
+        self.requests += 1
+        self.errors += 1
+        self.breaker.record_failure()
+
+    def hedge_delay(self):
+        """p95 time-to-first-token once enough samples exist, else None (no hedging)."""
+        if len(self.ttfts) < settings.ROUTER_HEDGE_MIN_SAMPLES:
+            return None
+        return percentile(list(self.ttfts), 0.95)
+
+    def stats(self):
+        latencies, ttfts = list(self.latencies), list(self.ttfts)
+        return {
+            "requests": self.requests,
+            "errors": self.errors,
+            "hedges": self.hedges,
+            "circuit": self.breaker.state,
+            "latency_p50": percentile(latencies, 0.5),
+            "latency_p95": percentile(latencies, 0.95),
+            "ttft_p50": percentile(ttfts, 0.5),
+            "ttft_p95": percentile(ttfts, 0.95),
+        }
+
+
+class ModelRouter:
+    def __init__(self):
+        self._health = {}
+        self._lock = threading.Lock()
+        self._executor = None
+
+    def health(self, model_choice):
+        with self._lock:
+            if model_choice not in self._health:
+                self._health[model_choice] = ModelHealth(model_choice)
+            return self._health[model_choice]
+
+    def candidates(self, model_choice):
+        models = [model_choice]
+        fallback = settings.MODEL_FALLBACKS.get(model_choice)
+        if fallback and fallback != model_choice:
+            models.append(fallback)
+        return models
+
+    def _get_executor(self):
+        if self._executor is None:
+            with self._lock:
+                if self._executor is None:
+                    self._executor = ThreadPoolExecutor(max_workers=settings.ROUTER_HEDGE_WORKERS, thread_name_prefix='hedge')
+        return self._executor
+
+    def _attempt(self, model_choice, messages, max_tokens, first_token, cancelled):
+        start = time.monotonic()
+        ttft = None
+        usage = None
+        parts = []
+        stream = create_chat_completion(messages, model_choice, max_tokens, stream=True)
+        try:
+            for chunk in stream:
+                if cancelled.is_set():
+                    raise AttemptCancelled()
+                x_groq = getattr(chunk, 'x_groq', None)
+                if x_groq is not None and x_groq.usage is not None:
+                    usage = x_groq.usage
+                if chunk.choices and chunk.choices[0].delta.content:
+                    if ttft is None:
+                        ttft = time.monotonic() - start
+                        first_token.set()
+                    parts.append(chunk.choices[0].delta.content)
+        finally:
+            stream.close()
+        latency = time.monotonic() - start
+        return Completion("".join(parts), model_choice, usage, ttft if ttft is not None else latency, latency)
+
+    def _complete_on(self, model_choice, messages, max_tokens):
+        health = self.health(model_choice)
+        hedge_delay = health.hedge_delay() if settings.ROUTER_HEDGE_ENABLED else None
+        cancelled = threading.Event()
+
+        if hedge_delay is None:
+            completion = self._attempt(model_choice, messages, max_tokens, threading.Event(), cancelled)
+            health.record_success(completion)
+            return completion
+
+        executor = self._get_executor()
+        first_token = threading.Event()
+        primary = executor.submit(self._attempt, model_choice, messages, max_tokens, first_token, cancelled)
+        # Finishing also ends the wait, so an attempt that fails fast falls back without the delay
+        primary.add_done_callback(lambda _: first_token.set())
+        pending = {primary}
+        if not first_token.wait(hedge_delay) and not primary.done():
+            health.hedges += 1
+            pending.add(executor.submit(self._attempt, model_choice, messages, max_tokens, threading.Event(), cancelled))
+
+        error = None
+        try:
+            while pending:
+                done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    if future.exception() is None:
+                        completion = future.result()
+                        health.record_success(completion)
+                        return completion
+                    error = future.exception()
+            raise error
+        finally:
+            # Stop the losing attempt at its next chunk
+            cancelled.set()
+
+    def complete(self, messages, model_choice, max_tokens):
+        """Blocking completion with breakers, fallback and optional hedging; returns a Completion."""
+        errors = []
+        for model in self.candidates(model_choice):
+            health = self.health(model)
+            if not health.breaker.allow():
+                errors.append((model, "circuit open"))
+                continue
+            try:
+                return self._complete_on(model, messages, max_tokens)
+            except Exception as e:
+                health.record_failure()
+                errors.append((model, str(e)))
+        raise AllModelsFailed(errors)
+
+    async def _aattempt(self, model_choice, messages, max_tokens, first_token):
+        start = time.monotonic()
+        ttft = None
+        usage = None
+        parts = []
+        stream = await acreate_chat_completion(messages, model_choice, max_tokens, stream=True)
+        try:
+            async for chunk in stream:
+                x_groq = getattr(chunk, 'x_groq', None)
+                if x_groq is not None and x_groq.usage is not None:
+                    usage = x_groq.usage
+                if chunk.choices and chunk.choices[0].delta.content:
+                    if ttft is None:
+                        ttft = time.monotonic() - start
+                        first_token.set()
+                    parts.append(chunk.choices[0].delta.content)
+        finally:
+            await stream.close()
+        latency = time.monotonic() - start
+        return Completion("".join(parts), model_choice, usage, ttft if ttft is not None else latency, latency)
+
+    async def _acomplete_on(self, model_choice, messages, max_tokens):
+        health = self.health(model_choice)
+        hedge_delay = health.hedge_delay() if settings.ROUTER_HEDGE_ENABLED else None
+
+        if hedge_delay is None:
+            completion = await self._aattempt(model_choice, messages, max_tokens, asyncio.Event())
+            health.record_success(completion)
+            return completion
+
+        first_token = asyncio.Event()
+        pending = {asyncio.ensure_future(self._aattempt(model_choice, messages, max_tokens, first_token))}
+        waiter = asyncio.ensure_future(first_token.wait())
+        done, _ = await asyncio.wait({waiter, *pending}, timeout=hedge_delay, return_when=asyncio.FIRST_COMPLETED)
+        waiter.cancel()
+        if not done:
+            health.hedges += 1
+            pending.add(asyncio.ensure_future(self._aattempt(model_choice, messages, max_tokens, asyncio.Event())))
+
+        error = None
+        try:
+            while pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    if task.exception() is None:
+                        completion = task.result()
+                        health.record_success(completion)
+                        return completion
+                    error = task.exception()
+            raise error
+        finally:
+            for task in pending:
+                task.cancel()
+
+    async def acomplete(self, messages, model_choice, max_tokens):
+        """Async counterpart of ``complete``."""
+        errors = []
+        for model in self.candidates(model_choice):
+            health = self.health(model)
+            if not health.breaker.allow():
+                errors.append((model, "circuit open"))
+                continue
+            try:
+                return await self._acomplete_on(model, messages, max_tokens)
+            except Exception as e:
+                health.record_failure()
+                errors.append((model, str(e)))
+        raise AllModelsFailed(errors)
+
+    async def astream(self, messages, model_choice, max_tokens, on_complete=None):
+        """Yield text deltas, falling back to the sibling model if a stream fails before its
+        first token. Failures after output has started are raised to the caller.
+
+        ``on_complete`` is called with the finished Completion (including ``usage``). If the
+        consumer stops early (a client disconnect closes this generator), it is called with
+        the partial Completion instead, so the tokens streamed so far are still charged.
+        """
+        errors = []
+        for model in self.candidates(model_choice):
+            health = self.health(model)
+            if not health.breaker.allow():
+                errors.append((model, "circuit open"))
+                continue
+
+            start = time.monotonic()
+            ttft = None
+            usage = None
+            parts = []
+            stream = None
+            try:
+                stream = await acreate_chat_completion(messages, model, max_tokens, stream=True)
+                async for chunk in stream:
+                    x_groq = getattr(chunk, 'x_groq', None)
+                    if x_groq is not None and x_groq.usage is not None:
+                        usage = x_groq.usage
+                    if chunk.choices and chunk.choices[0].delta.content:
+                        if ttft is None:
+                            ttft = time.monotonic() - start
+                        parts.append(chunk.choices[0].delta.content)
+                        yield chunk.choices[0].delta.content
+            except (GeneratorExit, asyncio.CancelledError):
+                if parts and on_complete is not None:
+                    # usage only arrives with the last chunk, so this charge is estimated
+                    on_complete(Completion("".join(parts), model, usage, ttft, time.monotonic() - start))
+                raise
+            except Exception as e:
+                health.record_failure()
+                if ttft is not None:
+                    raise
+                errors.append((model, str(e)))
+                continue
+            finally:
+                if stream is not None:
+                    # Closing the stream stops generation upstream when the consumer goes away early
+                    await stream.close()
+
+            latency = time.monotonic() - start
+            completion = Completion("".join(parts), model, usage, ttft if ttft is not None else latency, latency)
+            health.record_success(completion)
+            if on_complete is not None:
+                on_complete(completion)
+            return
+        raise AllModelsFailed(errors)
+
+    def stats(self):
+        with self._lock:
+            items = list(self._health.items())
+        return {model: health.stats() for model, health in items}
+
+
+router = ModelRouter()
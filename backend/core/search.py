@@ -0,0 +1,337 @@
+"""Search over a user's chat history.
+
+``SEARCH_BACKEND = 'mongo'`` (the default) uses the text indexes on ChatMessage
+(message/response) and ChatThread (title), both prefixed by ``user`` so a query only touches
+the requesting user's entries. Mongo text search matches whole words and their stems.
+
+``SEARCH_BACKEND = 'local'`` is for deployments without text indexes: an in-process inverted
+index per user, built from a projected scan on that user's first search, caught up with
+newer messages on each search and rebuilt every ``SEARCH_INDEX_TTL`` seconds. It also matches the last query term as a prefix, for search-as-you-type.
+"""
+import base64
+import html
+import json
+import math
+import re
+import threading
+import time
+from bisect import bisect_left
+from datetime import timedelta
+from bson import ObjectId
+from bson.errors import InvalidId
+from django.conf import settings
+from core.db import secondary_reads
+from core.models import ChatThread, ChatMessage
+
+_TERM_RE = re.compile(r"\w+", re.UNICODE)
+SNIPPET_RADIUS = 60
+
+
+def tokenize(text):
+    return [term.casefold() for term in _TERM_RE.findall(text or '')]
+
+
+def encode_search_cursor(score, pk):
+    payload = json.dumps({"s": score, "id": str(pk)}, separators=(',', ':'))
+    return base64.urlsafe_b64encode(payload.encode()).decode().rstrip('=')
+
+
+def decode_search_cursor(cursor):
+    try:
+        padded = cursor + '=' * (-len(cursor) % 4)
+        payload = json.loads(base64.urlsafe_b64decode(padded.encode()))
+        return float(payload["s"]), ObjectId(payload["id"])
+    except (TypeError, KeyError, InvalidId, ValueError) as e:
+        raise ValueError("Invalid cursor.") from e
+
+
+def highlight(text, terms, prefix=None):
+    """HTML-escaped excerpt of ``text`` around the first match, matches wrapped in <mark>."""
+    text = text or ''
+    patterns = [re.escape(term) + r"\b" for term in terms]
+    if prefix:
+        patterns.append(re.escape(prefix) + r"\w*")
+    if not patterns:
+        return html.escape(text[:2 * SNIPPET_RADIUS])
+    pattern = re.compile(r"\b(?:" + "|".join(patterns) + ")", re.IGNORECASE | re.UNICODE)
+
+    first = pattern.search(text)
+    start = max(0, first.start() - SNIPPET_RADIUS) if first else 0
+    end = min(len(text), (first.end() if first else 0) + SNIPPET_RADIUS)
+    excerpt = text[start:end]
+
+    parts, last = [], 0
+    for match in pattern.finditer(excerpt):
+        parts.append(html.escape(excerpt[last:match.start()]))
+        parts.append(f"<mark>{html.escape(match.group())}</mark>")
+        last = match.end()
+    parts.append(html.escape(excerpt[last:]))
+    return ("…" if start else "") + "".join(parts) + ("…" if end < len(text) else "")
+
+
+def _after_cursor(score, pk, cursor):
+    cursor_score, cursor_pk = cursor
+    return score < cursor_score or (score == cursor_score and pk < cursor_pk)
+
+
+class MongoTextSearch:
+    def search_messages(self, user, query, cursor, limit):
+        pipeline = [
+            {'$match': {'user': user.id, '$text': {'$search': query}}},
+            {'$addFields': {'score': {'$meta': 'textScore'}}},
+        ]
+        if cursor:
+            score, pk = cursor
+            pipeline.append({'$match': {'$or': [{'score': {'$lt': score}}, {'score': score, '_id': {'$lt': pk}}]}})
+        pipeline += [
+            {'$sort': {'score': -1, '_id': -1}},
+            {'$limit': limit + 1},
+            {'$project': {'message': 1, 'response': 1, 'thread': 1, 'timestamp': 1, 'slug': 1, 'score': 1}},
+        ]
+        return list(ChatMessage.objects.read_preference(secondary_reads()).aggregate(pipeline))
+
+    def search_threads(self, user, query, limit):
+        return list(ChatThread.objects.read_preference(secondary_reads()).aggregate([
+            {'$match': {'user': user.id, '$text': {'$search': query}}},
+            {'$addFields': {'score': {'$meta': 'textScore'}}},
+            {'$sort': {'score': -1, '_id': -1}},
+            {'$limit': limit},
+            {'$project': {'title': 1, 'slug': 1, 'score': 1}},
+        ]))
+
+    def add_message(self, chat_message):
+        pass  # maintained by MongoDB
+
+    def remove_messages(self, user_id, message_ids):
+        pass
+
+    def forget_user(self, user_id):
+        pass
+
+
+class _UserIndex:
+    def __init__(self):
+        self.postings = {}  # term -> {message_id: term frequency}
+        self.documents = {}  # message_id -> (thread_id, timestamp, terms)
+        self._terms = None
+        self.built_at = time.monotonic()
+        self.synced_at = None  # creation time of the newest message pulled from Mongo
+
+    def add(self, message_id, thread_id, timestamp, text):
+        if message_id in self.documents:
+            return
+        terms = tokenize(text)
+        self.documents[message_id] = (thread_id, timestamp, set(terms))
+        for term in terms:
+            postings = self.postings.setdefault(term, {})
+            if not postings:
+                self._terms = None
+            postings[message_id] = postings.get(message_id, 0) + 1
+
+    def add_document(self, doc):
+        self.add(doc['_id'], doc.get('thread'), doc.get('timestamp'), f"{doc.get('message') or ''} {doc.get('response') or ''}")
+        created = doc['_id'].generation_time.replace(tzinfo=None)
+        if self.synced_at is None or created > self.synced_at:
+            self.synced_at = created
+
+    def remove(self, message_id):
+        entry = self.documents.pop(message_id, None)
+        if entry is None:
+            return
+        for term in entry[2]:
+            postings = self.postings.get(term)
+            if postings is not None:
+                postings.pop(message_id, None)
+                if not postings:
+                    del self.postings[term]
+                    self._terms = None
+
+    def terms_with_prefix(self, prefix):
+        if self._terms is None:
+            self._terms = sorted(self.postings)
+        i = bisect_left(self._terms, prefix)
+        while i < len(self._terms) and self._terms[i].startswith(prefix):
+            yield self._terms[i]
+            i += 1
+
+
+class LocalInvertedIndex:
+    """Per-user indexes, kept current across processes on every search.
+
+    Messages saved by this process are added as they are saved. Before each search the index
+    also pulls the user's messages created since the newest one it holds (minus
+    ``SYNC_OVERLAP`` for ids generated out of order by other workers), and it is rebuilt from
+    scratch after ``SEARCH_INDEX_TTL`` seconds to pick up imports, restores and deletions made
+    elsewhere. Hits whose message no longer exists are dropped from the index as they are found.
+    """
+    SYNC_OVERLAP = timedelta(minutes=2)
+    FIELDS = ('message', 'response', 'thread', 'timestamp')
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._users = {}
+
+    def _build(self, user):
+        index = _UserIndex()
+        for doc in ChatMessage.objects(user=user).only(*self.FIELDS).batch_size(1000).as_pymongo():
+            index.add_document(doc)
+        return index
+
+    def _user_index(self, user):
+        with self._lock:
+            index = self._users.get(user.id)
+        if index is None or time.monotonic() - index.built_at > settings.SEARCH_INDEX_TTL:
+            index = self._build(user)
+            with self._lock:
+                self._users[user.id] = index
+            return index
+
+        queryset = ChatMessage.objects(user=user)
+        if index.synced_at is not None:
+            queryset = queryset.filter(id__gte=ObjectId.from_datetime(index.synced_at - self.SYNC_OVERLAP))
+        docs = list(queryset.only(*self.FIELDS).batch_size(1000).as_pymongo())
+        with self._lock:
+            for doc in docs:
+                index.add_document(doc)
+        return index
+
+    def add_message(self, chat_message):
+        user_id = chat_message._data['user'].id if chat_message._data.get('user') is not None else None
+        with self._lock:
+            index = self._users.get(user_id)
+            if index is not None:
+                index.add(chat_message.id, chat_message.thread.id, chat_message.timestamp,
+                          f"{chat_message.message or ''} {chat_message.response or ''}")
+
+    def remove_messages(self, user_id, message_ids):
+        with self._lock:
+            index = self._users.get(user_id)
+            if index is not None:
+                for message_id in message_ids:
+                    index.remove(message_id)
+
+    def forget_user(self, user_id):
+        with self._lock:
+            self._users.pop(user_id, None)
+
+    def _score(self, index, query):
+        terms = tokenize(query)
+        prefix = terms.pop() if terms and not query[-1:].isspace() else None
+        total = max(1, len(index.documents))
+        scores = {}
+
+        def add(term, weight=1.0):
+            postings = index.postings.get(term, {})
+            idf = math.log(1 + total / (1 + len(postings)))
+            for message_id, tf in postings.items():
+                scores[message_id] = scores.get(message_id, 0.0) + weight * (1 + math.log(tf)) * idf
+
+        for term in terms:
+            add(term)
+        if prefix:
+            for term in index.terms_with_prefix(prefix):
+                add(term, 1.0 if term == prefix else 0.8)
+        return scores
+
+    def search_messages(self, user, query, cursor, limit):
+        index = self._user_index(user)
+        with self._lock:
+            scores = self._score(index, query)
+        ranked = sorted(((round(score, 6), pk) for pk, score in scores.items()), reverse=True)
+        if cursor:
+            ranked = [(score, pk) for score, pk in ranked if _after_cursor(score, pk, cursor)]
+
+        results = []
+        while ranked and len(results) < limit + 1:
+            page, ranked = ranked[:limit + 1 - len(results)], ranked[limit + 1 - len(results):]
+            documents = {
+                doc['_id']: doc for doc in ChatMessage.objects(id__in=[pk for _, pk in page])
+                .only('message', 'response', 'thread', 'timestamp', 'slug').as_pymongo()
+            }
+            # Deleted or archived elsewhere: drop them and fill the page from the next hits
+            missing = [pk for _, pk in page if pk not in documents]
+            if missing:
+                self.remove_messages(user.id, missing)
+            results.extend(dict(documents[pk], score=score) for score, pk in page if pk in documents)
+        return results
+
+    def search_threads(self, user, query, limit):
+        terms = tokenize(query)
+        if not terms:
+            return []
+        matches = []
+        for doc in ChatThread.objects(user=user).only('title', 'slug').as_pymongo():
+            title_terms = tokenize(doc.get('title'))
+            score = sum(1 for term in terms[:-1] if term in title_terms)
+            score += sum(1 for term in title_terms if term.startswith(terms[-1]))
+            if score:
+                matches.append(dict(doc, score=float(score)))
+        matches.sort(key=lambda doc: (doc['score'], doc['_id']), reverse=True)
+        return matches[:limit]
+
+
+_backend = None
+
+
+def get_search_backend():
+    global _backend
+    if _backend is None:
+        _backend = LocalInvertedIndex() if settings.SEARCH_BACKEND == 'local' else MongoTextSearch()
+    return _backend
+
+
+def index_chat_message(chat_message):
+    get_search_backend().add_message(chat_message)
+
+
+def unindex_messages(user_id, message_ids):
+    """Drop deleted or archived messages from this process's index; other processes catch up on their own."""
+    get_search_backend().remove_messages(user_id, message_ids)
+
+
+def unindex_user(user_id):
+    get_search_backend().forget_user(user_id)
+
+
+def search_history(user, query, cursor=None, limit=20):
+    """Ranked message hits and matching thread titles for ``query`` in ``user``'s history.
+
+    Returns ``(threads, results, next_cursor)``; raises ``ValueError`` for a bad cursor.
+    """
+    backend = get_search_backend()
+    decoded = decode_search_cursor(cursor) if cursor else None
+    hits = backend.search_messages(user, query, decoded, limit)
+
+    next_cursor = None
+    if len(hits) > limit:
+        hits = hits[:limit]
+        next_cursor = encode_search_cursor(hits[-1]['score'], hits[-1]['_id'])
+
+    # One query for the slugs/titles of every thread on the page
+    thread_ids = {hit.get('thread') for hit in hits if hit.get('thread')}
+    threads_by_id = {
+        doc['_id']: doc for doc in ChatThread.objects(id__in=list(thread_ids)).read_preference(secondary_reads()).only('title', 'slug').as_pymongo()
+    } if thread_ids else {}
+
+    terms = tokenize(query)
+    prefix = terms[-1] if settings.SEARCH_BACKEND == 'local' and terms and not query[-1:].isspace() else None
+    if prefix:
+        terms = terms[:-1]
+    results = []
+    for hit in hits:
+        thread = threads_by_id.get(hit.get('thread'), {})
+        results.append({
+            "slug": hit.get('slug'),
+            "thread_slug": thread.get('slug'),
+            "thread_title": thread.get('title'),
+            "timestamp": hit.get('timestamp'),
+            "score": hit['score'],
+            "message_snippet": highlight(hit.get('message'), terms, prefix),
+            "response_snippet": highlight(hit.get('response'), terms, prefix),
+        })
+
+    threads = [
+        {"slug": doc.get('slug'), "title": doc.get('title'), "title_snippet": highlight(doc.get('title'), terms, prefix)}
+        for doc in backend.search_threads(user, query, settings.SEARCH_THREAD_LIMIT)
+    ] if not cursor else []
+    return threads, results, next_cursor
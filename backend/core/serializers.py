@@ -1,7 +1,42 @@
+from bson import DBRef, ObjectId
 from rest_framework import serializers
-from django.contrib.auth.hashers import make_password, check_password
 from core.models import User, ChatThread, ChatMessage,Settings
 
+
+def prefetch_references(documents, field_names, known=()):
+    """Resolve ``field_names`` references on ``documents`` in bulk before serializing them.
+
+    Nested serializers otherwise dereference each row's ReferenceFields one query at a
+    time. Ids are collected per field and loaded with one ``$in`` query per referenced
+    collection; ``known`` documents (e.g. the request user) are used without querying.
+    Returns the documents as a list.
+    """
+    documents = list(documents)
+    loaded = {(type(doc), doc.pk): doc for doc in known}
+
+    for field_name in field_names:
+        pending = {}
+        document_type = None
+        for doc in documents:
+            value = doc._data.get(field_name)
+            if isinstance(value, DBRef):
+                value = value.id
+            if isinstance(value, ObjectId):
+                document_type = doc._fields[field_name].document_type
+                pending.setdefault(value, []).append(doc)
+        if not pending:
+            continue
+
+        missing = [pk for pk in pending if (document_type, pk) not in loaded]
+        if missing:
+            for pk, referenced in document_type.objects.in_bulk(missing).items():
+                loaded[(document_type, pk)] = referenced
+        for pk, docs in pending.items():
+            for doc in docs:
+                # Set the raw value so the document is not marked as changed
+                doc._data[field_name] = loaded.get((document_type, pk))
+    return documents
+
 # Serializer for User Registration
 class UserRegisterSerializer(serializers.Serializer):
     username = serializers.CharField(max_length=150)
@@ -31,11 +66,11 @@ class UserLoginSerializer(serializers.Serializer):
         password = attrs.get('password')
 
         try:
-            user = User.objects.get(username=username)
+            user = User.objects.only('id', 'username', 'password').get(username=username)
         except User.DoesNotExist:
             raise serializers.ValidationError("Invalid username or password.")
     
-        if not check_password(password, user.password):
+        if not user.check_password(password):
             raise serializers.ValidationError("Invalid username or password.")
 
         return user
@@ -54,6 +89,9 @@ class ChatThreadSerializer(serializers.Serializer):
     slug = serializers.CharField(read_only=True)
     user = UserSerializer(read_only=True)
     created_at = serializers.DateTimeField()
+    message_count = serializers.IntegerField(read_only=True)
+    last_message_at = serializers.DateTimeField(read_only=True)
+    last_message_preview = serializers.CharField(read_only=True)
 
 class ChatMessageSerializer(serializers.Serializer):
     thread = ChatThreadSerializer(read_only=True)
@@ -64,6 +102,14 @@ class ChatMessageSerializer(serializers.Serializer):
     slug = serializers.CharField(read_only=True)
 
 
+class CompactChatMessageSerializer(serializers.Serializer):
+    message = serializers.CharField()
+    response = serializers.CharField()
+    timestamp = serializers.DateTimeField()
+    slug = serializers.CharField(read_only=True)
+
+
+
 class SettingsSerializer(serializers.Serializer):
     user = UserSerializer(read_only=True)  # Read-only field to display user info, if needed
     model = serializers.ChoiceField(choices=Settings.model_choices)
@@ -71,10 +117,12 @@ class SettingsSerializer(serializers.Serializer):
     customize_response = serializers.CharField(
         default="You are an intelligent assistant. Please provide informative and helpful responses."
     )
+    use_response_cache = serializers.BooleanField(default=True)
 
     def update(self, instance, validated_data):
         instance.model = validated_data.get('model', instance.model)
         instance.max_tokens = validated_data.get('max_tokens', instance.max_tokens)
         instance.customize_response = validated_data.get('customize_response', instance.customize_response)
+        instance.use_response_cache = validated_data.get('use_response_cache', instance.use_response_cache)
         instance.save()  
         return instance
\ No newline at end of file
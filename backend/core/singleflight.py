@@ -0,0 +1,77 @@
+import asyncio
+import threading
+
+
+class _Call:
+    def __init__(self):
+        self.event = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class SingleFlight:
+    """Collapses concurrent calls that share a key into one execution.
+
+    The first caller for a key runs the function; callers arriving while it is in flight
+    wait for and share its result (or exception) instead of repeating the work.
+    """
+
+    def __init__(self):
+        self.executed = 0
+        self.coalesced = 0
+        self._lock = threading.Lock()
+        self._calls = {}
+        self._tasks = {}
+
+    def do(self, key, fn):
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = _Call()
+                self.executed += 1
+            else:
+                self.coalesced += 1
+
+        if not leader:
+            call.event.wait()
+            if call.error is not None:
+                raise call.error
+            return call.result
+
+        try:
+            call.result = fn()
+        except Exception as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call.event.set()
+        return call.result
+
+    async def ado(self, key, coroutine_fn):
+        loop = asyncio.get_running_loop()
+        task_key = (id(loop), key)
+        with self._lock:
+            task = self._tasks.get(task_key)
+            if task is None:
+                # Run as its own task so one caller going away does not cancel it for the rest
+                task = loop.create_task(coroutine_fn())
+                self._tasks[task_key] = task
+                task.add_done_callback(lambda _: self._forget(task_key))
+                self.executed += 1
+            else:
+                self.coalesced += 1
+        return await asyncio.shield(task)
+
+    def _forget(self, task_key):
+        with self._lock:
+            self._tasks.pop(task_key, None)
+
+    def stats(self):
+        return {"executed": self.executed, "coalesced": self.coalesced}
+
+
+# Identical chat completions in flight at the same time (see ChatAPIView)
+chat_completions = SingleFlight()
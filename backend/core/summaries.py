@@ -0,0 +1,104 @@
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from django.conf import settings
+from core.llm import create_chat_completion
+from core.metrics import observe_completion
+from core.routing import Completion
+from core.models import ChatThread, ChatMessage
+
+SUMMARY_PROMPT = (
+    "You maintain a running summary of a conversation between a user and an assistant. "
+    "Merge the new exchanges into the existing summary. Keep facts, decisions, names and open "
+    "questions the assistant may need later; drop pleasantries. Reply with the summary only."
+)
+
+_executor = None
+_pending = set()
+_lock = threading.Lock()
+
+
+def _get_executor():
+    global _executor
+    if _executor is None:
+        with _lock:
+            if _executor is None:
+                _executor = ThreadPoolExecutor(max_workers=settings.CHAT_SUMMARY_WORKERS, thread_name_prefix='thread-summary')
+    return _executor
+
+
+def unsummarized_filter(chat_thread):
+    query = {'thread': chat_thread}
+    if chat_thread.summarized_until:
+        query['timestamp__gt'] = chat_thread.summarized_until
+    return query
+
+
+def maybe_schedule_summary(chat_thread):
+    """Queue a summary refresh once enough turns have piled up past the marker.
+
+    The count stops at the trigger size, so the check costs the same on any thread length.
+    """
+    if not settings.CHAT_SUMMARY_ENABLED:
+        return
+    threshold = settings.CHAT_SUMMARY_TRIGGER_MESSAGES + settings.CHAT_SUMMARY_KEEP_RECENT
+    unsummarized = ChatMessage.objects(**unsummarized_filter(chat_thread)).limit(threshold).count(with_limit_and_skip=True)
+    if unsummarized < threshold:
+        return
+
+    thread_id = chat_thread.id
+    with _lock:
+        if thread_id in _pending:
+            return
+        _pending.add(thread_id)
+    _get_executor().submit(_run_refresh, thread_id)
+
+
+def _run_refresh(thread_id):
+    try:
+        refresh_thread_summary(thread_id)
+    except Exception as e:
+        print(f"Error summarizing thread {thread_id}: {str(e)}")
+    finally:
+        with _lock:
+            _pending.discard(thread_id)
+
+
+def refresh_thread_summary(thread_id):
+    """Fold the oldest unsummarized turns (all but the recent tail) into the thread summary."""
+    chat_thread = ChatThread.objects(id=thread_id).only('summary', 'summarized_until').first()
+    if chat_thread is None:
+        return None
+
+    exchanges = list(
+        ChatMessage.objects(**unsummarized_filter(chat_thread))
+        .order_by('timestamp')
+        .only('message', 'response', 'timestamp')
+        .limit(settings.CHAT_SUMMARY_TRIGGER_MESSAGES)
+        .as_pymongo()
+    )
+    if len(exchanges) < settings.CHAT_SUMMARY_TRIGGER_MESSAGES:
+        return chat_thread.summary
+
+    transcript = "\n\n".join(
+        f"User: {doc.get('message') or ''}\nAssistant: {doc.get('response') or ''}" for doc in exchanges
+    )
+    start = time.monotonic()
+    chat_completion = create_chat_completion(
+        [
+            {"role": "system", "content": SUMMARY_PROMPT},
+            {"role": "user", "content": f"Existing summary:\n{chat_thread.summary or '(none)'}\n\nNew exchanges:\n{transcript}"},
+        ],
+        settings.CHAT_SUMMARY_MODEL,
+        settings.CHAT_SUMMARY_MAX_TOKENS,
+    )
+    summary = chat_completion.choices[0].message.content
+    latency = time.monotonic() - start
+    observe_completion(Completion(summary, settings.CHAT_SUMMARY_MODEL, chat_completion.usage, latency, latency))
+
+    # Only move the marker if nobody else did in the meantime
+    ChatThread.objects(id=thread_id, summarized_until=chat_thread.summarized_until).update_one(
+        set__summary=summary,
+        set__summarized_until=exchanges[-1]['timestamp'],
+    )
+    return summary
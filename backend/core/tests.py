@@ -1,3 +1,409 @@
-from django.test import TestCase
+import os
+import threading
+import time
+from unittest import SkipTest, mock
+import asyncio
+import json
+import mongoengine
+from bson import ObjectId
+from asgiref.sync import async_to_sync
+from groq import InternalServerError, RateLimitError
+from django.test import Client, SimpleTestCase, override_settings
+from pymongo import MongoClient
+from pymongo.errors import PyMongoError
+from core import llm
+from core.benchmark import QueryCounter, seed, access_token
+from core.cache import MongoInvalidationBus
+from core.groq_stub import GroqStubServer
+from core.ids import new_ulid, prefixed_slug
+from core.models import ChatThread, ChatMessage
+from core.quotas import RateLimited, UsageLimiter, limiter
+from core.routing import ModelRouter, AllModelsFailed, router
+from core.transfer import ChatImporter
 
-# Create your tests here.
+# Query-count tests need a real server (mongomock emits no command events); the database is dropped
+MONGO_TEST_URI = os.environ.get('MONGO_TEST_URI', 'mongodb://localhost:27017/chat_test')
+
+
+class ULIDTests(SimpleTestCase):
+    def test_ids_from_many_threads_are_unique_and_increasing(self):
+        threads, per_thread = 16, 2000
+        generated = [[] for _ in range(threads)]
+        ordered = []
+        order_lock = threading.Lock()
+
+        def generate(bucket):
+            for i in range(per_thread):
+                if i % 10:
+                    bucket.append(new_ulid())
+                else:
+                    # Every tenth id is also recorded in global generation order
+                    with order_lock:
+                        ulid = new_ulid()
+                        ordered.append(ulid)
+                    bucket.append(ulid)
+
+        workers = [threading.Thread(target=generate, args=(bucket,)) for bucket in generated]
+        for worker in workers:
+            worker.start()
+        for worker in workers:
+            worker.join()
+
+        everything = [ulid for bucket in generated for ulid in bucket]
+        self.assertEqual(len(set(everything)), threads * per_thread)
+        for bucket in generated:
+            self.assertTrue(all(a < b for a, b in zip(bucket, bucket[1:])))
+        self.assertTrue(all(a < b for a, b in zip(ordered, ordered[1:])))
+        self.assertTrue(all(len(ulid) == 26 for ulid in everything))
+
+    def test_slugs_in_a_burst_do_not_conflict(self):
+        slugs = [prefixed_slug('same-title') for _ in range(10000)]
+        self.assertEqual(len(set(slugs)), len(slugs))
+        self.assertEqual(slugs, sorted(slugs))
+        self.assertTrue(prefixed_slug('').isalnum())
+
+
+class QueryCountTests(SimpleTestCase):
+    """Listing threads and paging history cost the same number of Mongo commands at any page size."""
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        try:
+            MongoClient(MONGO_TEST_URI, serverSelectionTimeoutMS=500).admin.command('ping')
+        except PyMongoError:
+            raise SkipTest(f"No MongoDB server at {MONGO_TEST_URI}")
+        cls.counter = QueryCounter()
+        mongoengine.disconnect()
+        connection = mongoengine.connect(host=MONGO_TEST_URI, event_listeners=[cls.counter])
+        connection.drop_database(mongoengine.get_db().name)
+        cls.user, cls.slugs = seed(40, 60)
+        cls.token = access_token(cls.user)
+
+    @classmethod
+    def tearDownClass(cls):
+        mongoengine.get_connection().drop_database(mongoengine.get_db().name)
+        mongoengine.disconnect()
+        super().tearDownClass()
+
+    def count(self, path, params):
+        client = Client(headers={'Authorization': f'Bearer {self.token}'})
+        client.get(path, params)  # warm the per-process user and settings caches
+        self.counter.reset()
+        response = client.get(path, params)
+        self.assertEqual(response.status_code, 200)
+        return self.counter.count
+
+    def test_thread_list(self):
+        self.assertEqual(self.count('/api/threads/', {'limit': 5}), self.count('/api/threads/', {'limit': 30}))
+
+    def test_message_list(self):
+        path = f'/api/threads/{self.slugs[0]}/messages/'
+        self.assertEqual(self.count(path, {'limit': 5}), self.count(path, {'limit': 50}))
+
+    def test_compact_message_list(self):
+        path = f'/api/threads/{self.slugs[0]}/messages/'
+        self.assertEqual(self.count(path, {'limit': 5, 'compact': 1}), self.count(path, {'limit': 50, 'compact': 1}))
+
+
+class StubTestCase(SimpleTestCase):
+    """Runs against mongomock and a local Groq stub server."""
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        try:
+            import mongomock  # optional dev dependency
+        except ImportError:
+            raise SkipTest("mongomock is not installed")
+        mongoengine.disconnect()
+        mongoengine.connect('chat_test', host='mongodb://localhost', mongo_client_class=mongomock.MongoClient)
+        cls.stub = GroqStubServer(tokens=5).start()
+        # A single test process: the shared invalidation bus would outlive the mongomock connection
+        cls.stub_settings = override_settings(GROQ_BASE_URL=cls.stub.base_url, GROQ_API_KEY='test', CACHE_INVALIDATION_BUS='local')
+        cls.stub_settings.enable()
+        llm._reset_clients()
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.stub_settings.disable()
+        llm._reset_clients()
+        cls.stub.shutdown()
+        cls.stub.server_close()
+        limiter.flush()  # before the connection goes away
+        mongoengine.disconnect()
+        super().tearDownClass()
+
+
+@override_settings(RATE_LIMIT_BURST=3, RATE_LIMIT_REQUESTS_PER_MINUTE=1)
+class BatchRateLimitTests(StubTestCase):
+    def setUp(self):
+        mongoengine.get_connection().drop_database(mongoengine.get_db().name)
+        self.user, _ = seed(0, 0)
+        self.client = Client(headers={'Authorization': f'Bearer {access_token(self.user)}'})
+
+    def post_batch(self, count):
+        items = [{'question': f'Batch question {i}'} for i in range(count)]
+        return self.client.post('/api/threads/chat/batch/', {'items': items}, content_type='application/json')
+
+    def test_batch_larger_than_the_burst_is_answered(self):
+        response = self.post_batch(8)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()['succeeded'], 8)
+        self.assertEqual(ChatMessage.objects(user=self.user).count(), 8)
+
+    def test_batch_over_the_rate_is_rejected_whole(self):
+        for _ in range(3):
+            self.assertEqual(self.post_batch(2).status_code, 200)
+        response = self.post_batch(2)
+        self.assertEqual(response.status_code, 429)
+        self.assertTrue(int(response['Retry-After']) > 0)
+        self.assertEqual(ChatMessage.objects(user=self.user).count(), 6)
+
+
+PROMPT = [{'role': 'user', 'content': 'Hello'}]
+MODEL, FALLBACK = 'llama-3.1-8b-instant', 'llama3-8b-8192'  # siblings in MODEL_FALLBACKS
+
+
+@override_settings(GROQ_MAX_RETRIES=2, GROQ_RETRY_BACKOFF=0.01)
+class LLMClientTests(StubTestCase):
+    def setUp(self):
+        self.stub.fail_first, self.stub.error_status = 0, 503
+        self.stub.request_count = self.stub.connection_count = 0
+        llm._reset_clients()
+
+    def test_retries_server_errors(self):
+        self.stub.fail_first = 2
+        completion = llm.create_chat_completion(PROMPT, MODEL, 50)
+        self.assertTrue(completion.choices[0].message.content)
+        self.assertEqual(self.stub.request_count, 3)
+
+    def test_retries_rate_limits(self):
+        self.stub.fail_first, self.stub.error_status = 1, 429
+        llm.create_chat_completion(PROMPT, MODEL, 50)
+        self.assertEqual(self.stub.request_count, 2)
+
+    def test_gives_up_after_max_retries(self):
+        self.stub.fail_first = 10
+        with self.assertRaises(InternalServerError):
+            llm.create_chat_completion(PROMPT, MODEL, 50)
+        self.assertEqual(self.stub.request_count, 3)
+
+    def test_async_retries(self):
+        self.stub.fail_first, self.stub.error_status = 2, 429
+        completion = async_to_sync(llm.acreate_chat_completion)(PROMPT, MODEL, 50)
+        self.assertTrue(completion.choices[0].message.content)
+        self.assertEqual(self.stub.request_count, 3)
+
+        self.stub.fail_first, self.stub.request_count = 10, 0
+        with self.assertRaises(RateLimitError):
+            async_to_sync(llm.acreate_chat_completion)(PROMPT, MODEL, 50)
+        self.assertEqual(self.stub.request_count, 3)
+
+    def test_one_sync_client_per_process(self):
+        clients = []
+        workers = [threading.Thread(target=lambda: clients.append(llm.get_client())) for _ in range(8)]
+        for worker in workers:
+            worker.start()
+        for worker in workers:
+            worker.join()
+        self.assertTrue(all(client is clients[0] for client in clients))
+
+        for _ in range(5):
+            llm.create_chat_completion(PROMPT, MODEL, 50)
+        self.assertEqual(self.stub.connection_count, 1)  # keep-alive connection reused
+
+    def test_one_async_client_per_event_loop(self):
+        async def clients_on_this_loop():
+            first = llm.get_async_client()
+            await llm.acreate_chat_completion(PROMPT, MODEL, 50)
+            await llm.acreate_chat_completion(PROMPT, MODEL, 50)
+            return first, llm.get_async_client()
+
+        first, second = asyncio.run(clients_on_this_loop())
+        self.assertIs(first, second)
+        self.assertEqual(self.stub.connection_count, 1)
+        other_loop, _ = asyncio.run(clients_on_this_loop())
+        self.assertIsNot(other_loop, first)
+
+
+@override_settings(GROQ_MAX_RETRIES=0, CIRCUIT_FAILURE_THRESHOLD=2, CIRCUIT_RESET_TIMEOUT=1.0,
+                   ROUTER_HEDGE_ENABLED=True, ROUTER_HEDGE_MIN_SAMPLES=1)
+class RoutingTests(StubTestCase):
+    def setUp(self):
+        self.stub.fail_models = set()
+        self.stub.fail_first = self.stub.slow_first = self.stub.slow_latency = 0
+        self.stub.request_count = self.stub.error_count = 0
+        self.router = ModelRouter()
+
+    def prime_hedge_delay(self, model, seconds):
+        self.router.health(model).ttfts.append(seconds)
+
+    def test_falls_back_to_the_sibling_model(self):
+        self.stub.fail_models = {MODEL}
+        completion = self.router.complete(PROMPT, MODEL, 50)
+        self.assertEqual(completion.model, FALLBACK)
+        self.assertTrue(completion.content)
+
+    def test_fast_failure_falls_back_without_waiting_for_the_hedge_delay(self):
+        self.stub.fail_models = {MODEL}
+        self.prime_hedge_delay(MODEL, 2.0)
+        started = time.monotonic()
+        completion = self.router.complete(PROMPT, MODEL, 50)
+        self.assertEqual(completion.model, FALLBACK)
+        self.assertLess(time.monotonic() - started, 1.0)
+
+    @override_settings(ROUTER_HEDGE_ENABLED=False)  # so every call makes exactly one request
+    def test_breaker_opens_and_recovers_through_half_open(self):
+        self.stub.fail_models = {MODEL}
+        for _ in range(2):
+            self.router.complete(PROMPT, MODEL, 50)
+        health = self.router.health(MODEL)
+        self.assertEqual(health.breaker.state, 'open')
+
+        # While open, the primary is skipped without a request
+        requests = self.stub.request_count
+        self.assertEqual(self.router.complete(PROMPT, MODEL, 50).model, FALLBACK)
+        self.assertEqual(self.stub.request_count, requests + 1)
+
+        self.stub.fail_models = set()
+        time.sleep(1.05)
+        self.assertEqual(health.breaker.state, 'half-open')
+        self.assertEqual(self.router.complete(PROMPT, MODEL, 50).model, MODEL)
+        self.assertEqual(health.breaker.state, 'closed')
+
+    def test_hedge_wins_over_a_stalled_attempt(self):
+        self.stub.slow_first, self.stub.slow_latency = 1, 2.0
+        self.prime_hedge_delay(MODEL, 0.05)
+        started = time.monotonic()
+        completion = self.router.complete(PROMPT, MODEL, 50)
+        self.assertEqual(completion.model, MODEL)
+        self.assertLess(time.monotonic() - started, 1.0)
+        self.assertEqual(self.router.health(MODEL).hedges, 1)
+        self.assertEqual(self.stub.request_count, 2)
+
+    def test_async_fast_failure_falls_back(self):
+        self.stub.fail_models = {MODEL}
+        self.prime_hedge_delay(MODEL, 2.0)
+        started = time.monotonic()
+        completion = async_to_sync(self.router.acomplete)(PROMPT, MODEL, 50)
+        self.assertEqual(completion.model, FALLBACK)
+        self.assertLess(time.monotonic() - started, 1.0)
+
+    def test_all_models_failing_raises(self):
+        self.stub.fail_models = {MODEL, FALLBACK}
+        with self.assertRaises(AllModelsFailed):
+            self.router.complete(PROMPT, MODEL, 50)
+
+
+@override_settings(GROQ_MAX_RETRIES=0)
+class ChatFailureTests(StubTestCase):
+    def setUp(self):
+        mongoengine.get_connection().drop_database(mongoengine.get_db().name)
+        router._health.clear()
+        self.stub.fail_models = {MODEL, FALLBACK}
+        self.user, _ = seed(0, 0)  # the user's model is FALLBACK
+        self.client = Client(headers={'Authorization': f'Bearer {access_token(self.user)}'})
+
+    def tearDown(self):
+        self.stub.fail_models = set()
+        router._health.clear()
+
+    def assert_nothing_stored(self):
+        self.assertEqual(ChatMessage.objects(user=self.user).count(), 0)
+        self.assertEqual(ChatMessage.objects(response__startswith='Error').count(), 0)
+
+    def test_failed_completion_is_not_stored_as_an_answer(self):
+        response = self.client.post('/api/threads/chat/', {'question': 'Will this fail?'}, content_type='application/json')
+        self.assertEqual(response.status_code, 502)
+        self.assert_nothing_stored()
+
+    def test_failed_async_completion_is_not_stored_as_an_answer(self):
+        response = self.client.post('/api/threads/chat/async/', {'question': 'Will this fail?'}, content_type='application/json')
+        self.assertEqual(response.status_code, 502)
+        self.assert_nothing_stored()
+
+
+class ImportTests(StubTestCase):
+    def setUp(self):
+        mongoengine.get_connection().drop_database(mongoengine.get_db().name)
+        self.user, _ = seed(0, 0)
+        for document_class in (ChatThread, ChatMessage):
+            document_class.ensure_indexes()
+        self.existing = ChatThread.objects.create(user=self.user, title='Existing', slug='taken')
+
+    def export(self):
+        thread_ids = [str(ObjectId()), str(ObjectId())]
+        records = [
+            {'type': 'thread', 'id': thread_ids[0], 'title': 'Clash', 'slug': 'taken'},
+            {'type': 'message', 'id': str(ObjectId()), 'thread': thread_ids[0], 'message': 'a', 'response': 'b', 'slug': 'm-1'},
+            {'type': 'message', 'id': str(ObjectId()), 'thread': thread_ids[0], 'message': 'c', 'response': 'd', 'slug': 'm-2'},
+            {'type': 'thread', 'id': thread_ids[1], 'title': 'Fresh', 'slug': 'fresh'},
+            {'type': 'message', 'id': str(ObjectId()), 'thread': thread_ids[1], 'message': 'e', 'response': 'f', 'slug': 'm-3'},
+        ]
+        return [json.dumps(record) for record in records]
+
+    def test_slug_conflict_is_reported_and_its_messages_are_not_orphaned(self):
+        lines = self.export()
+        counts = ChatImporter(user=self.user, batch_size=2).run(lines)
+        self.assertEqual((counts['threads'], counts['messages']), (1, 1))
+        self.assertEqual(counts['conflicting_threads'], ['taken'])
+        self.assertEqual(counts['dropped_messages'], 2)
+        self.assertEqual(counts['skipped_threads'], 0)
+        thread_ids = set(ChatThread.objects.distinct('id'))
+        self.assertTrue(all(message.thread.id in thread_ids for message in ChatMessage.objects.no_dereference()))
+
+        # Importing the same file again only skips what is already there
+        counts = ChatImporter(user=self.user, batch_size=2).run(lines)
+        self.assertEqual((counts['threads'], counts['messages']), (0, 0))
+        self.assertEqual((counts['skipped_threads'], counts['skipped_messages']), (1, 1))
+        self.assertEqual(counts['conflicting_threads'], ['taken'])
+        self.assertEqual(ChatMessage.objects.count(), 1)
+
+
+class InvalidationBusTests(StubTestCase):
+    def test_invalidations_reach_other_processes(self):
+        # Two buses stand in for two worker processes; their poll threads sleep through the test
+        here, there = MongoInvalidationBus(3600), MongoInvalidationBus(3600)
+        received_here, received_there = [], []
+        here.subscribe(lambda cache, key: received_here.append((cache, key)))
+        there.subscribe(lambda cache, key: received_there.append((cache, key)))
+
+        here.publish('user', 'deleted-user-id')
+        here.poll()
+        there.poll()
+        self.assertEqual(received_here, [])
+        self.assertEqual(received_there, [('user', 'deleted-user-id')])
+
+
+@override_settings(USAGE_REFRESH_INTERVAL=0, DAILY_TOKEN_QUOTA=1000, MODEL_DAILY_TOKEN_QUOTAS={})
+class UsageFlushTests(StubTestCase):
+    def test_reload_during_a_flush_keeps_the_flushed_usage(self):
+        import mongomock
+        mongoengine.get_connection().drop_database(mongoengine.get_db().name)
+        usage, user_id = UsageLimiter(), str(ObjectId())
+        usage.record(user_id, MODEL, 600, 500)
+
+        writing, release = threading.Event(), threading.Event()
+        bulk_write = mongomock.collection.Collection.bulk_write
+
+        def slow_bulk_write(collection, *args, **kwargs):
+            writing.set()
+            release.wait(5)
+            return bulk_write(collection, *args, **kwargs)
+
+        with mock.patch.object(mongomock.collection.Collection, 'bulk_write', slow_bulk_write):
+            flusher = threading.Thread(target=usage.flush)
+            flusher.start()
+            writing.wait(5)
+            outcome = []
+            checker = threading.Thread(target=lambda: outcome.append(usage.summary(user_id)['total_tokens']))
+            checker.start()
+            checker.join(0.2)
+            self.assertTrue(checker.is_alive())  # the reload waits for the write
+            release.set()
+            flusher.join()
+            checker.join()
+        self.assertEqual(outcome, [1100])
+        with self.assertRaises(RateLimited):
+            usage.check_quota(user_id, MODEL)
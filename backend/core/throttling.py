@@ -0,0 +1,22 @@
+from rest_framework.throttling import BaseThrottle
+from core.chat import get_user_settings
+from core.quotas import limiter, RateLimited
+
+
+class ChatUsageThrottle(BaseThrottle):
+    """Applies the per-user request rate and daily token quotas of core.quotas to chat requests."""
+
+    def allow_request(self, request, view):
+        self.retry_after = None
+        if request.method != 'POST' or not request.user or not request.user.is_authenticated:
+            return True
+        model_choice = get_user_settings(request.user).model
+        try:
+            limiter.check(request.user.id, model_choice)
+        except RateLimited as e:
+            self.retry_after = e.retry_after
+            return False
+        return True
+
+    def wait(self):
+        return self.retry_after
@@ -0,0 +1,255 @@
+"""Streaming NDJSON export and bulk import of chat threads and messages.
+
+An export is one JSON object per line: each ``thread`` line is followed by that thread's
+``message`` lines, oldest first. Documents are read through server-side cursors in batches
+and written as they are read, so memory use does not depend on the size of the account.
+"""
+import gzip
+import io
+import json
+import zlib
+from datetime import datetime
+from bson import ObjectId
+from django.conf import settings
+from django.utils.text import slugify
+from pymongo.errors import BulkWriteError
+from core.archive import archived_messages
+from core.db import secondary_reads
+from core.ids import prefixed_slug
+from core.models import User, ChatThread, ChatMessage
+from core.versions import bump_user_versions
+
+try:
+    import zstandard
+except ImportError:  # optional: only needed for zstd exports/imports
+    zstandard = None
+
+COMPRESSIONS = ('gzip', 'zstd', 'none')
+DUPLICATE_KEY = 11000
+
+THREAD_FIELDS = ('title', 'slug', 'created_at', 'summary', 'summarized_until', 'message_count', 'last_message_at', 'last_message_preview')
+MESSAGE_FIELDS = ('message', 'response', 'timestamp', 'slug')
+
+
+def _json_default(value):
+    if isinstance(value, datetime):
+        return value.isoformat()
+    if isinstance(value, ObjectId):
+        return str(value)
+    raise TypeError(f"Cannot serialize {type(value).__name__}")
+
+
+def _line(record):
+    return (json.dumps(record, default=_json_default, ensure_ascii=False, separators=(',', ':')) + "\n").encode()
+
+
+def iter_export_lines(users):
+    """Yield NDJSON lines (bytes) for every thread and message owned by ``users``."""
+    batch_size = settings.EXPORT_BATCH_SIZE
+    read_preference = secondary_reads()
+    for user in users:
+        threads = (
+            ChatThread.objects(user=user)
+            .read_preference(read_preference)
+            .only('id', 'archived_at', 'archive_location', *THREAD_FIELDS)
+            .order_by('created_at')
+            .batch_size(batch_size)
+            .as_pymongo()
+        )
+        for thread in threads:
+            yield _line(dict({field: thread.get(field) for field in THREAD_FIELDS}, type='thread', id=thread['_id'], user=user.username))
+            if thread.get('archived_at'):
+                # Read archived threads straight from cold storage rather than restoring them
+                messages = archived_messages(thread['_id'], thread.get('archive_location') or 'mongo')
+            else:
+                messages = (
+                    ChatMessage.objects(thread=thread['_id'])
+                    .read_preference(read_preference)
+                    .only('id', *MESSAGE_FIELDS)
+                    .order_by('timestamp')
+                    .batch_size(batch_size)
+                    .as_pymongo()
+                )
+            for message in messages:
+                yield _line(dict({field: message.get(field) for field in MESSAGE_FIELDS}, type='message', id=message['_id'], thread=thread['_id']))
+
+
+def compress(chunks, compression):
+    """Compress an iterable of byte chunks incrementally."""
+    if compression == 'none':
+        yield from chunks
+        return
+    if compression == 'gzip':
+        compressor = zlib.compressobj(6, zlib.DEFLATED, 31)  # wbits=31 writes a gzip container
+        finish = compressor.flush
+    elif compression == 'zstd':
+        if zstandard is None:
+            raise ValueError("zstd compression needs the 'zstandard' package.")
+        compressor = zstandard.ZstdCompressor(level=3).compressobj()
+        finish = compressor.flush
+    else:
+        raise ValueError(f"Unknown compression: {compression}")
+
+    buffered = []
+    size = 0
+    for chunk in chunks:
+        buffered.append(chunk)
+        size += len(chunk)
+        if size >= 64 * 1024:
+            data = compressor.compress(b"".join(buffered))
+            buffered, size = [], 0
+            if data:
+                yield data
+    data = compressor.compress(b"".join(buffered)) + finish()
+    if data:
+        yield data
+
+
+def open_export(path):
+    """Open an export for reading as text lines, detecting gzip/zstd from the file's magic bytes."""
+    raw = open(path, 'rb')
+    magic = raw.read(4)
+    raw.seek(0)
+    if magic[:2] == b'\x1f\x8b':
+        stream = gzip.GzipFile(fileobj=raw)
+    elif magic == b'\x28\xb5\x2f\xfd':
+        if zstandard is None:
+            raise ValueError("Reading zstd exports needs the 'zstandard' package.")
+        stream = zstandard.ZstdDecompressor().stream_reader(raw)
+    else:
+        stream = raw
+    return io.TextIOWrapper(stream, encoding='utf-8')
+
+
+def _parse_datetime(value):
+    return datetime.fromisoformat(value) if value else None
+
+
+class ChatImporter:
+    """Bulk-inserts exported threads and messages with unordered ``insert_many`` batches.
+
+    Original ids are kept, so importing the same file twice skips what already exists. A
+    document whose slug is taken by a different document is a conflict, not a re-import: it is
+    reported separately, and the messages of a conflicting thread are dropped rather than
+    inserted without their thread. With ``new_ids`` every document gets a fresh id and slug
+    instead, which allows loading the same file repeatedly, e.g. to seed load-test datasets.
+    ``user`` assigns everything to one account; otherwise threads go to the user with the
+    exported username.
+    """
+
+    def __init__(self, user=None, new_ids=False, batch_size=None):
+        self.user = user
+        self.new_ids = new_ids
+        self.batch_size = batch_size or settings.IMPORT_BATCH_SIZE
+        self.threads = {}  # exported thread id -> (new thread id, owner id)
+        self.users = {}
+        self.pending = {ChatThread: [], ChatMessage: []}
+        self.inserted = {ChatThread: 0, ChatMessage: 0}
+        self.skipped = {ChatThread: 0, ChatMessage: 0}
+        self.conflicts = {ChatThread: [], ChatMessage: []}  # slugs held by other documents
+        self.failed_threads = set()
+        self.dropped_messages = 0
+
+    def _owner(self, username):
+        if self.user is not None:
+            return self.user
+        if username not in self.users:
+            self.users[username] = User.objects(username=username).only('id').first()
+            if self.users[username] is None:
+                raise ValueError(f"User '{username}' does not exist; pass a target user.")
+        return self.users[username]
+
+    def _flush(self, document_class):
+        documents = self.pending[document_class]
+        self.pending[document_class] = []
+        if document_class is ChatMessage and self.failed_threads:
+            kept = [document for document in documents if document['thread'] not in self.failed_threads]
+            self.dropped_messages += len(documents) - len(kept)
+            documents = kept
+        if not documents:
+            return
+        try:
+            result = document_class._get_collection().insert_many(documents, ordered=False)
+            self.inserted[document_class] += len(result.inserted_ids)
+        except BulkWriteError as e:
+            errors = e.details.get('writeErrors', [])
+            other = [error for error in errors if error.get('code') != DUPLICATE_KEY]
+            if other:
+                raise
+            # Servers name the clashing index in keyPattern; without it, check which ids exist
+            unnamed = [documents[error['index']]['_id'] for error in errors if not error.get('keyPattern')]
+            existing = {row['_id'] for row in document_class._get_collection().find({'_id': {'$in': unnamed}}, {'_id': 1})} if unnamed else set()
+            for error in errors:
+                document = documents[error['index']]
+                if '_id' in error.get('keyPattern', {}) or document['_id'] in existing:
+                    # Already imported
+                    self.skipped[document_class] += 1
+                else:
+                    self.conflicts[document_class].append(document.get('slug'))
+                    if document_class is ChatThread:
+                        self.failed_threads.add(document['_id'])
+            self.inserted[document_class] += e.details.get('nInserted', 0)
+
+    def add(self, record):
+        kind = record.get('type')
+        if kind == 'thread':
+            thread_id = ObjectId() if self.new_ids else ObjectId(record['id'])
+            owner_id = self._owner(record.get('user')).id
+            self.threads[record['id']] = (thread_id, owner_id)
+            document = {
+                '_id': thread_id,
+                'user': owner_id,
+                'title': record.get('title'),
+                'slug': prefixed_slug(slugify(record.get('title') or '')) if self.new_ids else record.get('slug'),
+                'created_at': _parse_datetime(record.get('created_at')),
+                'summary': record.get('summary'),
+                'summarized_until': _parse_datetime(record.get('summarized_until')),
+                'message_count': record.get('message_count') or 0,
+                'last_message_at': _parse_datetime(record.get('last_message_at') or record.get('created_at')),
+                'last_message_preview': record.get('last_message_preview'),
+            }
+            self.pending[ChatThread].append({k: v for k, v in document.items() if v is not None})
+            if len(self.pending[ChatThread]) >= self.batch_size:
+                self._flush(ChatThread)
+        elif kind == 'message':
+            if record.get('thread') not in self.threads:
+                raise ValueError(f"Message {record.get('id')} appears before its thread.")
+            thread_id, owner_id = self.threads[record['thread']]
+            document = {
+                '_id': ObjectId() if self.new_ids else ObjectId(record['id']),
+                'thread': thread_id,
+                'user': owner_id,
+                'message': record.get('message'),
+                'response': record.get('response'),
+                'timestamp': _parse_datetime(record.get('timestamp')),
+                'slug': prefixed_slug(slugify((record.get('message') or '')[:30])) if self.new_ids else record.get('slug'),
+            }
+            self.pending[ChatMessage].append({k: v for k, v in document.items() if v is not None})
+            if len(self.pending[ChatMessage]) >= self.batch_size:
+                # Threads first, so no message is visible before its thread
+                self._flush(ChatThread)
+                self._flush(ChatMessage)
+        else:
+            raise ValueError(f"Unknown record type: {kind!r}")
+
+    def run(self, lines):
+        for number, line in enumerate(lines, 1):
+            if not line.strip():
+                continue
+            try:
+                record = json.loads(line)
+            except ValueError as e:
+                raise ValueError(f"Line {number}: invalid JSON") from e
+            self.add(record)
+        self._flush(ChatThread)
+        self._flush(ChatMessage)
+        bump_user_versions(owner_id for _, owner_id in self.threads.values())
+        return {
+            "threads": self.inserted[ChatThread],
+            "messages": self.inserted[ChatMessage],
+            "skipped_threads": self.skipped[ChatThread],
+            "skipped_messages": self.skipped[ChatMessage],
+            "conflicting_threads": self.conflicts[ChatThread],
+            "conflicting_messages": self.conflicts[ChatMessage],
+            "dropped_messages": self.dropped_messages,
+        }
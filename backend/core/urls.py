@@ -1,5 +1,5 @@
 from django.urls import path
-from .views import ExampleView,UserRegisterView, UserLoginView, UserListView,ThreadListCreateAPIView, MessageListAPIView, ChatAPIView ,SettingsUpdateView,ModelChoicesView
+from .views import ExampleView,UserRegisterView, UserLoginView, UserListView,ThreadListCreateAPIView, MessageListAPIView, ThreadDeleteAPIView, AccountDeleteAPIView, DeletionStatusView, ChatAPIView, AsyncChatAPIView, BatchChatAPIView, SearchAPIView, ExportAPIView, SettingsUpdateView, ModelChoicesView, UsageSummaryView
 from rest_framework_simplejwt.views import TokenObtainPairView, TokenRefreshView
 
 urlpatterns = [
@@ -12,8 +12,16 @@ urlpatterns = [
     path('threads/', ThreadListCreateAPIView.as_view(), name='thread-list-create'),
     path('threads/<slug:slug>/messages/', MessageListAPIView.as_view(), name='message-list'),
     path('threads/chat/', ChatAPIView.as_view(), name='chat'),
+    path('threads/chat/async/', AsyncChatAPIView.as_view(), name='chat-async'),
+    path('threads/chat/batch/', BatchChatAPIView.as_view(), name='chat-batch'),
+    path('threads/<slug:slug>/', ThreadDeleteAPIView.as_view(), name='thread-delete'),
+    path('account/', AccountDeleteAPIView.as_view(), name='account-delete'),
+    path('deletions/<str:key>/', DeletionStatusView.as_view(), name='deletion-status'),
+    path('search/', SearchAPIView.as_view(), name='search'),
+    path('export/', ExportAPIView.as_view(), name='export'),
     path('settings/update/', SettingsUpdateView.as_view(), name='settings-update'),
     path('settings/model-choices/', ModelChoicesView.as_view(), name='model-choices'),
+    path('settings/usage/', UsageSummaryView.as_view(), name='usage-summary'),
 
 ]
 
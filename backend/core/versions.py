@@ -0,0 +1,54 @@
+"""Version stamps and weak ETags for conditional GETs.
+
+Every write that changes a user's thread list (a new thread, a new message, a deletion) bumps
+that user's stamp. The thread list ETag is derived from the stamp, so checking a poll costs one
+primary-key read. A thread's message list ETag is derived from fields ChatThread already
+updates with each message (``message_count``, ``last_message_at``), so checking it reads only
+the thread, which the view loads anyway.
+"""
+import hashlib
+from django.utils.http import parse_etags
+from pymongo import UpdateOne
+from core.models import VersionStamp
+
+
+def _user_key(user_id):
+    return f"threads:{user_id}"
+
+
+def bump_user_version(user_id):
+    VersionStamp._get_collection().update_one({'_id': _user_key(user_id)}, {'$inc': {'version': 1}}, upsert=True)
+
+
+def bump_user_versions(user_ids):
+    """Bump several users' stamps in one bulk write."""
+    requests = [UpdateOne({'_id': _user_key(user_id)}, {'$inc': {'version': 1}}, upsert=True) for user_id in set(user_ids)]
+    if requests:
+        VersionStamp._get_collection().bulk_write(requests, ordered=False)
+
+
+def user_version(user_id):
+    doc = VersionStamp._get_collection().find_one({'_id': _user_key(user_id)}, {'version': 1})
+    return doc['version'] if doc else 0
+
+
+def thread_version(chat_thread):
+    last = chat_thread.last_message_at.isoformat() if chat_thread.last_message_at else ''
+    return f"{chat_thread.message_count or 0}:{last}"
+
+
+def make_etag(*parts):
+    digest = hashlib.blake2b("|".join(str(part) for part in parts).encode(), digest_size=12).hexdigest()
+    return f'W/"{digest}"'
+
+
+def etag_matches(request, etag):
+    """Weak comparison of ``etag`` against the request's If-None-Match header."""
+    header = request.headers.get('If-None-Match')
+    if not header:
+        return False
+    tags = parse_etags(header)
+    if '*' in tags:
+        return True
+    opaque = etag.removeprefix('W/')
+    return any(tag.removeprefix('W/') == opaque for tag in tags)
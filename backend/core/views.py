@@ -1,14 +1,59 @@
 from rest_framework.views import APIView
 from rest_framework.response import Response
-from django.http import Http404
+from django.http import Http404, HttpResponse, JsonResponse, StreamingHttpResponse
+from django.utils.decorators import method_decorator
+from django.views import View
+from django.views.decorators.csrf import csrf_exempt
 from rest_framework import generics, status
-from core.serializers import UserRegisterSerializer, UserLoginSerializer , UserSerializer , ChatThreadSerializer, ChatMessageSerializer , SettingsSerializer
+from core.serializers import UserRegisterSerializer, UserLoginSerializer , UserSerializer , ChatThreadSerializer, ChatMessageSerializer, CompactChatMessageSerializer, SettingsSerializer, prefetch_references
 from django.contrib.auth import logout
 from rest_framework.permissions import AllowAny, IsAuthenticated
-from core.models import User, ChatThread, ChatMessage , Settings
+from core.models import User, ChatThread, ChatMessage , Settings, DeletionJob
+from rest_framework.exceptions import AuthenticationFailed
 from rest_framework_simplejwt.tokens import RefreshToken
-import os
-from groq import Groq
+from core.chat import resolve_chat_thread, get_user_settings, save_chat_message, ensure_thread_activity
+from core.custom_auth_backend import MongoDBJWTAuthentication
+from core.context import build_chat_messages
+from core.pagination import keyset_page, get_page_size
+from core.singleflight import chat_completions
+from core.response_cache import response_cache_key, lookup_cached_response, store_cached_response, cache_metadata
+from core.routing import router, AllModelsFailed
+from core.search import search_history
+from core.quotas import limiter, RateLimited
+from core.throttling import ChatUsageThrottle
+from core.archive import rehydrate_thread
+from core.batch import parse_items, run_batch
+from core.deletion import delete_thread, delete_account, job_progress
+from core.metrics import span, render_metrics
+from core.versions import bump_user_version, user_version, thread_version, make_etag, etag_matches
+from core.transfer import COMPRESSIONS, iter_export_lines, compress
+from django.conf import settings
+from asgiref.sync import sync_to_async
+import asyncio
+import json
+from contextlib import aclosing
+
+
+def sse_event(data, event=None):
+    payload = f"data: {json.dumps(data)}\n\n"
+    if event:
+        payload = f"event: {event}\n{payload}"
+    return payload
+
+
+async def cached_stream(response):
+    yield response
+
+
+def with_etag(response, etag):
+    # Per-user data: browsers keep it but must revalidate before each reuse
+    response['ETag'] = etag
+    response['Cache-Control'] = 'private, no-cache'
+    return response
+
+
+def not_modified(etag):
+    return with_etag(Response(status=status.HTTP_304_NOT_MODIFIED), etag)
 
 
 
@@ -43,24 +88,48 @@ class UserLoginView(generics.GenericAPIView):
 
 
 class UserListView(generics.ListAPIView):
-    queryset = User.objects.all()
     serializer_class = UserSerializer
 
+    def get_queryset(self):
+        # Built per request: a class-level queryset would open (and pin) the Mongo connection at import
+        return User.objects.all()
+
 
 
 class ThreadListCreateAPIView(APIView):
     permission_classes = [IsAuthenticated]
 
     def get(self, request):
-        threads = ChatThread.objects.filter(user=request.user)
+        # Threads from before the activity fields would otherwise sort nowhere (and end no page)
+        ensure_thread_activity(request.user.id)
+
+        # Polls with an unchanged version stamp skip the thread query entirely
+        etag = make_etag(request.user.id, user_version(request.user.id), request.get_full_path())
+        if etag_matches(request, etag):
+            return not_modified(etag)
+
+        # Most recently active first, served from the (user, -last_message_at) index
+        queryset = ChatThread.objects.filter(user=request.user).exclude('summary')
+        try:
+            threads, next_cursor = keyset_page(
+                queryset, 'last_message_at', request.query_params.get('cursor'), get_page_size(request)
+            )
+        except ValueError as e:
+            return Response({'error': str(e)}, status=status.HTTP_400_BAD_REQUEST)
+
+        threads = prefetch_references(threads, ['user'], known=[request.user])
         serializer = ChatThreadSerializer(threads, many=True)
-        return Response(serializer.data)
+        response = Response(serializer.data)
+        if next_cursor:
+            response['X-Next-Cursor'] = next_cursor
+        return with_etag(response, etag)
 
     def post(self, request):
         title = request.data.get('title')
         if not title:
             return Response({'error': 'Title is required.'}, status=status.HTTP_400_BAD_REQUEST)
         thread = ChatThread.objects.create(title=title, user=request.user)
+        bump_user_version(request.user.id)
         serializer = ChatThreadSerializer(thread)
         return Response(serializer.data, status=status.HTTP_201_CREATED)
 
@@ -72,15 +141,83 @@ class MessageListAPIView(APIView):
         except ChatThread.DoesNotExist:
             return Response({'error': 'Thread not found.'}, status=status.HTTP_404_NOT_FOUND)
 
-        messages = ChatMessage.objects.filter(thread=thread)
+        # The thread's message counter and timestamp change with every message, so a matching
+        # ETag is answered without reading (or rehydrating) the messages
+        etag = make_etag(request.user.id, thread.id, thread_version(thread), request.get_full_path())
+        if etag_matches(request, etag):
+            return not_modified(etag)
+        rehydrate_thread(thread)
+
+        compact = bool(request.query_params.get('compact'))
+        queryset = ChatMessage.objects.filter(thread=thread)
+        if compact:
+            queryset = queryset.only('message', 'response', 'timestamp', 'slug')
+
+        # Newest page first; pass the next cursor back as ?cursor= to load older messages
+        try:
+            messages, next_cursor = keyset_page(
+                queryset, 'timestamp', request.query_params.get('cursor'), get_page_size(request)
+            )
+        except ValueError as e:
+            return Response({'error': str(e)}, status=status.HTTP_400_BAD_REQUEST)
+        messages.reverse()
+        prefetch_references([thread], ['user'], known=[request.user])
+
+        if compact:
+            # Thread and user are the same for every row, send them once per page
+            return with_etag(Response({
+                "thread": ChatThreadSerializer(thread).data,
+                "user": UserSerializer(request.user).data,
+                "results": CompactChatMessageSerializer(messages, many=True).data,
+                "next_cursor": next_cursor,
+            }), etag)
+
+        # Every row points at this thread and user, so nested fields need no further queries
+        messages = prefetch_references(messages, ['thread', 'user'], known=[thread, request.user])
         serializer = ChatMessageSerializer(messages, many=True)
-        return Response(serializer.data)
+        response = Response(serializer.data)
+        if next_cursor:
+            response['X-Next-Cursor'] = next_cursor
+        return with_etag(response, etag)
         
 
+class ThreadDeleteAPIView(APIView):
+    permission_classes = [IsAuthenticated]
+
+    def delete(self, request, slug):
+        try:
+            thread = ChatThread.objects.only('id', 'user', 'message_count', 'archive_location').get(slug=slug, user=request.user)
+        except ChatThread.DoesNotExist:
+            return Response({'error': 'Thread not found.'}, status=status.HTTP_404_NOT_FOUND)
+        job = delete_thread(thread)
+        if job.status == 'done':
+            return Response(status=status.HTTP_204_NO_CONTENT)
+        return Response(job_progress(job), status=status.HTTP_202_ACCEPTED)
+
+
+class AccountDeleteAPIView(APIView):
+    permission_classes = [IsAuthenticated]
+
+    def delete(self, request):
+        job = delete_account(request.user)
+        # Poll the job by its key; the account can no longer authenticate
+        code = status.HTTP_200_OK if job.status == 'done' else status.HTTP_202_ACCEPTED
+        return Response(job_progress(job), status=code)
+
+
+class DeletionStatusView(APIView):
+    permission_classes = [AllowAny]
+
+    def get(self, request, key):
+        try:
+            job = DeletionJob.objects.get(key=key)
+        except DeletionJob.DoesNotExist:
+            return Response({'error': 'Deletion not found.'}, status=status.HTTP_404_NOT_FOUND)
+        return Response(job_progress(job), status=status.HTTP_200_OK)
+
+
 class ChatAPIView(APIView):
-    def __init__(self, **kwargs):
-        super().__init__(**kwargs)
-        self.client = Groq(api_key=os.environ.get("GROQ_API_KEY"))
+    throttle_classes = [ChatUsageThrottle]
 
     def post(self, request):
         user = request.user
@@ -91,91 +228,297 @@ class ChatAPIView(APIView):
             return Response({'error': 'Question is required.'}, status=status.HTTP_400_BAD_REQUEST)
 
         # Determine if a new thread needs to be created
-        new_thread_created = False
-        if not slug:
-            title = question[:30]  # Generate a title based on the first 30 characters of the question
-            existing_thread = ChatThread.objects.filter(title=title, user=user).first()
-
-            if existing_thread:
-                chat_thread = existing_thread
-                slug = chat_thread.slug
-            else:
-                chat_thread = ChatThread(title=title, user=user)
-                chat_thread.save()
-                slug = chat_thread.slug
-                new_thread_created = True  # Indicate a new thread was created
-        else:
-            try:
-                chat_thread = ChatThread.objects.get(slug=slug, user=user)
-            except ChatThread.DoesNotExist:
-                return Response({'error': 'ChatThread does not exist.'}, status=status.HTTP_404_NOT_FOUND)
-
-
         try:
-            settings = Settings.objects.get(user=user)
-           
-        except Settings.DoesNotExist:
-            settings = Settings.objects.create(user=user, model='llama3-8b-8192', customize_response="You are an intelligent assistant. Please provide informative and helpful responses.", max_tokens=200)
-        
+            chat_thread, new_thread_created = resolve_chat_thread(user, question, slug)
+        except ChatThread.DoesNotExist:
+            return Response({'error': 'ChatThread does not exist.'}, status=status.HTTP_404_NOT_FOUND)
+        slug = chat_thread.slug
+
+        settings = get_user_settings(user)
         model_choice = settings.model  
         system_message_content = settings.customize_response  
         max_tokens = settings.max_tokens  
+        with span('context'):
+            messages = build_chat_messages(chat_thread, question, system_message_content, model_choice, max_tokens, include_history=not new_thread_created)
+        cache_key, cached = lookup_cached_response(settings, messages, model_choice, max_tokens)
+
+        if request.data.get('stream'):
+            # Streamed over SSE; only served incrementally when running under backend.asgi
+            response = StreamingHttpResponse(
+                self.stream_chat_response(chat_thread, user, question, messages, model_choice, max_tokens, new_thread_created, cache_key, cached),
+                content_type='text/event-stream'
+            )
+            response['Cache-Control'] = 'no-cache'
+            response['X-Accel-Buffering'] = 'no'
+            return response
 
-        # Generate the chat response using settings
-        gorq_response = self.get_chat_response(question, model_choice, system_message_content, max_tokens)
+        # Generate the chat response using settings, unless an identical prompt was answered recently
+        if cached:
+            gorq_response = cached["response"]
+        else:
+            # Identical prompts already in flight share one upstream call
+            with span('llm'):
+                completion = chat_completions.do(
+                    response_cache_key(messages, model_choice, max_tokens),
+                    lambda: self.get_chat_response(messages, model_choice, max_tokens)
+                )
+            gorq_response = completion.content if completion else None
+            if completion:
+                limiter.record_completion(user.id, completion, messages)
+            store_cached_response(cache_key, gorq_response, model_choice)
         if not gorq_response:
-            return Response({'error': 'Failed to generate a valid response.'}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+            return Response({'error': 'Failed to generate a valid response.'}, status=status.HTTP_502_BAD_GATEWAY)
 
         # Save the question/response in the database
-        chat_message = ChatMessage(
-            thread=chat_thread,
-            user=user,
-            message=question,
-            response=gorq_response
-        )
-        chat_message.save()
+        chat_message = save_chat_message(chat_thread, user, question, gorq_response)
 
         # Return the serialized response with the new thread flag
         serializer = ChatMessageSerializer(chat_message)
         return Response({
             "data": serializer.data,
             "new_thread_created": new_thread_created,  
-            "thread_slug": slug  
+            "thread_slug": slug,
+            "cache": cache_metadata(cached)
         }, status=status.HTTP_201_CREATED)
 
-    def get_chat_response(self, question, model_choice, system_message_content, max_tokens):
-        system_message = {
-            "role": "system",
-            "content": system_message_content
-        }
+    async def stream_chat_response(self, chat_thread, user, question, messages, model_choice, max_tokens, new_thread_created, cache_key=None, cached=None):
+        yield sse_event({"new_thread_created": new_thread_created, "thread_slug": chat_thread.slug, "cache": cache_metadata(cached)}, event="thread")
+
+        chunks = []
         try:
-            chat_completion = self.client.chat.completions.create(
-                messages=[system_message, {"role": "user", "content": question}],
-                model=model_choice,  
-                max_tokens=max_tokens,  
-            )
-            response_content = chat_completion.choices[0].message.content
-            print("Groq Response:", response_content)
-            return response_content
+            if cached:
+                deltas = cached_stream(cached["response"])
+            else:
+                deltas = router.astream(
+                    messages, model_choice, max_tokens,
+                    on_complete=lambda completion: limiter.record_completion(user.id, completion, messages)
+                )
+            # aclosing: a disconnect while this generator is suspended at a yield closes the
+            # upstream stream now, not whenever the inner generator is garbage-collected
+            async with aclosing(deltas):
+                async for delta in deltas:
+                    chunks.append(delta)
+                    yield sse_event({"delta": delta})
+        except (asyncio.CancelledError, GeneratorExit):
+            # Client disconnected: the upstream stream has been closed, keep what was generated
+            if chunks:
+                await asyncio.shield(sync_to_async(save_chat_message)(chat_thread, user, question, "".join(chunks)))
+            raise
         except Exception as e:
+            print(f"Error streaming AI response: {str(e)}")
+            yield sse_event({"error": str(e)}, event="error")
+            return
+
+        if not cached:
+            await sync_to_async(store_cached_response)(cache_key, "".join(chunks), model_choice)
+        chat_message = await sync_to_async(save_chat_message)(chat_thread, user, question, "".join(chunks))
+        serializer = ChatMessageSerializer(chat_message)
+        yield sse_event(serializer.data, event="done")
+
+    def get_chat_response(self, messages, model_choice, max_tokens):
+        # Routed across the model and its fallback; None (rather than an error string) on failure
+        try:
+            return router.complete(messages, model_choice, max_tokens)
+        except AllModelsFailed as e:
+            print(f"Error generating AI response: {str(e)}")
+            return None
+
+
+@method_decorator(csrf_exempt, name='dispatch')
+class AsyncChatAPIView(View):
+    """Native async version of ChatAPIView.
+
+    Needs the ASGI app: the Groq round-trip is awaited on the shared pooled client instead
+    of holding a worker thread, so one process can keep many completions in flight.
+    """
+    authentication = MongoDBJWTAuthentication()
+
+    async def authenticate(self, request):
+        """Return ``(user, None)``, or ``(None, error_response)`` when the request is not authenticated."""
+        try:
+            auth = await sync_to_async(self.authentication.authenticate)(request)
+        except AuthenticationFailed as e:
+            return None, JsonResponse({'detail': str(e.detail)}, status=status.HTTP_401_UNAUTHORIZED)
+        if auth is None:
+            return None, JsonResponse({'detail': 'Authentication credentials were not provided.'}, status=status.HTTP_401_UNAUTHORIZED)
+        return auth[0], None
+
+    async def post(self, request):
+        user, error = await self.authenticate(request)
+        if error is not None:
+            return error
+
+        try:
+            data = json.loads(request.body or b'{}')
+        except ValueError:
+            return JsonResponse({'error': 'Invalid JSON body.'}, status=status.HTTP_400_BAD_REQUEST)
+        question = data.get('question')
+        if not question:
+            return JsonResponse({'error': 'Question is required.'}, status=status.HTTP_400_BAD_REQUEST)
+
+        try:
+            chat_thread, new_thread_created = await sync_to_async(resolve_chat_thread)(user, question, data.get('slug'))
+        except ChatThread.DoesNotExist:
+            return JsonResponse({'error': 'ChatThread does not exist.'}, status=status.HTTP_404_NOT_FOUND)
+        settings = await sync_to_async(get_user_settings)(user)
+        try:
+            await sync_to_async(limiter.check)(user.id, settings.model)
+        except RateLimited as e:
+            response = JsonResponse({'detail': e.detail}, status=status.HTTP_429_TOO_MANY_REQUESTS)
+            response['Retry-After'] = str(e.retry_after)
+            return response
+        with span('context'):
+            messages = await sync_to_async(build_chat_messages)(
+                chat_thread, question, settings.customize_response, settings.model, settings.max_tokens,
+                include_history=not new_thread_created
+            )
+        cache_key, cached = await sync_to_async(lookup_cached_response)(settings, messages, settings.model, settings.max_tokens)
+
+        if cached:
+            gorq_response = cached["response"]
+        else:
+            with span('llm'):
+                completion = await chat_completions.ado(
+                    response_cache_key(messages, settings.model, settings.max_tokens),
+                    lambda: self.get_chat_response(messages, settings.model, settings.max_tokens)
+                )
+            gorq_response = completion.content if completion else None
+            if completion:
+                limiter.record_completion(user.id, completion, messages)
+            await sync_to_async(store_cached_response)(cache_key, gorq_response, settings.model)
+        if not gorq_response:
+            return JsonResponse({'error': 'Failed to generate a valid response.'}, status=status.HTTP_502_BAD_GATEWAY)
+
+        chat_message = await sync_to_async(save_chat_message)(chat_thread, user, question, gorq_response)
+        serializer = ChatMessageSerializer(chat_message)
+        return JsonResponse({
+            "data": serializer.data,
+            "new_thread_created": new_thread_created,
+            "thread_slug": chat_thread.slug,
+            "cache": cache_metadata(cached)
+        }, status=status.HTTP_201_CREATED)
+
+    async def get_chat_response(self, messages, model_choice, max_tokens):
+        try:
+            return await router.acomplete(messages, model_choice, max_tokens)
+        except AllModelsFailed as e:
             print(f"Error generating AI response: {str(e)}")
-            return f"Error: {str(e)}"
+            return None
+
+
+class BatchChatAPIView(AsyncChatAPIView):
+    """Answer up to ``BATCH_MAX_ITEMS`` questions concurrently (see core.batch).
+
+    Body: ``{"items": [{"question": "...", "slug"?: "...", "model"?: "..."}, ...]}``. The
+    response lists one result per item, in order, with ``ok`` and either ``data`` or ``error``.
+    """
+
+    async def post(self, request):
+        user, error = await self.authenticate(request)
+        if error is not None:
+            return error
+        try:
+            items = parse_items(json.loads(request.body or b'{}'))
+        except ValueError as e:
+            return JsonResponse({'error': str(e)}, status=status.HTTP_400_BAD_REQUEST)
+
+        try:
+            results = await run_batch(user, items)
+        except RateLimited as e:
+            response = JsonResponse({'detail': e.detail}, status=status.HTTP_429_TOO_MANY_REQUESTS)
+            response['Retry-After'] = str(e.retry_after)
+            return response
+        succeeded = sum(1 for result in results if result['ok'])
+        return JsonResponse({
+            "results": results,
+            "succeeded": succeeded,
+            "failed": len(results) - succeeded,
+        }, status=status.HTTP_200_OK)
+
+
+class SearchAPIView(APIView):
+    permission_classes = [IsAuthenticated]
+
+    def get(self, request):
+        query = request.query_params.get('q', '')
+        if not query.strip():
+            return Response({'error': 'Query is required.'}, status=status.HTTP_400_BAD_REQUEST)
+        try:
+            threads, results, next_cursor = search_history(
+                request.user, query, request.query_params.get('cursor'), get_page_size(request)
+            )
+        except ValueError as e:
+            return Response({'error': str(e)}, status=status.HTTP_400_BAD_REQUEST)
+        return Response({
+            "threads": threads,
+            "results": results,
+            "next_cursor": next_cursor,
+        })
+
+
+class ExportAPIView(APIView):
+    permission_classes = [IsAuthenticated]
+    content_types = {'gzip': 'application/gzip', 'zstd': 'application/zstd', 'none': 'application/x-ndjson'}
+    extensions = {'gzip': '.ndjson.gz', 'zstd': '.ndjson.zst', 'none': '.ndjson'}
+
+    def get(self, request):
+        compression = request.query_params.get('compression', settings.EXPORT_COMPRESSION)
+        if compression not in COMPRESSIONS:
+            return Response({'error': f"compression must be one of: {', '.join(COMPRESSIONS)}."}, status=status.HTTP_400_BAD_REQUEST)
+        try:
+            chunks = compress(iter_export_lines([request.user]), compression)
+            first = next(chunks, b"")  # surfaces a missing zstd package before the response starts
+        except ValueError as e:
+            return Response({'error': str(e)}, status=status.HTTP_400_BAD_REQUEST)
+
+        def stream():
+            yield first
+            yield from chunks
+
+        response = StreamingHttpResponse(stream(), content_type=self.content_types[compression])
+        response['Content-Disposition'] = f'attachment; filename="{request.user.username}{self.extensions[compression]}"'
+        return response
 
 
 class SettingsUpdateView(generics.RetrieveUpdateAPIView):
-    queryset = Settings.objects.all()
     serializer_class = SettingsSerializer
     permission_classes = [IsAuthenticated]
 
+    def get_queryset(self):
+        return Settings.objects.all()
+
     def get_object(self):
 
         try:
-            return self.queryset.get(user=self.request.user)
+            return self.get_queryset().get(user=self.request.user)
         except Settings.DoesNotExist:
             return Settings.objects.create(user=self.request.user)
 
 
 class ModelChoicesView(APIView):
+    # Static for the life of a deployment, so browsers and proxies may keep it for a day
+    etag = make_etag(*(value for choice in Settings.model_choices for value in choice))
+
     def get(self, request):
-        model_choices = [{"value": choice[0], "label": choice[1]} for choice in Settings.model_choices]
-        return Response(model_choices, status=status.HTTP_200_OK)
+        if etag_matches(request, self.etag):
+            response = not_modified(self.etag)
+        else:
+            model_choices = [{"value": choice[0], "label": choice[1]} for choice in Settings.model_choices]
+            response = Response(model_choices, status=status.HTTP_200_OK)
+            response['ETag'] = self.etag
+        response['Cache-Control'] = 'public, max-age=86400'
+        return response
+
+
+class UsageSummaryView(APIView):
+    permission_classes = [IsAuthenticated]
+
+    def get(self, request):
+        return Response(limiter.summary(request.user.id), status=status.HTTP_200_OK)
+
+
+def metrics_view(request):
+    """Prometheus scrape endpoint; requires ``Authorization: Bearer <METRICS_TOKEN>`` when that is set."""
+    if settings.METRICS_TOKEN and request.headers.get('Authorization') != f"Bearer {settings.METRICS_TOKEN}":
+        return HttpResponse(status=status.HTTP_401_UNAUTHORIZED)
+    return HttpResponse(render_metrics(), content_type='text/plain; version=0.0.4; charset=utf-8')
@@ -0,0 +1,294 @@
+"""WebSocket chat channel (``/ws/chat/``), served by ``backend.asgi`` next to the Django app.
+
+A client authenticates once, with ``?token=<access token>`` or a first ``auth`` message, and
+then keeps the connection for any number of chat turns. The connection caches the user, the
+bound thread and the user's Settings, so a turn only touches Mongo for the history, the saved
+message and the usage/limit bookkeeping. Cached state is reloaded after ``WS_STATE_TTL``
+seconds.
+
+Client messages (JSON text frames)::
+
+    {"type": "auth", "token": "..."}
+    {"type": "bind", "slug": "..."}                  -> {"type": "bound", "thread": {...}}
+    {"type": "chat", "question": "...", "slug"?: ""}  -> start, delta..., done
+    {"type": "ping"}                                  -> {"type": "pong"}
+
+Once a message is saved, every connection of the same user in this process receives a
+``{"type": "thread", "thread": {...}}`` update. An idle connection is only a suspended
+coroutine, so a process can hold many thousands of them, up to ``WS_MAX_CONNECTIONS``.
+"""
+import asyncio
+import json
+import time
+from contextlib import aclosing
+from urllib.parse import parse_qs
+from functools import partial
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from rest_framework.exceptions import AuthenticationFailed
+from rest_framework_simplejwt.exceptions import InvalidToken, TokenError
+from core.archive import rehydrate_thread
+from core.chat import resolve_chat_thread, get_user_settings, save_chat_message
+from core.context import build_chat_messages
+from core.custom_auth_backend import MongoDBJWTAuthentication
+from core.models import ChatThread, PREVIEW_LENGTH
+from core.quotas import limiter, RateLimited
+from core.response_cache import lookup_cached_response, store_cached_response, cache_metadata
+from core.routing import router
+from core.serializers import ChatThreadSerializer, ChatMessageSerializer, prefetch_references
+
+PATH = '/ws/chat/'
+CLOSE_UNAUTHORIZED = 4401
+CLOSE_TRY_AGAIN_LATER = 1013
+
+# Outside Django's request handler, thread-sensitive calls would all share one thread;
+# the mongoengine calls made here are thread-safe, so use the default pool instead
+run_sync = partial(sync_to_async, thread_sensitive=False)
+
+
+class ConnectionRegistry:
+    """Open connections per user, for capacity limits and thread update fan-out."""
+
+    def __init__(self):
+        self._users = {}
+        self.count = 0
+
+    def add(self, connection):
+        self._users.setdefault(connection.user.id, set()).add(connection)
+
+    def remove(self, connection):
+        if connection.user is not None:
+            connections = self._users.get(connection.user.id, set())
+            connections.discard(connection)
+            if not connections:
+                self._users.pop(connection.user.id, None)
+
+    def for_user(self, user_id):
+        return list(self._users.get(user_id, ()))
+
+    def stats(self):
+        return {"connections": self.count, "users": len(self._users)}
+
+
+registry = ConnectionRegistry()
+
+
+def _thread_data(thread):
+    return json.loads(json.dumps(ChatThreadSerializer(thread).data, default=str))
+
+
+class ChatConnection:
+    authentication = MongoDBJWTAuthentication()
+
+    def __init__(self, scope, receive, send):
+        self.scope = scope
+        self.receive = receive
+        self._send = send
+        self.user = None
+        self.thread = None
+        self.thread_loaded = 0
+        self.settings = None
+        self.settings_loaded = 0
+        self.turn = None
+
+    async def send(self, payload):
+        await self._send({'type': 'websocket.send', 'text': json.dumps(payload, default=str)})
+
+    async def close(self, code=1000):
+        await self._send({'type': 'websocket.close', 'code': code})
+
+    async def run(self):
+        event = await self.receive()
+        if event['type'] != 'websocket.connect':
+            return
+        if registry.count >= settings.WS_MAX_CONNECTIONS:
+            return await self.close(CLOSE_TRY_AGAIN_LATER)
+        await self._send({'type': 'websocket.accept'})
+        registry.count += 1
+        try:
+            token = parse_qs(self.scope.get('query_string', b'').decode()).get('token', [None])[0]
+            if token is None:
+                token = await self._wait_for_auth_message()
+            if token is None or not await self.authenticate(token):
+                return await self.close(CLOSE_UNAUTHORIZED)
+            registry.add(self)
+            await self.send({"type": "ready", "user": self.user.username})
+            await self._loop()
+        finally:
+            registry.count -= 1
+            registry.remove(self)
+            if self.turn is not None and not self.turn.done():
+                self.turn.cancel()
+
+    async def _wait_for_auth_message(self):
+        try:
+            event = await asyncio.wait_for(self.receive(), settings.WS_AUTH_TIMEOUT)
+        except asyncio.TimeoutError:
+            return None
+        if event['type'] != 'websocket.receive':
+            return None
+        try:
+            data = json.loads(event.get('text') or '{}')
+        except ValueError:
+            return None
+        return data.get('token') if data.get('type') == 'auth' else None
+
+    async def authenticate(self, token):
+        def verify():
+            validated = self.authentication.get_validated_token(token)
+            return self.authentication.get_user(validated)
+        try:
+            self.user = await run_sync(verify)()
+        except (AuthenticationFailed, InvalidToken, TokenError):
+            return False
+        return True
+
+    async def _loop(self):
+        while True:
+            event = await self.receive()
+            if event['type'] == 'websocket.disconnect':
+                return
+            if event['type'] != 'websocket.receive':
+                continue
+            try:
+                data = json.loads(event.get('text') or '{}')
+            except ValueError:
+                await self.send({"type": "error", "error": "Invalid JSON."})
+                continue
+            await self.handle(data)
+
+    async def handle(self, data):
+        kind = data.get('type')
+        if kind == 'ping':
+            await self.send({"type": "pong"})
+        elif kind == 'bind':
+            if await self.bind(data.get('slug')):
+                await self.send({"type": "bound", "thread": _thread_data(self.thread)})
+        elif kind == 'chat':
+            question = data.get('question')
+            if not question:
+                await self.send({"type": "error", "error": "Question is required."})
+            elif self.turn is not None and not self.turn.done():
+                await self.send({"type": "error", "error": "A response is still streaming on this connection."})
+            else:
+                # Run the turn as a task so pings and disconnects are still read while it streams
+                self.turn = asyncio.create_task(self._run_turn(question, data.get('slug')))
+        else:
+            await self.send({"type": "error", "error": f"Unknown message type: {kind!r}."})
+
+    async def _run_turn(self, question, slug):
+        try:
+            await self.chat(question, slug)
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            print(f"Error in WebSocket chat turn: {str(e)}")
+            await self.send({"type": "error", "error": "Failed to generate a valid response."})
+
+    async def bind(self, slug):
+        def load():
+            thread = rehydrate_thread(ChatThread.objects.get(slug=slug, user=self.user))
+            prefetch_references([thread], ['user'], known=[self.user])
+            return thread
+        try:
+            self.thread = await run_sync(load)()
+        except ChatThread.DoesNotExist:
+            await self.send({"type": "error", "error": "ChatThread does not exist."})
+            return False
+        self.thread_loaded = time.monotonic()
+        return True
+
+    async def get_settings(self):
+        if self.settings is None or time.monotonic() - self.settings_loaded > settings.WS_STATE_TTL:
+            self.settings = await run_sync(get_user_settings)(self.user)
+            self.settings_loaded = time.monotonic()
+        return self.settings
+
+    async def chat(self, question, slug=None):
+        new_thread_created = False
+        if slug and (self.thread is None or self.thread.slug != slug or time.monotonic() - self.thread_loaded > settings.WS_STATE_TTL):
+            if not await self.bind(slug):
+                return
+        elif self.thread is not None and time.monotonic() - self.thread_loaded > settings.WS_STATE_TTL:
+            # Pick up the summary refreshed in the background since the thread was cached
+            if not await self.bind(self.thread.slug):
+                return
+        elif self.thread is None:
+            self.thread, new_thread_created = await run_sync(resolve_chat_thread)(self.user, question)
+            self.thread_loaded = time.monotonic()
+
+        user, chat_thread = self.user, self.thread
+        user_settings = await self.get_settings()
+        model_choice, max_tokens = user_settings.model, user_settings.max_tokens
+        try:
+            await run_sync(limiter.check)(user.id, model_choice)
+        except RateLimited as e:
+            return await self.send({"type": "error", "error": e.detail, "retry_after": e.retry_after})
+
+        messages = await run_sync(build_chat_messages)(
+            chat_thread, question, user_settings.customize_response, model_choice, max_tokens,
+            include_history=not new_thread_created
+        )
+        cache_key, cached = await run_sync(lookup_cached_response)(user_settings, messages, model_choice, max_tokens)
+        await self.send({
+            "type": "start",
+            "thread_slug": chat_thread.slug,
+            "new_thread_created": new_thread_created,
+            "cache": cache_metadata(cached),
+        })
+
+        chunks = []
+        try:
+            if cached:
+                chunks.append(cached["response"])
+                await self.send({"type": "delta", "text": cached["response"]})
+            else:
+                deltas = router.astream(
+                    messages, model_choice, max_tokens,
+                    on_complete=lambda completion: limiter.record_completion(user.id, completion, messages)
+                )
+                # Close the upstream stream as soon as the turn is cancelled
+                async with aclosing(deltas):
+                    async for delta in deltas:
+                        chunks.append(delta)
+                        await self.send({"type": "delta", "text": delta})
+        except asyncio.CancelledError:
+            # Client disconnected: keep what was generated, as the SSE stream does
+            if chunks:
+                await asyncio.shield(run_sync(save_chat_message)(chat_thread, user, question, "".join(chunks)))
+            raise
+        except Exception as e:
+            print(f"Error streaming AI response: {str(e)}")
+            return await self.send({"type": "error", "error": str(e)})
+
+        if not cached:
+            await run_sync(store_cached_response)(cache_key, "".join(chunks), model_choice)
+        chat_message = await run_sync(save_chat_message)(chat_thread, user, question, "".join(chunks))
+        await self.send({"type": "done", "message": json.loads(json.dumps(ChatMessageSerializer(chat_message).data, default=str))})
+
+        # Keep the cached thread in step with the counters save_chat_message just bumped
+        chat_thread.message_count = (chat_thread.message_count or 0) + 1
+        chat_thread.last_message_at = chat_message.timestamp
+        chat_thread.last_message_preview = chat_message.message[:PREVIEW_LENGTH]
+        await publish_thread_update(user.id, chat_thread)
+
+
+async def publish_thread_update(user_id, chat_thread):
+    """Push a thread's new state to every connection of its owner in this process."""
+    payload = {"type": "thread", "thread": _thread_data(chat_thread)}
+    for connection in registry.for_user(user_id):
+        if connection.thread is not None and connection.thread.id == chat_thread.id and connection.thread is not chat_thread:
+            connection.thread.message_count = chat_thread.message_count
+            connection.thread.last_message_at = chat_thread.last_message_at
+            connection.thread.last_message_preview = chat_thread.last_message_preview
+        try:
+            await connection.send(payload)
+        except Exception:
+            pass  # the connection is closing; its own loop cleans up
+
+
+async def websocket_application(scope, receive, send):
+    if scope['path'].rstrip('/') + '/' != PATH:
+        await receive()
+        return await send({'type': 'websocket.close', 'code': 4404})
+    await ChatConnection(scope, receive, send).run()
@@ -0,0 +1,135 @@
+"""Write-behind persistence for chat messages (``CHAT_WRITE_MODE = 'async'``).
+
+Completed exchanges are queued in memory and a background thread writes them with one
+``insert_many`` plus one bulk update of the thread counters per batch, so the chat response
+no longer waits on Mongo. The trade-off is durability: messages still queued are lost if the
+process is killed without running its exit handlers. When the queue is full, callers wait up
+to ``CHAT_WRITE_ENQUEUE_TIMEOUT`` and then fall back to writing synchronously.
+"""
+import atexit
+import queue
+import threading
+from bson import ObjectId
+from django.conf import settings
+from pymongo import UpdateOne
+from pymongo.errors import BulkWriteError
+from core.models import ChatThread, ChatMessage, PREVIEW_LENGTH
+from core.summaries import maybe_schedule_summary
+from core.versions import bump_user_versions
+
+
+def prepare_chat_message(chat_message):
+    """Assign the id and slug ``save`` would, and validate, ahead of a bulk insert."""
+    if chat_message.id is None:
+        chat_message.id = ObjectId()
+    if chat_message.message and not chat_message.slug:
+        chat_message.slug = chat_message._generate_slug()
+    chat_message.validate()
+    return chat_message
+
+
+def persist_chat_messages(batch):
+    """Write ``(chat_message, chat_thread)`` pairs with one ``insert_many`` and one bulk counter update.
+
+    Returns the positions in ``batch`` of the messages that could not be written.
+    """
+    failed = set()
+    try:
+        ChatMessage._get_collection().insert_many([message.to_mongo() for message, _ in batch], ordered=False)
+    except BulkWriteError as e:
+        errors = e.details.get('writeErrors', [])
+        failed = {error['index'] for error in errors}
+        print(f"Error writing {len(failed)} chat messages: {errors[:3]}")
+
+    # One counter update per thread, however many of its messages are in the batch
+    activity = {}
+    for i, (message, chat_thread) in enumerate(batch):
+        if i in failed:
+            continue
+        count, _, _ = activity.get(chat_thread.id, (0, None, None))
+        activity[chat_thread.id] = (count + 1, message, chat_thread)
+    if not activity:
+        return failed
+    ChatThread._get_collection().bulk_write([
+        UpdateOne({'_id': thread_id}, {
+            '$inc': {'message_count': count},
+            '$max': {'last_message_at': message.timestamp},
+            '$set': {'last_message_preview': message.message[:PREVIEW_LENGTH]},
+        })
+        for thread_id, (count, message, _) in activity.items()
+    ], ordered=False)
+    bump_user_versions(message.user.id for message, _ in batch)
+
+    for _, _, chat_thread in activity.values():
+        maybe_schedule_summary(chat_thread)
+    return failed
+
+
+class ChatMessageWriter:
+    def __init__(self):
+        self._queue = None
+        self._thread = None
+        self._lock = threading.Lock()
+        self.written = 0
+        self.failed = 0
+        self.fallbacks = 0
+
+    def _start(self):
+        with self._lock:
+            if self._thread is None:
+                self._queue = queue.Queue(maxsize=settings.CHAT_WRITE_QUEUE_SIZE)
+                self._thread = threading.Thread(target=self._run, daemon=True, name='chat-write-behind')
+                self._thread.start()
+                atexit.register(self.flush)
+
+    def submit(self, chat_message, chat_thread):
+        """Queue ``chat_message`` for writing; returns False if the queue stayed full.
+
+        The id and slug are assigned here so the message can be serialized right away.
+        """
+        self._start()
+        prepare_chat_message(chat_message)
+        try:
+            self._queue.put((chat_message, chat_thread), timeout=settings.CHAT_WRITE_ENQUEUE_TIMEOUT)
+        except queue.Full:
+            self.fallbacks += 1
+            return False
+        return True
+
+    def flush(self):
+        """Block until everything queued so far has been written."""
+        if self._queue is not None:
+            self._queue.join()
+
+    def _run(self):
+        while True:
+            batch = [self._queue.get()]
+            while len(batch) < settings.CHAT_WRITE_BATCH_SIZE:
+                try:
+                    batch.append(self._queue.get(timeout=settings.CHAT_WRITE_FLUSH_INTERVAL))
+                except queue.Empty:
+                    break
+            try:
+                self._write(batch)
+            except Exception as e:
+                self.failed += len(batch)
+                print(f"Error writing chat messages: {str(e)}")
+            finally:
+                for _ in batch:
+                    self._queue.task_done()
+
+    def _write(self, batch):
+        failed = persist_chat_messages(batch)
+        self.written += len(batch) - len(failed)
+        self.failed += len(failed)
+
+    def stats(self):
+        return {
+            "queued": self._queue.qsize() if self._queue is not None else 0,
+            "written": self.written,
+            "failed": self.failed,
+            "fallbacks": self.fallbacks,
+        }
+
+
+message_writer = ChatMessageWriter()
@@ -25,6 +25,9 @@ const ChatApp: React.FC = () => {
   );
   const [messages, setMessages] = useState<Message[]>([]);
   const [newMessage, setNewMessage] = useState<string>("");
+  // Cursors for the next (older) page; the API sends them in the X-Next-Cursor header
+  const [threadsCursor, setThreadsCursor] = useState<string | null>(null);
+  const [messagesCursor, setMessagesCursor] = useState<string | null>(null);
 
   const accessToken = Cookies.get("access_token");
   const router = useRouter();
@@ -44,20 +47,28 @@ const ChatApp: React.FC = () => {
     }
   }, [currentThreadSlug]);
 
-  const fetchThreads = async () => {
+  const fetchThreads = async (cursor: string | null = null) => {
     try {
       const response = await axios.get("http://127.0.0.1:8000/api/threads/", {
         headers: {
           Authorization: `Bearer ${accessToken}`,
         },
+        params: cursor ? { cursor } : {},
       });
-      setThreads(response.data);
+      // Without a cursor this is the first page; otherwise append the older threads
+      setThreads((prevThreads) =>
+        cursor ? [...prevThreads, ...response.data] : response.data
+      );
+      setThreadsCursor(response.headers["x-next-cursor"] || null);
     } catch (error) {
       console.error("Error fetching threads:", error);
     }
   };
 
-  const fetchMessages = async (threadSlug: string) => {
+  const fetchMessages = async (
+    threadSlug: string,
+    cursor: string | null = null
+  ) => {
     try {
       const response = await axios.get(
         `http://127.0.0.1:8000/api/threads/${threadSlug}/messages/`,
@@ -65,14 +76,18 @@ const ChatApp: React.FC = () => {
           headers: {
             Authorization: `Bearer ${accessToken}`,
           },
+          params: cursor ? { cursor } : {},
         }
       );
-      setMessages(
-        response.data.flatMap((msg: any) => [
-          { sender: "User", text: msg.message },
-          { sender: "Assistant", text: msg.response },
-        ])
+      const page: Message[] = response.data.flatMap((msg: any) => [
+        { sender: "User", text: msg.message },
+        { sender: "Assistant", text: msg.response },
+      ]);
+      // Pages come newest first, each in chronological order; older pages go on top
+      setMessages((prevMessages) =>
+        cursor ? [...page, ...prevMessages] : page
       );
+      setMessagesCursor(response.headers["x-next-cursor"] || null);
     } catch (error) {
       console.error("Error fetching messages:", error);
     }
@@ -84,6 +99,7 @@ const ChatApp: React.FC = () => {
       localStorage.setItem("lastThreadSlug", slug);
     }
     setMessages([]);
+    setMessagesCursor(null);
   };
 
   const handleSend = async () => {
@@ -132,6 +148,7 @@ const ChatApp: React.FC = () => {
     localStorage.removeItem("lastThreadSlug");
     setCurrentThreadSlug(null);
     setMessages([]);
+    setMessagesCursor(null);
     setNewMessage("");
   };
 
@@ -167,6 +184,14 @@ const ChatApp: React.FC = () => {
               </div>
             ))
           )}
+          {threadsCursor && (
+            <button
+              onClick={() => fetchThreads(threadsCursor)}
+              className="w-full p-2 text-sm text-gray-600 hover:text-gray-900"
+            >
+              Load more threads
+            </button>
+          )}
         </div>
         <div className="mt-6">
           <button
@@ -188,6 +213,14 @@ const ChatApp: React.FC = () => {
         )}
         <div className="flex flex-col w-2/4 mx-auto overflow-hidden">
           <div className="flex-grow bg-white rounded-lg p-4 overflow-y-scroll scrollbar-hidden">
+            {currentThreadSlug && messagesCursor && (
+              <button
+                onClick={() => fetchMessages(currentThreadSlug, messagesCursor)}
+                className="w-full mb-4 p-2 text-sm text-gray-600 hover:text-gray-900"
+              >
+                Load older messages
+              </button>
+            )}
             {messages.map((msg, index) => (
               <div
                 key={index} // Ideally, use a unique id for each message